@@ -21,3 +21,7 @@ from .immunity      import * # Depends on utils, parameters, defaults
 from .analysis      import * # Depends on utils, misc, interventions
 from .sim           import * # Depends on almost everything
 from .run           import * # Depends on sim
+
+# Optionally report which Numba functions were loaded from the cache
+if settings.options.numba_report:
+    utils.cache_report()
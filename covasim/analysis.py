@@ -4,7 +4,6 @@ but which are useful for particular investigations.
 '''
 
 import numpy as np
-import pylab as pl
 import pandas as pd
 import sciris as sc
 from . import utils as cvu
@@ -12,6 +11,7 @@ from . import misc as cvm
 from . import interventions as cvi
 from . import settings as cvset
 from . import plotting as cvpl
+pl = cvset.lazy_import('pylab') # Only imported when first used if running headless
 
 
 __all__ = ['Analyzer', 'snapshot', 'age_histogram', 'daily_age_stats', 'daily_stats', 'Fit', 'TransTree']
@@ -654,8 +654,8 @@ class daily_stats(Analyzer):
 
             # Source stats
             inflog = sim.people.infection_log
-            infloginds = [i for i,e in enumerate(inflog) if (e['date']==sim.t and e['source'] is not None)] # Person was infected today and was not a seed infection
-            sourceinds = list(set([inflog[i]['source'] for i in infloginds]))
+            infloginds = cvu.true((inflog.date == sim.t) & (inflog.source >= 0)) # Person was infected today and was not a seed infection
+            sourceinds = np.unique(inflog.source[infloginds])
             stats.source.new_sources = len(sourceinds)
             for key in self.keys:
                 stats.source[key] = len(self.intersect(sourceinds, key))
@@ -694,8 +694,8 @@ class daily_stats(Analyzer):
             stats.extra.per_presymp = stats.extra.presymp*per_factor
             stats.extra.per_asymp   = stats.extra.asymp*per_factor
             stats.layer_counts = {k:0 for k in sim.layer_keys()}
-            for i in infloginds:
-                stats.layer_counts[inflog[i]['layer']] += 1
+            for lkey in inflog.layer[infloginds]:
+                stats.layer_counts[lkey] += 1
 
             # Calculate extras for quarantine testing
             t_inds = newtests # Everyone who tested this timestep
@@ -1278,11 +1278,9 @@ class TransTree(Analyzer):
         self.source_dates = [None for i in range(self.pop_size)]
         self.target_dates = [[]   for i in range(self.pop_size)]
 
-        for entry in self.infection_log:
-            source = entry['source']
-            target = entry['target']
-            date   = entry['date']
-            if source:
+        log = self.infection_log
+        for source, target, date in zip(log.source.tolist(), log.target.tolist(), log.date.tolist()):
+            if source >= 0:
                 self.sources[target] = source # Each target has at most one source
                 self.targets[source].append(target) # Each source can have multiple targets
                 self.source_dates[target] = date # Each target has at most one source
@@ -1303,10 +1301,11 @@ class TransTree(Analyzer):
             self.graph = nx.DiGraph()
 
             # Add the nodes
+            arrs = {attr:cvu.to_float(people[attr]) for attr in attrs} # Undefined dates are NaN, even if stored as integers
             for i in range(len(people)):
                 d = {}
                 for attr in attrs:
-                    d[attr] = people[attr][i]
+                    d[attr] = arrs[attr][i]
                 self.graph.add_node(i, **d)
 
             # Next, add edges from linelist
@@ -1371,16 +1370,11 @@ class TransTree(Analyzer):
 
         This excludes edges corresponding to seeded infections without a source
         """
-        source_inds = []
-        target_inds = []
-        transmissions = []
-        for d in self.infection_log:
-            if d['source'] is not None:
-                src = d['source']
-                trg = d['target']
-                source_inds.append(src)
-                target_inds.append(trg)
-                transmissions.append([src, trg])
+        log = self.infection_log
+        has_source = log.source >= 0
+        source_inds = log.source[has_source].tolist()
+        target_inds = log.target[has_source].tolist()
+        transmissions = [[src, trg] for src,trg in zip(source_inds, target_inds)]
         self.transmissions = transmissions
         self.source_inds = source_inds
         self.target_inds = target_inds
@@ -1390,15 +1384,9 @@ class TransTree(Analyzer):
     def make_detailed(self, people, reset=False):
         ''' Construct a detailed transmission tree, with additional information for each person '''
 
-        def df_to_arrdict(df):
-            ''' Convert a dataframe to a dictionary of arrays '''
-            arrdict = dict()
-            for col in df.columns:
-                arrdict[col] = df[col].values
-            return arrdict
-
-        # Convert infection log to a dataframe and from there to a dict of arrays
-        inflog = df_to_arrdict(sc.dcp(pd.DataFrame(self.infection_log)))
+        # Pull out the columns of the infection log
+        log = self.infection_log
+        inflog = dict(source=np.where(log.source >= 0, log.source, np.nan), target=log.target, date=log.date, layer=log.layer)
 
         # Initialization
         n_people = len(people)
@@ -1438,8 +1426,8 @@ class TransTree(Analyzer):
 
         # Populate from people
         for attr in attrs+quar_attrs:
-            dd[trg+attr] = people[attr][:]
-            dd[src+attr][vi] = people[attr][vs_inds]
+            dd[trg+attr] = cvu.to_float(people[attr])[:] # Undefined dates are NaN, even if stored as integers
+            dd[src+attr][vi] = dd[trg+attr][vs_inds]
 
         # Pull out valid indices for source and target
         lnot = np.logical_not # Shorten since used heavily
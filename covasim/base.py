@@ -15,7 +15,7 @@ from . import defaults as cvd
 from . import parameters as cvpar
 
 # Specify all externally visible classes this file defines
-__all__ = ['ParsObj', 'Result', 'BaseSim', 'BasePeople', 'Person', 'FlexDict', 'Contacts', 'Layer']
+__all__ = ['ParsObj', 'Result', 'BaseSim', 'BasePeople', 'Person', 'FlexDict', 'Contacts', 'Layer', 'MassActionLayer', 'CliqueLayer', 'CompactLayer', 'BitArray']
 
 
 #%% Define simulation classes
@@ -825,6 +825,196 @@ class BaseSim(ParsObj):
 
 #%% Define people classes
 
+class BitArray:
+    '''
+    A boolean array (e.g. a health state such as people.infectious) stored as bits
+    rather than bytes, so it takes 8 times less memory. Along the last axis (i.e.
+    people), person i is stored in bit i%64 of word i//64; any leading axes (e.g.
+    strains) are stored as rows of words. Used for people's states if
+    cv.options.packed_states is set.
+
+    Getting and setting values for arrays of indices (e.g. ``arr[inds] = True``)
+    and finding and counting the people who are true (e.g. cv.true(arr) or arr.sum())
+    use compiled kernels that work on the bits directly. Indexing with an integer
+    along a leading axis (e.g. ``arr[strain]``) returns a view, as for NumPy. Other
+    operations convert to a regular boolean array first, either explicitly via
+    ``np.asarray(arr)`` or automatically, e.g. ``np.logical_and(arr, other)``.
+
+    Args:
+        arr (array): the boolean array to pack
+        shape (tuple): if arr is None, the shape of an all-false array to create
+        words (array): if supplied, the packed words to use (not copied), with the shape given by shape
+
+    **Example**::
+
+        arr = cv.BitArray(np.array([True, False, True]))
+        arr[[1,2]] = [True, False]
+        assert arr.sum() == 2 and np.array_equal(arr, [True, True, False])
+    '''
+
+    dtype = np.dtype(bool)
+
+    def __init__(self, arr=None, shape=None, words=None):
+        if words is not None:
+            self.shape = tuple(shape)
+            self.words = words
+        elif arr is not None:
+            arr = np.asarray(arr, dtype=bool)
+            self.shape = arr.shape
+            self.words = cvu.pack_bits(arr.reshape(-1, self.shape[-1])).reshape(self.shape[:-1] + (-1,))
+        else:
+            self.shape = tuple(sc.promotetolist(shape))
+            self.words = np.zeros(self.shape[:-1] + ((self.shape[-1] + cvu.word_bits - 1)//cvu.word_bits,), dtype=np.uint64)
+        return
+
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'BitArray({np.asarray(self)!r})'
+
+    def _rows(self):
+        ''' The words as a 2D array of rows (a view unless the words aren't contiguous) '''
+        return self.words.reshape(-1, self.words.shape[-1])
+
+    def __array__(self, dtype=None, copy=None):
+        arr = cvu.unpack_bits(self._rows(), self.shape[-1]).reshape(self.shape)
+        return arr if dtype is None else arr.astype(dtype)
+
+    def _split_key(self, key):
+        '''
+        Split the key into an integer along the first axis (None for all rows) and
+        the key along the last axis (people); or (False, None) if it can't be handled
+        without unpacking
+        '''
+        if not isinstance(key, tuple):
+            if self.ndim == 1:
+                return None, key
+            elif isinstance(key, (int, np.integer)):
+                return key, slice(None)
+        elif len(key) == 2:
+            if key[0] is Ellipsis or (self.ndim == 2 and isinstance(key[0], slice) and key[0] == slice(None)):
+                return None, key[1]
+            elif self.ndim == 2 and isinstance(key[0], (int, np.integer)):
+                return key[0], key[1]
+        return False, None
+
+    def _person_inds(self, key):
+        ''' Convert the key along the last axis into an array of indices, or None if it's a slice '''
+        if isinstance(key, slice):
+            return None
+        inds = np.asarray(key)
+        if inds.dtype == bool:
+            inds = inds.nonzero()[0]
+        inds = inds.astype(np.int64)
+        return np.where(inds < 0, inds + self.shape[-1], inds) # Handle negative indices
+
+    def __getitem__(self, key):
+        rows, people = self._split_key(key)
+        if rows is not None and rows is not False: # An integer along the first axis gives a view of that row
+            row = BitArray(shape=self.shape[1:], words=self.words[rows])
+            return row if isinstance(people, slice) and people == slice(None) else row[people]
+        inds = self._person_inds(people) if rows is None else None
+        if inds is None: # Otherwise, unpack
+            return np.asarray(self)[key]
+        out = cvu.get_bits(self._rows(), inds.reshape(-1)).reshape(self.shape[:-1] + inds.shape)
+        return out[()] if out.ndim == 0 else out
+
+    def __setitem__(self, key, value):
+        rows, people = self._split_key(key)
+        if rows is not None and rows is not False:
+            row = BitArray(shape=self.shape[1:], words=self.words[rows])
+            row[people] = value
+            return
+        inds = self._person_inds(people) if rows is None else None
+        if inds is None: # Otherwise, unpack, set, and repack
+            arr = np.asarray(self)
+            arr[key] = value
+            self.words[...] = BitArray(arr).words
+            return
+        values = np.asarray(value, dtype=bool)
+        values = values.reshape(1, -1) if values.ndim < 2 else values.reshape(-1, values.shape[-1])
+        cvu.set_bits(self._rows(), inds.reshape(-1), values)
+        return
+
+    def nonzero(self):
+        ''' Return the indices of the people who are true, as for np.nonzero() '''
+        if self.ndim == 1:
+            return (cvu.find_bits(self.words),)
+        return np.asarray(self).nonzero()
+
+    def count(self):
+        ''' Count the people who are true, in each row if there are leading axes '''
+        counts = cvu.count_bits(self._rows())
+        return counts[0] if self.ndim == 1 else counts.reshape(self.shape[:-1])
+
+    def sum(self, axis=None):
+        ''' Count the people who are true, as for arr.sum() '''
+        if axis is None:
+            return self.count().sum()
+        return np.asarray(self).sum(axis=axis)
+
+    def any(self):
+        return self.words.any()
+
+    def all(self):
+        return self.sum() == self.size
+
+    def copy(self):
+        return BitArray(shape=self.shape, words=self.words.copy())
+
+    def resize(self, new_shape, refcheck=False):
+        ''' Resize in place, filling new people with False, as for ndarray.resize() '''
+        arr = np.asarray(self).copy()
+        arr.resize(new_shape, refcheck=False)
+        new = BitArray(arr)
+        self.shape, self.words = new.shape, new.words
+        return
+
+    def __invert__(self):
+        ''' Invert the bits, leaving the unused bits of the last word as zero '''
+        words = ~self.words
+        n = self.shape[-1]
+        if n % cvu.word_bits:
+            words[..., -1] &= np.uint64((1 << (n % cvu.word_bits)) - 1)
+        return BitArray(shape=self.shape, words=words)
+
+    def __eq__(self, other):
+        return np.asarray(self) == np.asarray(other)
+
+    def __ne__(self, other):
+        return np.asarray(self) != np.asarray(other)
+
+    def __gt__(self, other):
+        return np.asarray(self) > np.asarray(other)
+
+    def __lt__(self, other):
+        return np.asarray(self) < np.asarray(other)
+
+    def __and__(self, other):
+        return np.asarray(self) & np.asarray(other)
+
+    def __or__(self, other):
+        return np.asarray(self) | np.asarray(other)
+
+    __rand__ = __and__
+    __ror__  = __or__
+    __hash__ = None
+
+
 class BasePeople(FlexPretty):
     '''
     A class to handle all the boilerplate for people -- note that as with the
@@ -848,10 +1038,12 @@ class BasePeople(FlexPretty):
 
 
     def __setitem__(self, key, value):
-        ''' Ditto '''
+        ''' Ditto, storing boolean states as bits if people.packed_states is set '''
         if self._lock and key not in self.__dict__: # pragma: no cover
             errormsg = f'Key "{key}" is not a valid attribute of people'
             raise AttributeError(errormsg)
+        if getattr(self, 'packed_states', False) and not isinstance(value, BitArray) and key in self.meta.states + self.meta.by_strain_states:
+            value = BitArray(value)
         self.__dict__[key] = value
         return
 
@@ -951,21 +1143,27 @@ class BasePeople(FlexPretty):
 
     def defined(self, key):
         ''' Return indices of people who are not-nan '''
-        return (~np.isnan(self[key])).nonzero()[0]
+        return (~cvu.isnan(self[key])).nonzero()[0]
 
 
     def undefined(self, key):
         ''' Return indices of people who are nan '''
-        return np.isnan(self[key]).nonzero()[0]
+        return cvu.isnan(self[key]).nonzero()[0]
 
 
     def count(self, key):
         ''' Count the number of people for a given key '''
-        return (self[key]>0).sum()
+        arr = self[key]
+        if isinstance(arr, BitArray): # Count the bits directly
+            return arr.count()
+        return (arr>0).sum()
 
     def count_by_strain(self, key, strain):
         ''' Count the number of people for a given key '''
-        return (self[key][strain,:]>0).sum()
+        arr = self[key][strain,:]
+        if isinstance(arr, BitArray):
+            return arr.count()
+        return (arr>0).sum()
 
 
     def count_not(self, key):
@@ -973,6 +1171,18 @@ class BasePeople(FlexPretty):
         return (self[key]==0).sum()
 
 
+    @property
+    def float_type(self):
+        ''' The float type used by these people, set by cv.options.precision when they were created '''
+        return self.rel_trans.dtype.type
+
+
+    @property
+    def int_type(self):
+        ''' The integer type used by these people and their contacts '''
+        return self.uid.dtype.type
+
+
     def set_pars(self, pars):
         '''
         Very simple method to re-link the parameters stored in the people object
@@ -1024,6 +1234,117 @@ class BasePeople(FlexPretty):
         return np.arange(len(self))
 
 
+    def find_uids(self, uids):
+        '''
+        Return the indices of the people with the specified UIDs. These are the
+        same as the UIDs unless the people have been reordered (see reorder()).
+
+        Args:
+            uids (int/array): the UIDs to find
+
+        **Example**::
+
+            sim = cv.Sim(pop_type='hybrid').initialize(reorder=True)
+            ind = sim.people.find_uids(0)[0] # The index of the person who was originally first
+        '''
+        uids = sc.promotetoarray(uids)
+        order = np.argsort(self.uid, kind='stable')
+        inds = order[np.searchsorted(self.uid, uids, sorter=order).clip(0, len(self)-1)]
+        if not np.array_equal(self.uid[inds], uids):
+            missing = np.setdiff1d(uids, self.uid)
+            errormsg = f'Could not find people with UIDs {missing}'
+            raise sc.KeyNotFoundError(errormsg)
+        return inds
+
+
+    def reorder(self, order='rcm'):
+        '''
+        Reorder the people, e.g. so that people who are in contact with each other
+        are close together in memory, which makes looking up the states of each
+        edge's people during transmission more cache friendly for large populations.
+        All the people's arrays are permuted, and the edges and clusters of each
+        layer are relabeled. Each person keeps their UID, so people.uid[i] is the
+        UID of the person at index i; use find_uids() to find people by UID.
+
+        Since other objects (e.g. the infection log) refer to people by index, this
+        can only be done before the people are initialized, usually via
+        ``sim.initialize(reorder=True)`` (see cv.make_people()).
+
+        Args:
+            order (str/array): 'rcm' to use the reverse Cuthill-McKee ordering of the edges of the static layers, or the index of the person to put at each position
+
+        Returns:
+            order (array): the index of the person that was put at each position
+        '''
+        if self.initialized:
+            errormsg = 'People can only be reordered before they are initialized, since results refer to people by index'
+            raise RuntimeError(errormsg)
+
+        # Find the order
+        n = len(self)
+        if isinstance(order, str):
+            if order != 'rcm':
+                errormsg = f'Reordering "{order}" not found; choices are "rcm" or an array of indices'
+                raise ValueError(errormsg)
+            order = self._rcm_order()
+        order = np.array(order, dtype=np.int64)
+        if len(order) != n or not np.array_equal(np.bincount(order, minlength=n), np.ones(n)):
+            errormsg = f'The order must contain each index from 0 to {n-1} exactly once'
+            raise ValueError(errormsg)
+        new_inds = np.empty(n, dtype=np.int64) # The new index of each person
+        new_inds[order] = np.arange(n)
+
+        # Permute the people's arrays
+        for key in self.keys():
+            self[key] = self[key][..., order]
+
+        # Relabel the edges, then restore the clusters, which are discarded when the edges are replaced
+        for layer in self.contacts.values():
+            clusters = getattr(layer, 'clusters', None)
+            for key in ['p1', 'p2']:
+                layer[key] = np.array(new_inds[layer[key]], dtype=layer[key].dtype)
+            if isinstance(layer, CompactLayer):
+                p1, p2, beta = layer.get_edges()
+                layer.set_edges(new_inds[p1], new_inds[p2], beta=beta, n=n)
+            if clusters is not None:
+                new_clusters = layer.set_clusters(clusters.ids[order])
+                if 'beta' in clusters: # For clique layers; the cluster IDs are unchanged
+                    new_clusters.beta = clusters.beta
+
+        return order
+
+
+    def _rcm_order(self):
+        ''' Find the reverse Cuthill-McKee ordering of the edges of the static layers; used by reorder() '''
+        from scipy import sparse as sps # Not imported by default since it's rarely used
+        from scipy.sparse import csgraph
+
+        n = len(self)
+        dynam_layer = self.pars.get('dynam_layer', {}) if self.pars else {}
+        p1, p2 = [], []
+        for lkey,layer in self.contacts.items():
+            if dynam_layer.get(lkey, False) or layer.dynamic: # These change anyway
+                continue
+            if isinstance(layer, CliqueLayer): # Connect the members of each cluster in a chain
+                members = layer.clusters.members
+                same = layer.clusters.ids[members[:-1]] == layer.clusters.ids[members[1:]]
+                p1.append(members[:-1][same])
+                p2.append(members[1:][same])
+            elif isinstance(layer, CompactLayer):
+                edges = layer.get_edges()
+                p1.append(edges[0])
+                p2.append(edges[1])
+            else:
+                p1.append(layer['p1'])
+                p2.append(layer['p2'])
+        p1 = np.concatenate(p1 + [[]]).astype(np.int64)
+        p2 = np.concatenate(p2 + [[]]).astype(np.int64)
+        ones = np.ones(2*len(p1), dtype=np.int8)
+        adjacency = sps.csr_matrix((ones, (np.concatenate([p1, p2]), np.concatenate([p2, p1]))), shape=(n, n))
+        order = csgraph.reverse_cuthill_mckee(adjacency, symmetric_mode=True)
+        return order
+
+
     def validate(self, die=True, verbose=False):
 
         # Check that the keys match
@@ -1080,20 +1401,31 @@ class BasePeople(FlexPretty):
         return
 
 
+    def _columns(self):
+        ''' Return each person's values as a dict of 1D arrays, with a column for each strain for states by strain (e.g. exposed_by_strain_0) '''
+        columns = {}
+        for key in self.keys():
+            data = np.asarray(self[key])
+            if data.ndim == 2:
+                for strain,row in enumerate(data):
+                    columns[f'{key}_{strain}'] = row
+            else:
+                columns[key] = data
+        return columns
+
+
     def to_df(self):
-        ''' Convert to a Pandas dataframe '''
-        df = pd.DataFrame.from_dict({key:self[key] for key in self.keys()})
+        ''' Convert to a Pandas dataframe; the UIDs differ from the indices if the people have been reordered '''
+        df = pd.DataFrame.from_dict(self._columns())
         return df
 
 
     def to_arr(self):
-        ''' Return as numpy array '''
-        arr = np.empty((len(self), len(self.keys())), dtype=cvd.default_float)
-        for k,key in enumerate(self.keys()):
-            if key == 'uid':
-                arr[:,k] = np.arange(len(self))
-            else:
-                arr[:,k] = self[key]
+        ''' Return as numpy array, with the columns of to_df() '''
+        columns = self._columns()
+        arr = np.empty((len(self), len(columns)), dtype=cvd.default_float)
+        for k,data in enumerate(columns.values()):
+            arr[:,k] = cvu.to_float(data) # Undefined dates are NaN, even if stored as integers
         return arr
 
 
@@ -1143,7 +1475,8 @@ class BasePeople(FlexPretty):
     def to_graph(self): # pragma: no cover
         '''
         Convert all people to a networkx MultiDiGraph, including all properties of
-        the people (nodes) and contacts (edges).
+        the people (nodes) and contacts (edges). The nodes are the people's UIDs,
+        which differ from their indices if the people have been reordered.
 
         **Example**::
 
@@ -1161,11 +1494,11 @@ class BasePeople(FlexPretty):
         '''
         import networkx as nx
 
-        # Copy data from people into graph
-        G = self.contacts.to_graph()
-        for key in self.keys():
-            data = {k:v for k,v in enumerate(self[key])}
-            nx.set_node_attributes(G, data, name=key)
+        # Copy data from people into graph, labeling each person by UID
+        uids = self.uid.tolist()
+        G = nx.relabel_nodes(self.contacts.to_graph(), dict(enumerate(uids)))
+        for key,data in self._columns().items():
+            nx.set_node_attributes(G, dict(zip(uids, data)), name=key)
 
         # Include global layer weights
         for u,v,k in G.edges(keys=True):
@@ -1449,6 +1782,8 @@ class Layer(FlexDict):
         layer2 = cv.Layer(**layer, index=index, self_conn=self_conn, label=layer.label)
     '''
 
+    dynamic = False # Whether the layer always regenerates its contacts on each timestep, regardless of the dynam_layer parameter
+
     def __init__(self, label=None, **kwargs):
         self.meta = {
             'p1':    cvd.default_int,   # Person 1
@@ -1457,6 +1792,8 @@ class Layer(FlexDict):
         }
         self.basekey = 'p1' # Assign a base key for calculating lengths and performing other operations
         self.label = label
+        self.neighbor_index = None # The neighbor index, created by make_index() if needed
+        self.clusters = None # The members of each cluster, if set by set_clusters()
 
         # Initialize the keys of the layers
         for key,dtype in self.meta.items():
@@ -1476,6 +1813,20 @@ class Layer(FlexDict):
             return 0
 
 
+    def __getstate__(self):
+        ''' Don't save the neighbor index, since it's regenerated when needed '''
+        state = self.__dict__.copy()
+        state['neighbor_index'] = None
+        return state
+
+
+    def __setitem__(self, key, value):
+        ''' Replacing any of the arrays invalidates the neighbor index and clusters '''
+        self.neighbor_index = None
+        self.clusters = None
+        return super().__setitem__(key, value)
+
+
     def __repr__(self):
         ''' Convert to a dataframe for printing '''
         namestr = self.__class__.__name__
@@ -1626,8 +1977,15 @@ class Layer(FlexDict):
         if inds.dtype != np.int64:  # pragma: no cover # This is int64 since indices often come from cv.true(), which returns int64
             inds = np.array(inds, dtype=np.int64)
 
-        # Find the contacts
-        contact_inds = cvu.find_contacts(self['p1'], self['p2'], inds)
+        # Find the contacts, using the clusters or the neighbor index if they're available
+        clusters = getattr(self, 'clusters', None)
+        index = getattr(self, 'neighbor_index', None)
+        if clusters is not None:
+            contact_inds = cvu.find_contacts_clusters(clusters.indptr, clusters.members, clusters.ids, inds)
+        elif index is not None:
+            contact_inds = cvu.find_contacts_index(index.indptr, index.slots, self['p1'], self['p2'], inds)
+        else:
+            contact_inds = cvu.find_contacts(self['p1'], self['p2'], inds)
         if as_array:
             contact_inds = np.fromiter(contact_inds, dtype=cvd.default_int)
             contact_inds.sort()  # Sorting ensures that the results are reproducible for a given seed as well as being identical to previous versions of Covasim
@@ -1661,5 +2019,442 @@ class Layer(FlexDict):
         self['p1'][inds]   = np.array(cvu.choose_r(max_n=pop_size, n=n_new), dtype=cvd.default_int) # Choose with replacement
         self['p2'][inds]   = np.array(cvu.choose_r(max_n=pop_size, n=n_new), dtype=cvd.default_int)
         self['beta'][inds] = np.ones(n_new, dtype=cvd.default_float)
+        self.reset_index() # The edges have been modified in place
+        return
+
+
+    def make_index(self, n=None):
+        '''
+        Create a compressed sparse row (CSR) neighbor index for the layer, so the
+        contacts of a given person can be found without scanning every edge. The
+        contacts of person i are stored in index.slots[index.indptr[i]:index.indptr[i+1]],
+        where each slot is 2*edge for a contact where the person is p1 and 2*edge+1
+        where they are p2.
+
+        The index is discarded whenever the edges are replaced (e.g. by add_contacts(),
+        pop_inds(), append(), or update()); if the arrays are modified in place
+        by other code, call reset_index() afterwards.
+
+        Args:
+            n (int): the number of people; if None, use the largest index in the layer
+
+        Returns:
+            index (objdict): the index, with keys indptr and slots
+
+        **Example**::
+
+            sim = cv.Sim(pop_type='hybrid').initialize()
+            index = sim.people.contacts['h'].make_index(len(sim.people))
+            contacts = index.slots[index.indptr[0]:index.indptr[1]] // 2 # Edges involving person 0
+        '''
+        if n is None:
+            n = max(self['p1'].max(initial=-1), self['p2'].max(initial=-1)) + 1
+        indptr, slots = cvu.make_index(self['p1'], self['p2'], int(n))
+        self.neighbor_index = sc.objdict(indptr=indptr, slots=slots)
+        return self.neighbor_index
+
+
+    def get_index(self, n=None):
+        '''
+        Return the neighbor index, creating it if it doesn't exist or if it was
+        created for a different number of people. See make_index() for details.
+        '''
+        index = getattr(self, 'neighbor_index', None)
+        if index is None or (n is not None and len(index.indptr) != n+1):
+            index = self.make_index(n)
+        return index
+
+
+    def reset_index(self):
+        ''' Discard the neighbor index and clusters, e.g. after modifying the edges in place '''
+        self.neighbor_index = None
+        self.clusters = None
         return
 
+
+    def set_clusters(self, cluster_ids):
+        '''
+        Record which cluster (e.g. household) each person belongs to, for a layer
+        whose edges connect everyone in each cluster, such as the household layer
+        of a hybrid population (where this is done automatically). The contacts of
+        a person are then found from the other members of their cluster, without
+        visiting any edges. As with the neighbor index, the clusters are discarded
+        whenever the edges are replaced or reset_index() is called, since they may
+        no longer match.
+
+        Args:
+            cluster_ids (array): the cluster ID of each person, or -1 for people not in any cluster
+
+        Returns:
+            clusters (objdict): the clusters, with keys ids, indptr, and members, where the members of cluster c are members[indptr[c]:indptr[c+1]]
+
+        **Example**::
+
+            sim = cv.Sim(pop_type='hybrid').initialize()
+            clusters = sim.people.contacts['h'].clusters
+            household = clusters.members[clusters.indptr[clusters.ids[0]]:clusters.indptr[clusters.ids[0]+1]] # Everyone in person 0's household
+        '''
+        ids = np.array(cluster_ids, dtype=cvd.default_int)
+        order = np.argsort(ids, kind='stable')
+        members = np.array(order[ids[order] >= 0], dtype=cvd.default_int)
+        indptr = np.zeros(ids.max(initial=-1)+2, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(ids[members], minlength=len(indptr)-1))
+        self.clusters = sc.objdict(ids=ids, indptr=indptr, members=members)
+        return self.clusters
+
+
+    def find_cluster_members(self, inds):
+        '''
+        Find everyone in the same clusters (e.g. households) as the specified people,
+        including the people themselves; requires set_clusters(). This is useful for
+        household-level interventions, e.g. subtargeting testing to the households
+        of people who have been diagnosed.
+
+        Args:
+            inds (array): indices of people whose clusters to return
+
+        Returns:
+            member_inds (array): sorted indices of the members of these clusters
+
+        **Example**::
+
+            def diag_households(sim):
+                return sim.people.contacts['h'].find_cluster_members(cv.true(sim.people.diagnosed))
+            tp = cv.test_prob(symp_prob=0.1, subtarget={'inds':diag_households, 'vals':10})
+        '''
+        clusters = getattr(self, 'clusters', None)
+        if clusters is None:
+            errormsg = f'Layer "{self.label}" does not have clusters; use set_clusters() first'
+            raise ValueError(errormsg)
+        cluster_inds = np.unique(clusters.ids[sc.promotetoarray(inds).astype(np.int64)])
+        cluster_inds = cluster_inds[cluster_inds >= 0]
+        starts = clusters.indptr[cluster_inds]
+        counts = clusters.indptr[cluster_inds+1] - starts
+        slots = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        member_inds = np.sort(clusters.members[slots])
+        return member_inds
+
+
+class MassActionLayer(Layer):
+    '''
+    A well-mixed ("mass-action") layer whose contacts are never stored for the
+    whole population. Instead, on each timestep, each infectious person draws a
+    Poisson (or negative binomial) number of contacts, with the others chosen at
+    random from the whole population, and only these contacts are stored. This
+    gives the same distribution of infections as a random layer that is regenerated
+    on each timestep, but without storing or redrawing the contacts of everyone
+    else, which for a large population is most of the memory and time used by
+    the community layer.
+
+    Note that since only the current contacts of infectious people are stored,
+    interventions that use a layer's contacts (e.g. contact tracing) only see these.
+
+    Usually created via ``sim.initialize(mass_action=True)`` (see cv.make_randpop()).
+
+    Args:
+        n_contacts (float): the average number of contacts per person per day
+        dispersion (float): if not None, use a negative binomial distribution with this dispersion parameter instead of Poisson
+        label (str): the name of the layer (optional)
+
+    **Example**::
+
+        sim = cv.Sim(pop_type='hybrid').initialize()
+        sim.people.contacts['c'] = cv.MassActionLayer(n_contacts=sim['contacts']['c'], label='c')
+        sim.run()
+    '''
+
+    dynamic = True
+
+    def __init__(self, n_contacts=0, dispersion=None, label=None):
+        super().__init__(label=label)
+        self.n_contacts = n_contacts
+        self.dispersion = dispersion
+        return
+
+
+    def update(self, people, frac=1.0):
+        '''
+        Draw the contacts of each infectious person for this timestep, replacing
+        the previous ones; called by people.update_contacts() on each timestep.
+
+        Args:
+            people (People): the people, used to find who is infectious
+            frac (float): not used, since all the contacts are redrawn
+        '''
+        inf_inds = people.true('infectious')
+        n_inf = len(inf_inds)
+        if self.dispersion is None:
+            counts = cvu.n_poisson(people.float_type(self.n_contacts), n_inf)
+        else:
+            counts = cvu.n_neg_binomial(rate=self.n_contacts, dispersion=self.dispersion, n=n_inf)
+        p1 = np.repeat(inf_inds, counts).astype(people.int_type)
+        self['p1']   = p1
+        self['p2']   = cvu.choose_r(max_n=len(people), n=len(p1)).astype(people.int_type) # Choose with replacement, not skipping self-connections
+        self['beta'] = np.ones(len(p1), dtype=people.float_type)
+        return
+
+
+class CliqueLayer(Layer):
+    '''
+    A layer in which everyone in each cluster (e.g. household) is connected to
+    everyone else in it, stored as the members of each cluster rather than as
+    edges. A cluster of k people would otherwise need k(k-1)/2 edges, so memory
+    grows linearly rather than quadratically with cluster size, which matters
+    for large clusters such as institutions. Transmission is calculated per
+    cluster, from each infectious person to the other members of their cluster.
+
+    Since the edges aren't stored, the p1, p2, and beta arrays are empty. Methods
+    that use the clusters, such as find_contacts() (e.g. for contact tracing),
+    work as for other layers, but interventions that modify the edges can't be
+    used (clip_edges raises an error). Use to_layer() to convert to a regular layer.
+
+    Usually created via ``sim.initialize(cliques=True)`` (see cv.make_randpop()).
+
+    Args:
+        cluster_ids (array): the cluster ID of each person, or -1 for people not in any cluster
+        beta (float/array): the transmissibility of each cluster
+        label (str): the name of the layer (optional)
+
+    **Example**::
+
+        sim = cv.Sim(pop_type='hybrid').initialize()
+        cluster_ids = sim.people.contacts['h'].clusters.ids
+        sim.people.contacts['h'] = cv.CliqueLayer(cluster_ids=cluster_ids, label='h')
+        sim.run()
+    '''
+
+    def __init__(self, cluster_ids=None, beta=1.0, label=None):
+        super().__init__(label=label)
+        if cluster_ids is not None:
+            self.set_clusters(cluster_ids, beta=beta)
+        return
+
+
+    def __setitem__(self, key, value):
+        ''' The clusters don't depend on the (empty) arrays, so aren't discarded when these are replaced '''
+        self.neighbor_index = None
+        return FlexDict.__setitem__(self, key, value)
+
+
+    def reset_index(self):
+        ''' Discard the neighbor index, but not the clusters '''
+        self.neighbor_index = None
+        return
+
+
+    def set_clusters(self, cluster_ids, beta=1.0):
+        '''
+        Set the members of each cluster; see Layer.set_clusters().
+
+        Args:
+            cluster_ids (array): the cluster ID of each person, or -1 for people not in any cluster
+            beta (float/array): the transmissibility of each cluster
+        '''
+        clusters = super().set_clusters(cluster_ids)
+        n_clusters = len(clusters.indptr) - 1
+        clusters.beta = np.array(np.broadcast_to(beta, n_clusters), dtype=cvd.default_float)
+        return clusters
+
+
+    def update(self, people, frac=1.0):
+        ''' Clusters are fixed, so there's nothing to update '''
+        return
+
+
+    def to_layer(self):
+        '''
+        Convert to a regular layer, with an edge between every pair of members of each cluster.
+
+        **Example**::
+
+            sim = cv.Sim(pop_type='hybrid').initialize(cliques=True)
+            sim.people.contacts['h'] = sim.people.contacts['h'].to_layer()
+        '''
+        clusters = self.clusters
+        p1, p2 = cvu.make_clique_edges(clusters.indptr, clusters.members)
+        sizes = np.diff(clusters.indptr)
+        beta = np.repeat(clusters.beta, sizes*(sizes-1)//2)
+        layer = Layer(label=self.label, p1=p1, p2=p2, beta=beta)
+        layer.set_clusters(clusters.ids)
+        return layer
+
+
+class CompactLayer(Layer):
+    '''
+    A static layer stored in a compact format: the edges are sorted by person, and
+    stored once in each direction as the contacts of each person, so the contacts of
+    person i are adjacency.contacts[adjacency.indptr[i]:adjacency.indptr[i+1]]. The
+    sorted p1 array is thus replaced by the offset of each person's contacts, the p2
+    array is stored as unsigned 32-bit integers, and beta is stored as a single value
+    if it's the same for every edge (as it is for the layers made by cv.make_randpop()).
+    This replaces both the p1, p2, and beta arrays and the neighbor index (see
+    Layer.make_index()), which typically takes less than half as much memory, and
+    the transmission calculations use it directly.
+
+    As for cv.CliqueLayer, the p1, p2, and beta arrays are empty; use to_layer()
+    to convert to a regular layer. Edges can still be removed and added back (e.g.
+    by clip_edges) via pop_inds() and append(), but since each call rebuilds the
+    adjacency arrays, this is slower than for a regular layer. Contacts are not
+    regenerated, so dynamic layers can't be compact.
+
+    Usually created via ``sim.initialize(compact=True)`` (see cv.make_people()).
+
+    Args:
+        p1 (array): an array of N connections, representing people on one side of the connection
+        p2 (array): an array of people on the other side of the connection
+        beta (float/array): the weight of each connection
+        n (int): the number of people; if None, use the largest index in the layer
+        label (str): the name of the layer (optional)
+
+    **Example**::
+
+        sim = cv.Sim(pop_type='hybrid').initialize()
+        layer = sim.people.contacts['w']
+        sim.people.contacts['w'] = cv.CompactLayer(**layer, n=len(sim.people), label='w')
+        sim.run()
+    '''
+
+    def __init__(self, p1=None, p2=None, beta=1.0, n=None, label=None):
+        super().__init__(label=label)
+        self.adjacency = None
+        if p1 is not None:
+            self.set_edges(p1, p2, beta=beta, n=n)
+        return
+
+
+    def __len__(self):
+        ''' The number of edges, each of which is stored in both directions '''
+        adjacency = getattr(self, 'adjacency', None)
+        return 0 if adjacency is None else len(adjacency.contacts)//2
+
+
+    def __setitem__(self, key, value):
+        ''' The edges aren't stored in the (empty) arrays, so aren't discarded when these are replaced '''
+        self.neighbor_index = None
+        return FlexDict.__setitem__(self, key, value)
+
+
+    def reset_index(self):
+        ''' Discard the neighbor index, but not the clusters or edges '''
+        self.neighbor_index = None
+        return
+
+
+    def set_edges(self, p1, p2, beta=1.0, n=None):
+        '''
+        Store the edges in the compact format, in the same order as in the neighbor
+        index of a regular layer with these edges (see Layer.make_index()).
+
+        Args:
+            p1 (array): an array of N connections, representing people on one side of the connection
+            p2 (array): an array of people on the other side of the connection
+            beta (float/array): the weight of each connection
+            n (int): the number of people; if None, use the largest index in the layer
+
+        Returns:
+            adjacency (objdict): the edges, with keys indptr, contacts, and beta
+        '''
+        p1 = np.array(p1, dtype=cvd.default_int)
+        p2 = np.array(p2, dtype=cvd.default_int)
+        beta = np.array(np.broadcast_to(beta, len(p1)), dtype=cvd.default_float)
+        if n is None:
+            n = max(p1.max(initial=-1), p2.max(initial=-1)) + 1
+        indptr, slots = cvu.make_index(p1, p2, int(n))
+        edges = slots >> 1
+        contacts = np.where(slots & 1, p1[edges], p2[edges]).astype(np.uint32)
+        if len(beta) and (beta == beta[0]).all(): # Store a single value if all the edges are the same
+            beta = beta[:1]
+        elif len(beta):
+            beta = beta[edges]
+        else:
+            beta = np.ones(1, dtype=cvd.default_float)
+        self.adjacency = sc.objdict(indptr=indptr, contacts=contacts, beta=beta)
+        return self.adjacency
+
+
+    def get_edges(self):
+        '''
+        Return the edges, each in one direction, sorted by the lower-numbered person.
+
+        Returns:
+            p1, p2, beta (arrays): the edges
+        '''
+        adjacency = self.adjacency
+        p1 = np.repeat(np.arange(len(adjacency.indptr)-1, dtype=cvd.default_int), np.diff(adjacency.indptr))
+        p2 = adjacency.contacts.astype(cvd.default_int)
+        keep = p1 < p2
+        loops = cvu.true(p1 == p2)
+        keep[loops[::2]] = True # Self-connections are stored twice in a row, so keep the first of each pair
+        beta = adjacency.beta if len(adjacency.beta) == 1 else adjacency.beta[keep]
+        beta = np.array(np.broadcast_to(beta, keep.sum()), dtype=cvd.default_float)
+        return p1[keep], p2[keep], beta
+
+
+    def pop_inds(self, inds):
+        '''
+        "Pop" the specified edges, indexed in the order returned by get_edges(), and
+        return them as a dict; see Layer.pop_inds().
+
+        Args:
+            inds (int, array, slice): the indices to be removed
+        '''
+        p1, p2, beta = self.get_edges()
+        output = dict(p1=p1[inds], p2=p2[inds], beta=beta[inds])
+        keep = np.ones(len(p1), dtype=bool)
+        keep[inds] = False
+        self.set_edges(p1[keep], p2[keep], beta=beta[keep], n=len(self.adjacency.indptr)-1)
+        return output
+
+
+    def append(self, contacts):
+        '''
+        Append edges to the layer; see Layer.append().
+
+        Args:
+            contacts (dict): a dictionary of arrays with keys p1,p2,beta, as returned from layer.pop_inds()
+        '''
+        edges = self.get_edges()
+        p1, p2, beta = [np.concatenate([arr, contacts[key]]) for arr,key in zip(edges, ['p1', 'p2', 'beta'])]
+        self.set_edges(p1, p2, beta=beta, n=len(self.adjacency.indptr)-1)
+        return
+
+
+    def to_df(self):
+        ''' Convert the edges to a dataframe '''
+        p1, p2, beta = self.get_edges()
+        df = pd.DataFrame(dict(p1=p1, p2=p2, beta=beta))
+        return df
+
+
+    def find_contacts(self, inds, as_array=True):
+        ''' Find all contacts of the specified people; see Layer.find_contacts() '''
+        if getattr(self, 'clusters', None) is not None:
+            return super().find_contacts(inds, as_array=as_array)
+        inds = np.array(sc.promotetoarray(inds), dtype=np.int64)
+        adjacency = self.adjacency
+        contact_inds = cvu.find_contacts_compact(adjacency.indptr, adjacency.contacts, inds)
+        if as_array:
+            contact_inds = np.fromiter(contact_inds, dtype=cvd.default_int)
+            contact_inds.sort()
+        return contact_inds
+
+
+    def update(self, people, frac=1.0):
+        ''' Edges are fixed, so there's nothing to update '''
+        return
+
+
+    def to_layer(self):
+        '''
+        Convert to a regular layer, with the edges sorted by the lower-numbered person.
+
+        **Example**::
+
+            sim = cv.Sim(pop_type='hybrid').initialize(compact=True)
+            sim.people.contacts['s'] = sim.people.contacts['s'].to_layer()
+        '''
+        p1, p2, beta = self.get_edges()
+        layer = Layer(label=self.label, p1=p1, p2=p2, beta=beta)
+        if getattr(self, 'clusters', None) is not None:
+            layer.set_clusters(self.clusters.ids)
+        return layer
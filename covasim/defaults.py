@@ -1,11 +1,13 @@
 '''
 Set the defaults across each of the different files.
 
-To change the default precision from 32 bit (default) to 64 bit, use::
+To change the default precision from 32 bit (default) to 64 bit for sims created
+from now on, use::
 
     cv.options.set(precision=64)
 '''
 
+import sys
 import numpy as np
 import numba as nb
 import sciris as sc
@@ -18,18 +20,45 @@ __all__ = ['default_float', 'default_int', 'get_default_colors', 'get_default_pl
 #%% Specify what data types to use
 
 result_float = np.float64 # Always use float64 for results, for simplicity
-if cvo.precision == 32:
-    default_float = np.float32
-    default_int   = np.int32
-    nbfloat       = nb.float32
-    nbint         = nb.int32
-elif cvo.precision == 64: # pragma: no cover
-    default_float = np.float64
-    default_int   = np.int64
-    nbfloat       = nb.float64
-    nbint         = nb.int64
-else:
-    raise NotImplementedError(f'Precision must be either 32 bit or 64 bit, not {cvo.precision}')
+date_int     = np.int16 # Used for dates and durations if cv.options.int_dates is set, since simulations are always shorter than 32767 days
+date_nan     = np.iinfo(date_int).max # Used for undefined integer dates, so that checks like t >= date are false, as for NaN
+strain_int   = np.int8 # Used for people's strains (e.g. exposed_strain), with -1 for no strain
+
+def set_precision(precision=None):
+    '''
+    Set the data types used for people and contacts created from now on. Numba
+    functions are compiled for both 32 and 64 bit precision and pick the version
+    matching the arrays they're given, so no reload is needed, and sims with different
+    precisions can be run in the same session. Not necessary to call directly if
+    cv.options.set(precision=...) is used.
+
+    Args:
+        precision (int): 32 or 64 (default: cv.options.precision)
+    '''
+    global default_float, default_int, nbfloat, nbint
+    if precision is None:
+        precision = cvo.precision
+    if precision == 32:
+        default_float = np.float32
+        default_int   = np.int32
+        nbfloat       = nb.float32
+        nbint         = nb.int32
+    elif precision == 64:
+        default_float = np.float64
+        default_int   = np.int64
+        nbfloat       = nb.float64
+        nbint         = nb.int64
+    else:
+        raise NotImplementedError(f'Precision must be either 32 bit or 64 bit, not {precision}')
+
+    # Also update the copies in the top-level module, e.g. cv.default_float
+    package = sys.modules.get(__package__)
+    if package is not None and hasattr(package, 'default_float'):
+        package.default_float = default_float
+        package.default_int   = default_int
+    return
+
+set_precision()
 
 
 #%% Define all properties of people
@@ -107,6 +136,7 @@ class PeopleMeta(sc.prettyobj):
         self.dates = [f'date_{state}' for state in self.states] # Convert each state into a date
         self.dates.append('date_pos_test') # Store the date when a person tested which will come back positive
         self.dates.append('date_end_quarantine') # Store the date when a person comes out of quarantine
+        self.dates.append('date_viral_switch') # Store the date when a person's viral load drops from high to low
 
         # Duration of different states: these are floats per person -- used in people.py
         self.durs = [
@@ -208,6 +238,19 @@ immunity_sources = [
     'severe',
 ]
 
+# Dates that are tracked by the event calendar (see People.init_calendar())
+event_dates = [
+    'date_infectious',
+    'date_symptomatic',
+    'date_severe',
+    'date_critical',
+    'date_dead',
+    'date_recovered',
+    'date_pos_test',
+    'date_diagnosed',
+    'date_end_quarantine',
+]
+
 # Default age data, based on Seattle 2018 census data -- used in population.py
 default_age_data = np.array([
     [ 0,  4, 0.0605],
@@ -5,7 +5,6 @@ defined by the user by inheriting from these classes.
 
 import numpy as np
 import pandas as pd
-import pylab as pl
 import sciris as sc
 import inspect
 import datetime as dt
@@ -14,7 +13,9 @@ from . import defaults as cvd
 from . import base as cvb
 from . import parameters as cvpar
 from . import immunity as cvi
+from . import settings as cvset
 from collections import defaultdict
+pl = cvset.lazy_import('pylab') # Only imported when first used if running headless
 
 
 #%% Generic intervention classes
@@ -293,6 +294,21 @@ class Intervention:
         return
 
 
+    def get_buffer(self, sim, key, dtype=None, fill=None):
+        '''
+        Borrow a scratch array with one entry per person from the sim's people (see
+        People.get_buffer()). The key is specific to this intervention, so that two
+        interventions (e.g. test_num and test_prob) never share a buffer.
+
+        Args:
+            sim (Sim): the sim whose people to borrow the buffer from
+            key (str): the name of the buffer, e.g. 'test_probs'
+            dtype (type): the data type of the buffer (default: the people's float type)
+            fill (float): if supplied, fill the buffer with this value
+        '''
+        return sim.people.get_buffer(f'{key}_{id(self)}', dtype=dtype, fill=fill)
+
+
     def finalize(self, sim=None):
         '''
         Finalize intervention
@@ -625,6 +641,9 @@ class clip_edges(Intervention):
             # Do the contact moving
             for lkey in self.layers:
                 s_layer = sim.people.contacts[lkey] # Contact layer in the sim
+                if isinstance(s_layer, cvb.CliqueLayer):
+                    errormsg = f'clip_edges() cannot be applied to layer "{lkey}", since it is a cv.CliqueLayer, which does not store its edges; use change_beta() instead, or convert it to a regular layer via to_layer()'
+                    raise ValueError(errormsg)
                 i_layer = self.contacts[lkey] # Contact layer in the intervention
                 n_sim = len(s_layer) # Number of contacts in the simulation layer
                 n_int = len(i_layer) # Number of contacts in the intervention layer
@@ -781,7 +800,7 @@ class test_num(Intervention):
         else:
             return
 
-        test_probs = np.ones(sim.n) # Begin by assigning equal testing weight (converted to a probability) to everyone
+        test_probs = self.get_buffer(sim, 'test_probs', dtype=np.float64, fill=1.0) # Begin by assigning equal testing weight (converted to a probability) to everyone
 
         # Calculate test probabilities for people with symptoms
         symp_inds = cvu.true(sim.people.symptomatic)
@@ -921,7 +940,10 @@ class test_prob(Intervention):
                 ili_inds = np.setdiff1d(ili_inds, symp_inds)
 
         # Define asymptomatics: those who neither have COVID symptoms nor ILI symptoms
-        asymp_inds = np.setdiff1d(np.setdiff1d(np.arange(pop_size), symp_inds), ili_inds)
+        asymp = self.get_buffer(sim, 'asymp', dtype=bool, fill=True)
+        asymp[symp_inds] = False
+        asymp[ili_inds]  = False
+        asymp_inds = np.flatnonzero(asymp)
 
         # Handle quarantine and other testing criteria
         quar_test_inds = get_quar_inds(self.quar_policy, sim)
@@ -930,7 +952,7 @@ class test_prob(Intervention):
         diag_inds       = cvu.true(sim.people.diagnosed)
 
         # Construct the testing probabilities piece by piece -- complicated, since need to do it in the right order
-        test_probs = np.zeros(sim['pop_size']) # Begin by assigning equal testing probability to everyone
+        test_probs = self.get_buffer(sim, 'test_probs', dtype=np.float64, fill=0.0) # Begin by assigning equal testing probability to everyone
         test_probs[symp_inds]       = symp_prob            # People with symptoms (true positive)
         test_probs[ili_inds]        = symp_prob            # People with symptoms (false positive)
         test_probs[asymp_inds]      = self.asymp_prob      # People without symptoms
@@ -1176,7 +1198,7 @@ class simple_vaccine(Intervention):
         for ind in find_day(self.days, sim.t, interv=self, sim=sim):
 
             # Construct the testing probabilities piece by piece -- complicated, since need to do it in the right order
-            vacc_probs = np.full(sim.n, self.prob) # Begin by assigning equal vaccination probability to everyone
+            vacc_probs = self.get_buffer(sim, 'vacc_probs', dtype=np.float64, fill=self.prob) # Begin by assigning equal vaccination probability to everyone
             if self.subtarget is not None:
                 subtarget_inds, subtarget_vals = get_subtargets(self.subtarget, sim)
                 vacc_probs[subtarget_inds] = subtarget_vals # People being explicitly subtargeted
@@ -1201,7 +1223,7 @@ class simple_vaccine(Intervention):
                 self.vaccination_dates[v_ind].append(sim.t)
 
             # Update vaccine attributes in sim
-            sim.people.vaccinated[vacc_inds] = True
+            sim.people.set_state('vaccinated', vacc_inds, True)
             sim.people.vaccinations[vacc_inds] += 1
 
         return
@@ -1346,7 +1368,7 @@ class vaccinate(Intervention):
 
         if sim.t >= np.min(self.days):
             # Determine who gets first dose of vaccine today
-            vacc_probs = np.zeros(sim['pop_size'])
+            vacc_probs = self.get_buffer(sim, 'vacc_probs', dtype=np.float64, fill=0.0)
             if self.subtarget is not None:
                 subtarget_inds, subtarget_vals = get_subtargets(self.subtarget, sim)
                 if len(subtarget_vals):
@@ -1373,7 +1395,7 @@ class vaccinate(Intervention):
                 sim.people.flows['new_vaccinations'] += len(vacc_inds_dose2)
             if len(vacc_inds):
                 # Update vaccine attributes in sim
-                sim.people.vaccinated[vacc_inds] = True
+                sim.people.set_state('vaccinated', vacc_inds, True)
                 sim.people.vaccine_source[vacc_inds] = self.index
                 self.vaccinations[vacc_inds] += 1
                 self.vaccination_dates[vacc_inds] = sim.t
@@ -4,11 +4,14 @@ Miscellaneous functions that do not belong anywhere else
 
 import numpy as np
 import pandas as pd
-import pylab as pl
 import sciris as sc
-import scipy.stats as sps
 from pathlib import Path
 from . import version as cvv
+from . import settings as cvset
+
+# Only imported when first used if running headless
+pl  = cvset.lazy_import('pylab')
+sps = cvset.lazy_import('scipy.stats')
 
 
 #%% Convenience imports from Sciris
@@ -255,6 +258,24 @@ def migrate_strains(pars, verbose=True):
     return
 
 
+def migrate_engine(pars, verbose=True):
+    '''
+    Small helper function to add any missing engine parameters, using the
+    default calculations so results match the version the sim was saved with.
+    '''
+    defaults = dict(
+        trans_mode = 'layered',
+        trans_rng  = 'stream',
+        prog_mode  = 'exact',
+    )
+    for key,val in defaults.items():
+        if key not in pars:
+            if verbose > 1:
+                print(f'  Setting {key} to {val}')
+            pars[key] = val
+    return
+
+
 def migrate(obj, update=True, verbose=True, die=False):
     '''
     Define migrations allowing compatibility between different versions of saved
@@ -280,7 +301,9 @@ def migrate(obj, update=True, verbose=True, die=False):
     # Import here to avoid recursion
     from . import base as cvb
     from . import run as cvr
+    from . import people as cvppl
     from . import interventions as cvi
+    from . import defaults as cvd
 
     # Migrations for simulations
     if isinstance(obj, cvb.BaseSim):
@@ -321,6 +344,11 @@ def migrate(obj, update=True, verbose=True, die=False):
                 print('Adding strain parameters')
             migrate_strains(sim.pars, verbose=verbose)
 
+        # Migrations that do not depend on the version
+        migrate_engine(sim.pars, verbose=verbose)
+        if sim.people:
+            sim.people = migrate(sim.people, update=update, verbose=verbose)
+
     # Migrations for People
     elif isinstance(obj, cvb.BasePeople): # pragma: no cover
         ppl = obj
@@ -328,6 +356,28 @@ def migrate(obj, update=True, verbose=True, die=False):
             if verbose: print(f'Migrating people from version <2.0 to version {cvv.__version__}')
             cvb.set_metadata(ppl) # Set all metadata
 
+        # Convert the infection log from a list of dicts
+        if isinstance(ppl.infection_log, list):
+            ppl.infection_log = cvppl.InfectionLog.from_list(ppl.infection_log)
+
+        # Add the scratch buffers
+        if not hasattr(ppl, 'buffers'):
+            ppl.buffers = cvppl.BufferArena()
+
+        # Add the precomputed viral load switch dates
+        if not hasattr(ppl, 'date_viral_switch'):
+            for states in [ppl.meta.dates, ppl.meta.all_states]:
+                states.append('date_viral_switch')
+            ppl.__dict__['date_viral_switch'] = np.full(len(ppl), np.nan, dtype=ppl.date_infectious.dtype)
+            ppl.set_viral_switch(ppl.defined('date_infectious'))
+
+        # Store strains as integers, with -1 for no strain, rather than as floats with NaN
+        for key in ppl.meta.strain_states:
+            if ppl[key].dtype.kind == 'f':
+                ppl.__dict__[key] = np.array(np.nan_to_num(ppl[key], nan=-1), dtype=cvd.strain_int)
+                if hasattr(ppl, '_dtypes'):
+                    ppl._dtypes[key] = ppl[key].dtype
+
     # Migrations for MultiSims -- use recursion
     elif isinstance(obj, cvr.MultiSim):
         msim = obj
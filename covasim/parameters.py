@@ -41,6 +41,9 @@ def make_pars(set_prognoses=False, prog_by_age=True, version=None, **kwargs):
     pars['n_days']     = 60           # Number of days to run, if end_day isn't specified
     pars['rand_seed']  = 1            # Random seed, if None, don't reset
     pars['verbose']    = cvo.verbose  # Whether or not to display information during the run -- options are 0 (silent), 1 (default), 2 (everything)
+    pars['trans_mode'] = 'layered'    # How to calculate transmission -- 'layered' (one pass per strain, layer, and direction; default) 'fused' (one pass per layer for all strains and directions; faster, statistically equivalent), or 'hazard' (one random number per exposed person from their total hazard over all layers; statistically equivalent)
+    pars['trans_rng']  = 'stream'     # Random numbers for transmission with trans_mode='fused' or 'hazard' -- 'stream' (default) or 'counter' (keyed by seed, day, layer, and edge; reproducible with Numba multithreading)
+    pars['prog_mode']  = 'exact'      # How to calculate the disease course of newly infected people -- 'exact' (NumPy, step by step; default) or 'compiled' (Numba, one pass; faster, statistically equivalent)
 
     # Rescaling parameters
     pars['pop_scale']         = 1    # Factor by which to scale the population -- e.g. pop_scale=10 with pop_size=100e3 means a population of 1 million
@@ -4,9 +4,11 @@ Defines the Person class and functions associated with making people.
 
 #%% Imports
 import numpy as np
+import pandas as pd
 import sciris as sc
 from collections import defaultdict
 from . import version as cvv
+from .settings import options as cvo
 from . import utils as cvu
 from . import defaults as cvd
 from . import base as cvb
@@ -58,7 +60,10 @@ class People(cvb.BasePeople):
         self.meta = cvd.PeopleMeta() # Store list of keys and dtypes
         self.contacts = None
         self.init_contacts() # Initialize the contacts
-        self.infection_log = [] # Record of infections - keys for ['source','target','date','layer']
+        self.infection_log = InfectionLog() # Record of infections - keys for ['source','target','date','layer','strain']
+        self.calendar = None # Scheduled events, if cv.options.event_calendar is set; see init_calendar()
+        self.stock_counts = None # Number of people in each state; see init_counts()
+        self.buffers = BufferArena() # Scratch arrays reused across timesteps; see get_buffer()
 
         # Set person properties -- all floats except for UID
         for key in self.meta.person:
@@ -68,13 +73,14 @@ class People(cvb.BasePeople):
                 self[key] = np.full(self.pars['pop_size'], np.nan, dtype=cvd.default_float)
 
         # Set health states -- only susceptible is true by default -- booleans except exposed by strain which should return the strain that ind is exposed to
+        self.packed_states = cvo.packed_states # If set, the states are stored as bits (see cv.BitArray)
         for key in self.meta.states:
             val = (key in ['susceptible', 'naive']) # Default value is True for susceptible and naive, false otherwise
             self[key] = np.full(self.pars['pop_size'], val, dtype=bool)
 
-        # Set strain states, which store info about which strain a person is exposed to
+        # Set strain states, which store info about which strain a person is exposed to -- -1 for none
         for key in self.meta.strain_states:
-            self[key] = np.full(self.pars['pop_size'], np.nan, dtype=cvd.default_float)
+            self[key] = np.full(self.pars['pop_size'], -1, dtype=cvd.strain_int)
         for key in self.meta.by_strain_states:
             self[key] = np.full((self.pars['n_strains'], self.pars['pop_size']), False, dtype=bool)
 
@@ -86,9 +92,10 @@ class People(cvb.BasePeople):
         for key in self.meta.vacc_states:
             self[key] = np.zeros(self.pars['pop_size'], dtype=cvd.default_int)
 
-        # Set dates and durations -- both floats
+        # Set dates and durations -- both floats, or integers if cv.options.int_dates is set
+        date_dtype, date_nan = (cvd.date_int, cvd.date_nan) if cvo.int_dates else (cvd.default_float, np.nan)
         for key in self.meta.dates + self.meta.durs:
-            self[key] = np.full(self.pars['pop_size'], np.nan, dtype=cvd.default_float)
+            self[key] = np.full(self.pars['pop_size'], date_nan, dtype=date_dtype)
 
         # Store the dtypes used in a flat dict
         self._dtypes = {key:self[key].dtype for key in self.keys()} # Assign all to float by default
@@ -125,10 +132,33 @@ class People(cvb.BasePeople):
         return
 
 
+    def get_buffer(self, key, dtype=None, fill=None):
+        '''
+        Borrow a scratch array with one entry per person, e.g. for temporaries
+        that would otherwise be allocated on every timestep. The same array is
+        returned for the same key each time it's requested, so its contents are
+        only valid until the next request for that key; see BufferArena.
+
+        Args:
+            key (str): the name of the buffer, e.g. 'test_probs'
+            dtype (type): the data type of the buffer (default: the people's float type)
+            fill (float): if supplied, fill the buffer with this value
+
+        **Example**::
+
+            test_probs = sim.people.get_buffer('test_probs', dtype=np.float64, fill=1.0)
+        '''
+        if dtype is None:
+            dtype = self.float_type
+        return self.buffers.get(key, len(self), dtype=dtype, fill=fill)
+
+
     def initialize(self):
         ''' Perform initializations '''
         self.set_prognoses()
         self.validate()
+        self.calendar = None # Rebuilt from people's dates on the next update, if used
+        self.stock_counts = None # Likewise for the stock counts
         self.initialized = True
         return
 
@@ -144,19 +174,10 @@ class People(cvb.BasePeople):
             errormsg = 'This people object does not have the required parameters ("prognoses" and "rand_seed"). Create a sim (or parameters), then do e.g. people.set_pars(sim.pars).'
             raise sc.KeyNotFoundError(errormsg)
 
-        def find_cutoff(age_cutoffs, age):
-            '''
-            Find which age bin each person belongs to -- e.g. with standard
-            age bins 0, 10, 20, etc., ages [5, 12, 4, 58] would be mapped to
-            indices [0, 1, 0, 5]. Age bins are not guaranteed to be uniform
-            width, which is why this can't be done as an array operation.
-            '''
-            return np.nonzero(age_cutoffs <= age)[0][-1]  # Index of the age bin to use
-
         cvu.set_seed(pars['rand_seed'])
 
         progs = pars['prognoses'] # Shorten the name
-        inds = np.fromiter((find_cutoff(progs['age_cutoffs'], this_age) for this_age in self.age), dtype=cvd.default_int, count=len(self)) # Convert ages to indices
+        inds = np.searchsorted(progs['age_cutoffs'], self.age, side='right') - 1 # Convert ages to the indices of their age bins, e.g. [5, 12, 4, 58] -> [0, 1, 0, 5] with standard age bins (which are not guaranteed to be uniform width)
         self.symp_prob[:]   = progs['symp_probs'][inds] # Probability of developing symptoms
         self.severe_prob[:] = progs['severe_probs'][inds]*progs['comorbidities'][inds] # Severe disease probability is modified by comorbidities
         self.crit_prob[:]   = progs['crit_probs'][inds] # Probability of developing critical disease
@@ -172,7 +193,19 @@ class People(cvb.BasePeople):
 
         # Initialize
         self.t = t
-        self.is_exp = self.true('exposed') # For storing the interim values since used in every subsequent calculation
+        if not cvo.event_calendar:
+            self.calendar = None
+        elif getattr(self, 'calendar', None) is None:
+            self.init_calendar()
+        if self.calendar is None:
+            self.is_exp = self.true('exposed') # For storing the interim values since used in every subsequent calculation
+        else: # Likewise, but as a mask, since only the people with events due are looked up
+            self.is_exp = self.get_buffer('is_exp', dtype=bool)
+            self.is_exp[:] = np.asarray(self.exposed)
+        if not cvo.stock_counts:
+            self.stock_counts = None
+        elif getattr(self, 'stock_counts', None) is None:
+            self.init_counts()
 
         # Perform updates
         self.init_flows()
@@ -199,12 +232,121 @@ class People(cvb.BasePeople):
         ''' Refresh dynamic contacts, e.g. community '''
         # Figure out if anything needs to be done -- e.g. {'h':False, 'c':True}
         for lkey, is_dynam in self.pars['dynam_layer'].items():
-            if is_dynam:
+            if is_dynam or self.contacts[lkey].dynamic:
                 self.contacts[lkey].update(self)
 
         return self.contacts
 
 
+    def init_calendar(self):
+        '''
+        Create the event calendar from people's current dates. Once created, the
+        calendar is updated whenever People methods set one of the dates it tracks
+        (e.g. infect() and test()), and the check methods (e.g. check_infectious())
+        only need to look at people who have an event due, rather than checking
+        everyone's dates each day. Called automatically if cv.options.event_calendar
+        is set.
+
+        Dates that are set directly (e.g. people.date_recovered[inds] = t by a custom
+        intervention) are not seen by the calendar, so the change must be scheduled
+        with schedule_events(); this has no effect if the calendar isn't in use.
+        '''
+        self.calendar = EventCalendar(cvd.event_dates, t=self.t)
+        for key in cvd.event_dates:
+            self.schedule_events(key, cvu.defined(self[key]))
+        return
+
+
+    def schedule_events(self, key, inds):
+        '''
+        Add people to the event calendar, if it's active, using their current values
+        of the specified date. People methods do this automatically; after setting one
+        of the dates in cv.defaults.event_dates directly, call this for the people
+        whose dates were changed.
+
+        **Example**::
+
+            sim.people.date_recovered[inds] = sim.t + 1
+            sim.people.schedule_events('date_recovered', inds)
+        '''
+        if getattr(self, 'calendar', None) is not None:
+            self.calendar.push(key, inds, self[key][inds])
+        return
+
+
+    def init_counts(self):
+        '''
+        Count the number of people in each state used for the results (e.g. the
+        number exposed, overall and by strain). Once counted, the counts are kept
+        up to date by set_state(), so they do not need to be recomputed on each
+        timestep. Called automatically by update_states_pre() if cv.options.stock_counts
+        is set.
+        '''
+        self.stock_counts = {key:self.count_stock(key, recount=True) for key in list(cvd.result_stocks.keys()) + list(cvd.result_stocks_by_strain.keys())}
+        return
+
+
+    def count_stock(self, key, recount=False):
+        '''
+        Count the number of people in a state used for the results, e.g. 'severe'
+        (a number) or 'exposed_by_strain' (an array with one count per strain).
+        Uses the stock counts if they are being kept (see init_counts()), otherwise
+        counts everyone.
+        '''
+        if self.stock_counts is not None and not recount:
+            return self.stock_counts[key]
+        elif key in cvd.result_stocks_by_strain:
+            return np.array([self.count_by_strain(key, strain) for strain in range(self.pars['n_strains'])])
+        else:
+            return self.count(key)
+
+
+    def check_counts(self):
+        ''' Check that the stock counts, if any, match a full recount; used if cv.options.check_counts is set '''
+        if self.stock_counts is None:
+            return
+        for key,stock_count in self.stock_counts.items():
+            count = self.count_stock(key, recount=True)
+            if not np.array_equal(count, stock_count):
+                errormsg = f'Count of "{key}" on day {self.t} is {stock_count}, but a full recount gives {count}: states must be set via people.set_state() or other People methods'
+                raise RuntimeError(errormsg)
+        return
+
+
+    def set_state(self, key, inds, value, strain=None):
+        '''
+        Set a state (e.g. 'exposed') for the specified people, keeping the stock
+        counts up to date. If cv.options.stock_counts is set, states should be
+        changed via this method (or other People methods) rather than directly,
+        otherwise the results will be wrong.
+
+        Args:
+            key (str): the state to set, e.g. 'exposed' or 'exposed_by_strain'
+            inds (array): the (unique) indices of the people to set
+            value (bool): the value to set
+            strain (int): for states by strain, the strain to set (default: all strains)
+
+        **Example**::
+
+            sim.people.set_state('vaccinated', inds, True)
+        '''
+        arr = self[key]
+        if strain is not None:
+            arr = arr[strain]
+        counts = self.stock_counts
+        if counts is None or key not in counts:
+            arr[..., inds] = value
+        else:
+            before = np.count_nonzero(arr[..., inds], axis=-1)
+            arr[..., inds] = value
+            change = np.count_nonzero(arr[..., inds], axis=-1) - before
+            if strain is not None:
+                counts[key][strain] += change
+            else:
+                counts[key] += change
+        return
+
+
     #%% Methods for updating state
 
     def check_inds(self, current, date, filter_inds=None):
@@ -218,37 +360,60 @@ class People(cvb.BasePeople):
         return inds
 
 
+    def check_events(self, key, current, exposed_only=False):
+        '''
+        Return indices for which the current state is false and which meet the
+        date criterion for the specified date key. If the event calendar is active,
+        only people with an event due are checked; otherwise, this is the same as
+        check_inds().
+
+        Args:
+            key (str): the date key, e.g. 'date_infectious'
+            current (array): the current state, e.g. self.infectious
+            exposed_only (bool): whether to only include people who were exposed at the start of the timestep
+        '''
+        if self.calendar is None:
+            filter_inds = self.is_exp if exposed_only else None
+            return self.check_inds(current, self[key], filter_inds=filter_inds)
+
+        inds = self.calendar.pop(key, self.t)
+        date = self[key][inds]
+        keep = ~current[inds] & ~cvu.isnan(date) & (self.t >= date)
+        if exposed_only:
+            keep &= self.is_exp[inds]
+        return inds[keep]
+
+
     def check_infectious(self):
         ''' Check if they become infectious '''
-        inds = self.check_inds(self.infectious, self.date_infectious, filter_inds=self.is_exp)
-        self.infectious[inds] = True
+        inds = self.check_events('date_infectious', self.infectious, exposed_only=True)
+        self.set_state('infectious', inds, True)
         self.infectious_strain[inds] = self.exposed_strain[inds]
+        ptr, strain_inds = cvu.group_strains(self.infectious_strain, inds, self.pars['n_strains']) # Find the people with each strain in a single pass
+        self.flows_strain['new_infectious_by_strain'] += np.diff(ptr)
         for strain in range(self.pars['n_strains']):
-            this_strain_inds = cvu.itrue(self.infectious_strain[inds] == strain, inds)
-            n_this_strain_inds = len(this_strain_inds)
-            self.flows_strain['new_infectious_by_strain'][strain] += n_this_strain_inds
-            self.infectious_by_strain[strain, this_strain_inds] = True
+            self.set_state('infectious_by_strain', strain_inds[ptr[strain]:ptr[strain+1]], True, strain=strain)
         return len(inds)
 
 
     def check_symptomatic(self):
         ''' Check for new progressions to symptomatic '''
-        inds = self.check_inds(self.symptomatic, self.date_symptomatic, filter_inds=self.is_exp)
-        self.symptomatic[inds] = True
+        inds = self.check_events('date_symptomatic', self.symptomatic, exposed_only=True)
+        self.set_state('symptomatic', inds, True)
         return len(inds)
 
 
     def check_severe(self):
         ''' Check for new progressions to severe '''
-        inds = self.check_inds(self.severe, self.date_severe, filter_inds=self.is_exp)
-        self.severe[inds] = True
+        inds = self.check_events('date_severe', self.severe, exposed_only=True)
+        self.set_state('severe', inds, True)
         return len(inds)
 
 
     def check_critical(self):
         ''' Check for new progressions to critical '''
-        inds = self.check_inds(self.critical, self.date_critical, filter_inds=self.is_exp)
-        self.critical[inds] = True
+        inds = self.check_events('date_critical', self.critical, exposed_only=True)
+        self.set_state('critical', inds, True)
         return len(inds)
 
 
@@ -261,23 +426,24 @@ class People(cvb.BasePeople):
         '''
 
         # Handle more flexible options for setting indices
-        if filter_inds == 'is_exp':
-            filter_inds = self.is_exp
         if inds is None:
-            inds = self.check_inds(self.recovered, self.date_recovered, filter_inds=filter_inds)
+            if isinstance(filter_inds, str) and filter_inds == 'is_exp':
+                inds = self.check_events('date_recovered', self.recovered, exposed_only=True)
+            else:
+                inds = self.check_inds(self.recovered, self.date_recovered, filter_inds=filter_inds)
 
         # Now reset all disease states
-        self.exposed[inds]          = False
-        self.infectious[inds]       = False
-        self.symptomatic[inds]      = False
-        self.severe[inds]           = False
-        self.critical[inds]         = False
-        self.recovered[inds]        = True
+        self.set_state('exposed', inds, False)
+        self.set_state('infectious', inds, False)
+        self.set_state('symptomatic', inds, False)
+        self.set_state('severe', inds, False)
+        self.set_state('critical', inds, False)
+        self.set_state('recovered', inds, True)
         self.recovered_strain[inds] = self.exposed_strain[inds]
-        self.infectious_strain[inds] = np.nan
-        self.exposed_strain[inds]    = np.nan
-        self.exposed_by_strain[:, inds] = False
-        self.infectious_by_strain[:, inds] = False
+        self.infectious_strain[inds] = -1
+        self.exposed_strain[inds]    = -1
+        self.set_state('exposed_by_strain', inds, False)
+        self.set_state('infectious_by_strain', inds, False)
 
         # Handle immunity aspects
         if self.pars['use_waning']:
@@ -287,7 +453,7 @@ class People(cvb.BasePeople):
             severe_inds = self.check_inds(self.susceptible, self.date_severe,      filter_inds=inds)
 
             # Reset additional states
-            self.susceptible[inds] = True
+            self.set_state('susceptible', inds, True)
             self.prior_symptoms[inds]        = self.pars['rel_imm_symp']['asymp']
             self.prior_symptoms[mild_inds]   = self.pars['rel_imm_symp']['mild']
             self.prior_symptoms[severe_inds] = self.pars['rel_imm_symp']['severe']
@@ -298,20 +464,20 @@ class People(cvb.BasePeople):
 
     def check_death(self):
         ''' Check whether or not this person died on this timestep  '''
-        inds = self.check_inds(self.dead, self.date_dead, filter_inds=self.is_exp)
-        self.susceptible[inds]   = False
-        self.exposed[inds]       = False
-        self.infectious[inds]    = False
-        self.symptomatic[inds]   = False
-        self.severe[inds]        = False
-        self.critical[inds]      = False
-        self.known_contact[inds] = False
-        self.quarantined[inds]   = False
-        self.recovered[inds]     = False
-        self.dead[inds]          = True
-        self.infectious_strain[inds] = np.nan
-        self.exposed_strain[inds]    = np.nan
-        self.recovered_strain[inds]  = np.nan
+        inds = self.check_events('date_dead', self.dead, exposed_only=True)
+        self.set_state('susceptible', inds, False)
+        self.set_state('exposed', inds, False)
+        self.set_state('infectious', inds, False)
+        self.set_state('symptomatic', inds, False)
+        self.set_state('severe', inds, False)
+        self.set_state('critical', inds, False)
+        self.set_state('known_contact', inds, False)
+        self.set_state('quarantined', inds, False)
+        self.set_state('recovered', inds, False)
+        self.set_state('dead', inds, True)
+        self.infectious_strain[inds] = -1
+        self.exposed_strain[inds]    = -1
+        self.recovered_strain[inds]  = -1
         return len(inds)
 
 
@@ -325,15 +491,15 @@ class People(cvb.BasePeople):
         '''
 
         # Handle people who tested today who will be diagnosed in future
-        test_pos_inds = self.check_inds(self.diagnosed, self.date_pos_test, filter_inds=None) # Find people who will be diagnosed in future
-        self.date_pos_test[test_pos_inds] = np.nan # Clear date of having will-be-positive test
+        test_pos_inds = self.check_events('date_pos_test', self.diagnosed) # Find people who will be diagnosed in future
+        self.date_pos_test[test_pos_inds] = cvu.nan_value(self.date_pos_test) # Clear date of having will-be-positive test
 
         # Handle people who were actually diagnosed today
-        diag_inds  = self.check_inds(self.diagnosed, self.date_diagnosed, filter_inds=None) # Find who was actually diagnosed on this timestep
-        self.diagnosed[diag_inds]   = True # Set these people to be diagnosed
+        diag_inds  = self.check_events('date_diagnosed', self.diagnosed) # Find who was actually diagnosed on this timestep
+        self.set_state('diagnosed', diag_inds, True) # Set these people to be diagnosed
         quarantined = cvu.itruei(self.quarantined, diag_inds)
         self.date_end_quarantine[quarantined] = self.t # Set end quarantine date to match when the person left quarantine (and entered isolation)
-        self.quarantined[diag_inds] = False # If you are diagnosed, you are isolated, not in quarantine
+        self.set_state('quarantined', diag_inds, False) # If you are diagnosed, you are isolated, not in quarantine
 
         return len(test_pos_inds)
 
@@ -341,19 +507,24 @@ class People(cvb.BasePeople):
     def check_quar(self):
         ''' Update quarantine state '''
 
-        n_quarantined = 0 # Number of people entering quarantine
+        entering = set() # People entering quarantine
+        updated = [] # People whose end of quarantine has changed
         for ind,end_day in self._pending_quarantine[self.t]:
-            if self.quarantined[ind]:
+            if self.quarantined[ind] or ind in entering:
                 self.date_end_quarantine[ind] = max(self.date_end_quarantine[ind], end_day) # Extend quarantine if required
+                updated.append(ind)
             elif not (self.dead[ind] or self.recovered[ind] or self.diagnosed[ind]): # Unclear whether recovered should be included here # elif not (self.dead[ind] or self.diagnosed[ind]):
-                self.quarantined[ind] = True
+                entering.add(ind)
                 self.date_quarantined[ind] = self.t
                 self.date_end_quarantine[ind] = end_day
-                n_quarantined += 1
+                updated.append(ind)
+        n_quarantined = len(entering)
+        self.set_state('quarantined', np.array(sorted(entering), dtype=np.int64), True)
+        self.schedule_events('date_end_quarantine', np.array(updated, dtype=np.int64))
 
         # If someone on quarantine has reached the end of their quarantine, release them
-        end_inds = self.check_inds(~self.quarantined, self.date_end_quarantine, filter_inds=None) # Note the double-negative here (~)
-        self.quarantined[end_inds] = False # Release from quarantine
+        end_inds = self.check_events('date_end_quarantine', ~self.quarantined) # Note the double-negative here (~)
+        self.set_state('quarantined', end_inds, False) # Release from quarantine
 
         return n_quarantined
 
@@ -365,16 +536,13 @@ class People(cvb.BasePeople):
         Make a set of people naive. This is used during dynamic resampling.
         '''
         for key in self.meta.states:
-            if key in ['susceptible', 'naive']:
-                self[key][inds] = True
-            else:
-                self[key][inds] = False
+            self.set_state(key, inds, key in ['susceptible', 'naive'])
 
         # Reset strain states
         for key in self.meta.strain_states:
-            self[key][inds] = np.nan
+            self[key][inds] = -1
         for key in self.meta.by_strain_states:
-            self[key][:, inds] = False
+            self.set_state(key, inds, False)
 
         # Reset immunity and antibody states
         for key in self.meta.imm_states:
@@ -386,7 +554,7 @@ class People(cvb.BasePeople):
 
         # Reset dates
         for key in self.meta.dates + self.meta.durs:
-            self[key][inds] = np.nan
+            self[key][inds] = cvu.nan_value(self[key])
 
         return
 
@@ -402,17 +570,79 @@ class People(cvb.BasePeople):
 
         # Make them non-naive
         for key in ['susceptible', 'naive']:
-            self[key][inds] = False
+            self.set_state(key, inds, False)
 
         if set_recovered:
             self.date_recovered[inds] = date_recovered # Reset date recovered
+            self.schedule_events('date_recovered', inds)
             self.check_recovered(inds=inds, filter_inds=None) # Set recovered
 
         return
 
 
+    def set_viral_switch(self, inds):
+        '''
+        Store the day on which each person's viral load drops from high to low,
+        based on their infectious, recovered, and death dates. Called on infection
+        so that the viral load on each timestep is a simple comparison (see
+        get_viral_load()).
+        '''
+        vd = self.pars['viral_dist']
+        frac_time = self.float_type(vd['frac_time'])
+        high_cap  = self.float_type(vd['high_cap'])
+        self.date_viral_switch[inds] = cvu.compute_viral_switch(self.date_infectious[inds], self.date_recovered[inds], self.date_dead[inds], frac_time, high_cap)
+        return
 
-    def infect(self, inds, hosp_max=None, icu_max=None, source=None, layer=None, strain=0):
+
+    def get_viral_load(self, inds=None):
+        '''
+        Get the viral load of each person on the current timestep. Only the people
+        in inds (by default, everyone who is infectious) are given their actual
+        viral load; everyone else is given the low viral load. The array returned
+        is a scratch buffer (see get_buffer()), so is overwritten on the next call.
+        '''
+        if inds is None:
+            inds = cvu.true(self.infectious)
+        vd = self.pars['viral_dist']
+        frac_time  = self.float_type(vd['frac_time'])
+        load_ratio = self.float_type(vd['load_ratio'])
+        load = self.get_buffer('viral_load')
+        return cvu.compute_viral_load_switch(self.t, self.date_viral_switch, np.asarray(inds, dtype=np.int64), frac_time, load_ratio, load)
+
+
+    def compute_prognoses(self, inds, infect_pars, hosp_max=None, icu_max=None, strain=0):
+        '''
+        Determine the disease course of newly infected people -- when they become
+        infectious, and whether and when they become symptomatic, severe, critical,
+        recover, or die -- in a single compiled pass (see cvu.compute_prognoses()).
+        Used by infect() with prog_mode='compiled'; statistically equivalent to the
+        default calculation, but uses Numba's random number stream.
+
+        Args:
+            inds        (array): indices of the people being infected
+            infect_pars (dict):  the relative symptomatic, severe, critical, and death probabilities for this strain
+            hosp_max    (bool):  whether or not there is an acute bed available for this person
+            icu_max     (bool):  whether or not there is an ICU bed available for this person
+            strain      (int):   the strain people are being infected by
+        '''
+        durpars = self.pars['dur']
+        dur_keys = ['exp2inf', 'asym2rec', 'inf2sym', 'mild2rec', 'sym2sev', 'sev2rec', 'sev2crit', 'crit2rec', 'crit2die']
+        dist_pars = np.array([cvu.get_dist_pars(**durpars[key]) for key in dur_keys], dtype=np.float64)
+        rel_probs = np.array([
+            infect_pars['rel_symp_prob'],
+            infect_pars['rel_severe_prob'],
+            infect_pars['rel_crit_prob'] * (self.pars['no_hosp_factor'] if hosp_max else 1.),
+            infect_pars['rel_death_prob'] * (self.pars['no_icu_factor'] if icu_max else 1.),
+        ], dtype=np.float64)
+        probs = [self.symp_prob, self.severe_prob, self.crit_prob, self.death_prob, self.symp_imm[strain,:], self.sev_imm[strain,:]]
+        durs  = [self.dur_exp2inf, self.dur_inf2sym, self.dur_sym2sev, self.dur_sev2crit, self.dur_disease]
+        dates = [self.date_infectious, self.date_symptomatic, self.date_severe, self.date_critical, self.date_recovered, self.date_dead]
+        cvu.compute_prognoses(np.asarray(inds, dtype=np.int64), self.t, dist_pars, rel_probs, *probs, *durs, *dates)
+        return
+
+
+
+    def infect(self, inds, hosp_max=None, icu_max=None, source=None, layer=None, strain=0, dedup=True):
         '''
         Infect people and determine their eventual outcomes.
 
@@ -422,7 +652,7 @@ class People(cvb.BasePeople):
             * Critical cases either recover or die
 
         Method also deduplicates input arrays in case one agent is infected many times
-        and stores who infected whom in infection_log list.
+        and stores who infected whom in the infection log.
 
         Args:
             inds     (array): array of people to infect
@@ -431,15 +661,17 @@ class People(cvb.BasePeople):
             source   (array): source indices of the people who transmitted this infection (None if an importation or seed infection)
             layer    (str):   contact layer this infection was transmitted on
             strain   (int):   the strain people are being infected by
+            dedup    (bool):  whether to remove duplicates; set to False if inds are already unique and sorted
 
         Returns:
             count (int): number of people infected
         '''
 
         # Remove duplicates
-        inds, unique = np.unique(inds, return_index=True)
-        if source is not None:
-            source = source[unique]
+        if dedup:
+            inds, unique = np.unique(inds, return_index=True)
+            if source is not None:
+                source = source[unique]
 
         # Keep only susceptibles
         keep = self.susceptible[inds] # Unique indices in inds and source that are also susceptible
@@ -462,13 +694,13 @@ class People(cvb.BasePeople):
         durpars      = self.pars['dur']
 
         # Update states, strain info, and flows
-        self.susceptible[inds]    = False
-        self.naive[inds]          = False
-        self.recovered[inds]      = False
-        self.diagnosed[inds]      = False
-        self.exposed[inds]        = True
+        self.set_state('susceptible', inds, False)
+        self.set_state('naive', inds, False)
+        self.set_state('recovered', inds, False)
+        self.set_state('diagnosed', inds, False)
+        self.set_state('exposed', inds, True)
         self.exposed_strain[inds] = strain
-        self.exposed_by_strain[strain, inds] = True
+        self.set_state('exposed_by_strain', inds, True, strain=strain)
         self.flows['new_infections']   += len(inds)
         self.flows['new_reinfections'] += len(cvu.defined(self.date_recovered[inds])) # Record reinfections
         self.flows_strain['new_infections_by_strain'][strain] += len(inds)
@@ -476,75 +708,87 @@ class People(cvb.BasePeople):
         # self.date_recovered[inds] = np.nan # Reset date they recovered - we only store the last recovery # TODO CK
 
         # Record transmissions
-        for i, target in enumerate(inds):
-            self.infection_log.append(dict(source=source[i] if source is not None else None, target=target, date=self.t, layer=layer))
-
-        # Calculate how long before this person can infect other people
-        self.dur_exp2inf[inds] = cvu.sample(**durpars['exp2inf'], size=n_infections)
-        self.date_exposed[inds]   = self.t
-        self.date_infectious[inds] = self.dur_exp2inf[inds] + self.t
+        self.infection_log.append(inds, source=source, date=self.t, layer=layer, strain=strain)
 
         # Reset all other dates
+        self.date_exposed[inds] = self.t
         for key in ['date_symptomatic', 'date_severe', 'date_critical', 'date_diagnosed', 'date_recovered']:
-            self[key][inds] = np.nan
+            self[key][inds] = cvu.nan_value(self[key])
+
+        # Determine the course of the disease in a single compiled pass
+        if self.pars['prog_mode'] == 'compiled':
+            self.compute_prognoses(inds, infect_pars, hosp_max=hosp_max, icu_max=icu_max, strain=strain)
+
+        # Or with NumPy, step by step
+        else:
 
-        # Use prognosis probabilities to determine what happens to them
-        symp_probs = infect_pars['rel_symp_prob']*self.symp_prob[inds]*(1-self.symp_imm[strain, inds]) # Calculate their actual probability of being symptomatic
-        is_symp = cvu.binomial_arr(symp_probs) # Determine if they develop symptoms
-        symp_inds = inds[is_symp]
-        asymp_inds = inds[~is_symp] # Asymptomatic
-
-        # CASE 1: Asymptomatic: may infect others, but have no symptoms and do not die
-        dur_asym2rec = cvu.sample(**durpars['asym2rec'], size=len(asymp_inds))
-        self.date_recovered[asymp_inds] = self.date_infectious[asymp_inds] + dur_asym2rec  # Date they recover
-        self.dur_disease[asymp_inds] = self.dur_exp2inf[asymp_inds] + dur_asym2rec  # Store how long this person had COVID-19
-
-        # CASE 2: Symptomatic: can either be mild, severe, or critical
-        n_symp_inds = len(symp_inds)
-        self.dur_inf2sym[symp_inds] = cvu.sample(**durpars['inf2sym'], size=n_symp_inds) # Store how long this person took to develop symptoms
-        self.date_symptomatic[symp_inds] = self.date_infectious[symp_inds] + self.dur_inf2sym[symp_inds] # Date they become symptomatic
-        sev_probs = infect_pars['rel_severe_prob'] * self.severe_prob[symp_inds]*(1-self.sev_imm[strain, symp_inds]) # Probability of these people being severe
-        # print(self.sev_imm[strain, inds])
-        is_sev = cvu.binomial_arr(sev_probs) # See if they're a severe or mild case
-        sev_inds = symp_inds[is_sev]
-        mild_inds = symp_inds[~is_sev] # Not severe
-
-        # CASE 2.1: Mild symptoms, no hospitalization required and no probability of death
-        dur_mild2rec = cvu.sample(**durpars['mild2rec'], size=len(mild_inds))
-        self.date_recovered[mild_inds] = self.date_symptomatic[mild_inds] + dur_mild2rec  # Date they recover
-        self.dur_disease[mild_inds] = self.dur_exp2inf[mild_inds] + self.dur_inf2sym[mild_inds] + dur_mild2rec  # Store how long this person had COVID-19
-
-        # CASE 2.2: Severe cases: hospitalization required, may become critical
-        self.dur_sym2sev[sev_inds] = cvu.sample(**durpars['sym2sev'], size=len(sev_inds)) # Store how long this person took to develop severe symptoms
-        self.date_severe[sev_inds] = self.date_symptomatic[sev_inds] + self.dur_sym2sev[sev_inds]  # Date symptoms become severe
-        crit_probs = infect_pars['rel_crit_prob'] * self.crit_prob[sev_inds] * (self.pars['no_hosp_factor'] if hosp_max else 1.) # Probability of these people becoming critical - higher if no beds available
-        is_crit = cvu.binomial_arr(crit_probs)  # See if they're a critical case
-        crit_inds = sev_inds[is_crit]
-        non_crit_inds = sev_inds[~is_crit]
-
-        # CASE 2.2.1 Not critical - they will recover
-        dur_sev2rec = cvu.sample(**durpars['sev2rec'], size=len(non_crit_inds))
-        self.date_recovered[non_crit_inds] = self.date_severe[non_crit_inds] + dur_sev2rec  # Date they recover
-        self.dur_disease[non_crit_inds] = self.dur_exp2inf[non_crit_inds] + self.dur_inf2sym[non_crit_inds] + self.dur_sym2sev[non_crit_inds] + dur_sev2rec  # Store how long this person had COVID-19
-
-        # CASE 2.2.2: Critical cases: ICU required, may die
-        self.dur_sev2crit[crit_inds] = cvu.sample(**durpars['sev2crit'], size=len(crit_inds))
-        self.date_critical[crit_inds] = self.date_severe[crit_inds] + self.dur_sev2crit[crit_inds]  # Date they become critical
-        death_probs = infect_pars['rel_death_prob'] * self.death_prob[crit_inds] * (self.pars['no_icu_factor'] if icu_max else 1.)# Probability they'll die
-        is_dead = cvu.binomial_arr(death_probs)  # Death outcome
-        dead_inds = crit_inds[is_dead]
-        alive_inds = crit_inds[~is_dead]
-
-        # CASE 2.2.2.1: Did not die
-        dur_crit2rec = cvu.sample(**durpars['crit2rec'], size=len(alive_inds))
-        self.date_recovered[alive_inds] = self.date_critical[alive_inds] + dur_crit2rec # Date they recover
-        self.dur_disease[alive_inds] = self.dur_exp2inf[alive_inds] + self.dur_inf2sym[alive_inds] + self.dur_sym2sev[alive_inds] + self.dur_sev2crit[alive_inds] + dur_crit2rec  # Store how long this person had COVID-19
-
-        # CASE 2.2.2.2: Did die
-        dur_crit2die = cvu.sample(**durpars['crit2die'], size=len(dead_inds))
-        self.date_dead[dead_inds] = self.date_critical[dead_inds] + dur_crit2die # Date of death
-        self.dur_disease[dead_inds] = self.dur_exp2inf[dead_inds] + self.dur_inf2sym[dead_inds] + self.dur_sym2sev[dead_inds] + self.dur_sev2crit[dead_inds] + dur_crit2die   # Store how long this person had COVID-19
-        self.date_recovered[dead_inds] = np.nan # If they did die, remove them from recovered
+            # Calculate how long before this person can infect other people
+            self.dur_exp2inf[inds] = cvu.sample(**durpars['exp2inf'], size=n_infections)
+            self.date_infectious[inds] = self.dur_exp2inf[inds] + self.t
+
+            # Use prognosis probabilities to determine what happens to them
+            symp_probs = infect_pars['rel_symp_prob']*self.symp_prob[inds]*(1-self.symp_imm[strain, inds]) # Calculate their actual probability of being symptomatic
+            is_symp = cvu.binomial_arr(symp_probs) # Determine if they develop symptoms
+            symp_inds = inds[is_symp]
+            asymp_inds = inds[~is_symp] # Asymptomatic
+
+            # CASE 1: Asymptomatic: may infect others, but have no symptoms and do not die
+            dur_asym2rec = cvu.sample(**durpars['asym2rec'], size=len(asymp_inds))
+            self.date_recovered[asymp_inds] = self.date_infectious[asymp_inds] + dur_asym2rec  # Date they recover
+            self.dur_disease[asymp_inds] = self.dur_exp2inf[asymp_inds] + dur_asym2rec  # Store how long this person had COVID-19
+
+            # CASE 2: Symptomatic: can either be mild, severe, or critical
+            n_symp_inds = len(symp_inds)
+            self.dur_inf2sym[symp_inds] = cvu.sample(**durpars['inf2sym'], size=n_symp_inds) # Store how long this person took to develop symptoms
+            self.date_symptomatic[symp_inds] = self.date_infectious[symp_inds] + self.dur_inf2sym[symp_inds] # Date they become symptomatic
+            sev_probs = infect_pars['rel_severe_prob'] * self.severe_prob[symp_inds]*(1-self.sev_imm[strain, symp_inds]) # Probability of these people being severe
+            # print(self.sev_imm[strain, inds])
+            is_sev = cvu.binomial_arr(sev_probs) # See if they're a severe or mild case
+            sev_inds = symp_inds[is_sev]
+            mild_inds = symp_inds[~is_sev] # Not severe
+
+            # CASE 2.1: Mild symptoms, no hospitalization required and no probability of death
+            dur_mild2rec = cvu.sample(**durpars['mild2rec'], size=len(mild_inds))
+            self.date_recovered[mild_inds] = self.date_symptomatic[mild_inds] + dur_mild2rec  # Date they recover
+            self.dur_disease[mild_inds] = self.dur_exp2inf[mild_inds] + self.dur_inf2sym[mild_inds] + dur_mild2rec  # Store how long this person had COVID-19
+
+            # CASE 2.2: Severe cases: hospitalization required, may become critical
+            self.dur_sym2sev[sev_inds] = cvu.sample(**durpars['sym2sev'], size=len(sev_inds)) # Store how long this person took to develop severe symptoms
+            self.date_severe[sev_inds] = self.date_symptomatic[sev_inds] + self.dur_sym2sev[sev_inds]  # Date symptoms become severe
+            crit_probs = infect_pars['rel_crit_prob'] * self.crit_prob[sev_inds] * (self.pars['no_hosp_factor'] if hosp_max else 1.) # Probability of these people becoming critical - higher if no beds available
+            is_crit = cvu.binomial_arr(crit_probs)  # See if they're a critical case
+            crit_inds = sev_inds[is_crit]
+            non_crit_inds = sev_inds[~is_crit]
+
+            # CASE 2.2.1 Not critical - they will recover
+            dur_sev2rec = cvu.sample(**durpars['sev2rec'], size=len(non_crit_inds))
+            self.date_recovered[non_crit_inds] = self.date_severe[non_crit_inds] + dur_sev2rec  # Date they recover
+            self.dur_disease[non_crit_inds] = self.dur_exp2inf[non_crit_inds] + self.dur_inf2sym[non_crit_inds] + self.dur_sym2sev[non_crit_inds] + dur_sev2rec  # Store how long this person had COVID-19
+
+            # CASE 2.2.2: Critical cases: ICU required, may die
+            self.dur_sev2crit[crit_inds] = cvu.sample(**durpars['sev2crit'], size=len(crit_inds))
+            self.date_critical[crit_inds] = self.date_severe[crit_inds] + self.dur_sev2crit[crit_inds]  # Date they become critical
+            death_probs = infect_pars['rel_death_prob'] * self.death_prob[crit_inds] * (self.pars['no_icu_factor'] if icu_max else 1.)# Probability they'll die
+            is_dead = cvu.binomial_arr(death_probs)  # Death outcome
+            dead_inds = crit_inds[is_dead]
+            alive_inds = crit_inds[~is_dead]
+
+            # CASE 2.2.2.1: Did not die
+            dur_crit2rec = cvu.sample(**durpars['crit2rec'], size=len(alive_inds))
+            self.date_recovered[alive_inds] = self.date_critical[alive_inds] + dur_crit2rec # Date they recover
+            self.dur_disease[alive_inds] = self.dur_exp2inf[alive_inds] + self.dur_inf2sym[alive_inds] + self.dur_sym2sev[alive_inds] + self.dur_sev2crit[alive_inds] + dur_crit2rec  # Store how long this person had COVID-19
+
+            # CASE 2.2.2.2: Did die
+            dur_crit2die = cvu.sample(**durpars['crit2die'], size=len(dead_inds))
+            self.date_dead[dead_inds] = self.date_critical[dead_inds] + dur_crit2die # Date of death
+            self.dur_disease[dead_inds] = self.dur_exp2inf[dead_inds] + self.dur_inf2sym[dead_inds] + self.dur_sym2sev[dead_inds] + self.dur_sev2crit[dead_inds] + dur_crit2die   # Store how long this person had COVID-19
+            self.date_recovered[dead_inds] = cvu.nan_value(self.date_recovered) # If they did die, remove them from recovered
+
+        self.set_viral_switch(inds)
+
+        # Add the new dates to the event calendar
+        for key in ['date_infectious', 'date_symptomatic', 'date_severe', 'date_critical', 'date_recovered', 'date_dead']:
+            self.schedule_events(key, inds)
 
         return n_infections # For incrementing counters
 
@@ -569,13 +813,15 @@ class People(cvb.BasePeople):
         pos_test      = cvu.n_binomial(test_sensitivity, len(is_infectious))
         is_inf_pos    = is_infectious[pos_test]
 
-        not_diagnosed = is_inf_pos[np.isnan(self.date_diagnosed[is_inf_pos])]
+        not_diagnosed = is_inf_pos[cvu.isnan(self.date_diagnosed[is_inf_pos])]
         not_lost      = cvu.n_binomial(1.0-loss_prob, len(not_diagnosed))
         final_inds    = not_diagnosed[not_lost]
 
         # Store the date the person will be diagnosed, as well as the date they took the test which will come back positive
         self.date_diagnosed[final_inds] = self.t + test_delay
         self.date_pos_test[final_inds] = self.t
+        self.schedule_events('date_diagnosed', final_inds)
+        self.schedule_events('date_pos_test', final_inds)
 
         return
 
@@ -626,12 +872,27 @@ class People(cvb.BasePeople):
         return fig
 
 
+    def log_to_df(self):
+        '''
+        Convert the infection log to a dataframe, listing the sources and targets
+        by UID, which differs from their index if the people have been reordered;
+        see InfectionLog.to_df().
+
+        **Example**::
+
+            sim = cv.Sim(pop_type='hybrid').initialize(reorder=True)
+            sim.run()
+            df = sim.people.log_to_df()
+        '''
+        return self.infection_log.to_df(uids=self.uid)
+
+
     def story(self, uid, *args):
         '''
         Print out a short history of events in the life of the specified individual.
 
         Args:
-            uid (int/list): the person or people whose story is being regaled
+            uid (int/list): the UID of the person or people whose story is being regaled
             args (list): these people will tell their stories too
 
         **Example**::
@@ -663,13 +924,14 @@ class People(cvb.BasePeople):
 
         for uid in uids:
 
-            p = self[uid]
+            ind = self.find_uids(uid)[0] # The same as the UID unless the people have been reordered
+            p = self[int(ind)]
             sex = 'female' if p.sex == 0 else 'male'
 
             intro = f'\nThis is the story of {uid}, a {p.age:.0f} year old {sex}'
 
             if not p.susceptible:
-                if np.isnan(p.date_symptomatic):
+                if cvu.isnan(p.date_symptomatic):
                     print(f'{intro}, who had asymptomatic COVID.')
                 else:
                     print(f'{intro}, who had symptomatic COVID.')
@@ -710,21 +972,24 @@ class People(cvb.BasePeople):
 
             for attribute, message in dates.items():
                 date = getattr(p,attribute)
-                if not np.isnan(date):
+                if not cvu.isnan(date):
                     events.append((date, message))
 
-            for infection in self.infection_log:
+            log = self.infection_log
+            for i in cvu.true((log.target == ind) | (log.source == ind)):
+                infection = log[i]
                 lkey = infection['layer']
                 llabel = label_lkey(lkey)
-                if infection['target'] == uid:
+                if infection['target'] == ind:
+                    source = infection['source']
                     if lkey:
-                        events.append((infection['date'], f'was infected with COVID by {infection["source"]} via the {llabel} layer'))
+                        events.append((infection['date'], f'was infected with COVID by {self.uid[source] if source is not None else None} via the {llabel} layer'))
                     else:
                         events.append((infection['date'], 'was infected with COVID as a seed infection'))
 
-                if infection['source'] == uid:
-                    x = len([a for a in self.infection_log if a['source'] == infection['target']])
-                    events.append((infection['date'],f'gave COVID to {infection["target"]} via the {llabel} layer ({x} secondary infections)'))
+                if infection['source'] == ind:
+                    x = np.count_nonzero(log.source == infection['target'])
+                    events.append((infection['date'],f'gave COVID to {self.uid[infection["target"]]} via the {llabel} layer ({x} secondary infections)'))
 
             if len(events):
                 for day, event in sorted(events, key=lambda x: x[0]):
@@ -733,3 +998,288 @@ class People(cvb.BasePeople):
                 print(f'Nothing happened to {uid} during the simulation.')
         return
 
+
+
+class InfectionLog(sc.prettyobj):
+    '''
+    A record of who infected whom, stored in a preallocated structured array
+    that grows as needed. Each entry has the source (-1 for seed infections and
+    importations), the target, the date, the layer (stored as a code; see
+    log.layer_keys), and the strain. The columns are available as arrays, e.g.
+    log.source.
+
+    For compatibility, the log can also be used as a read-only list of dicts
+    with keys 'source' (None if there is no source), 'target', 'date', 'layer',
+    and 'strain'.
+
+    Args:
+        size (int): the initial number of entries to allocate
+
+    **Examples**::
+
+        sim = cv.Sim().run()
+        log = sim.people.infection_log
+        n_hh = (log.layer == 'h').sum() # Number of infections in the household layer
+        first = log[0] # First infection, as a dict
+        df = log.to_df() # As a dataframe
+    '''
+
+    dtype = np.dtype([('source', np.int32), ('target', np.int32), ('date', np.int16), ('layer', np.uint8), ('strain', np.int8)])
+
+    def __init__(self, size=16):
+        self.data = np.empty(size, dtype=self.dtype)
+        self.n = 0
+        self.layer_keys = [] # The layer key corresponding to each layer code
+        return
+
+
+    def __len__(self):
+        return self.n
+
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self.entry(i)
+
+
+    def __getitem__(self, ind):
+        ''' Return an entry (or a list of entries for a slice) as a dict '''
+        if isinstance(ind, slice):
+            return [self.entry(i) for i in range(*ind.indices(self.n))]
+        if ind < 0:
+            ind += self.n
+        if not 0 <= ind < self.n:
+            errormsg = f'Index {ind} is out of range for an infection log with {self.n} entries'
+            raise IndexError(errormsg)
+        return self.entry(ind)
+
+
+    def __getstate__(self):
+        ''' Don't store the unused part of the array when pickling '''
+        state = self.__dict__.copy()
+        state['data'] = self.data[:self.n].copy()
+        return state
+
+
+    def entry(self, ind):
+        ''' Return a single entry as a dict '''
+        row = self.data[ind]
+        source = int(row['source'])
+        return dict(source=source if source >= 0 else None, target=int(row['target']), date=int(row['date']), layer=self.layer_keys[row['layer']], strain=int(row['strain']))
+
+
+    def append(self, target, source=None, date=0, layer=None, strain=0):
+        '''
+        Add infections to the log.
+
+        Args:
+            target (array): the people who were infected
+            source (array): the people who infected them (None if there is no source)
+            date (int): the day they were infected
+            layer (str): the layer they were infected in
+            strain (int): the strain they were infected with
+        '''
+        n_new = len(target)
+        if not n_new:
+            return
+        if layer not in self.layer_keys:
+            if len(self.layer_keys) > np.iinfo(self.dtype['layer']).max:
+                errormsg = f'Cannot add layer "{layer}": the infection log is limited to {len(self.layer_keys)} layers'
+                raise ValueError(errormsg)
+            self.layer_keys.append(layer)
+
+        # Grow the array if needed, doubling its size to keep appending fast
+        n_total = self.n + n_new
+        if n_total > len(self.data):
+            data = np.empty(max(2*len(self.data), n_total), dtype=self.dtype)
+            data[:self.n] = self.data[:self.n]
+            self.data = data
+
+        # Store the entries
+        new = self.data[self.n:n_total]
+        new['source'] = -1 if source is None else source
+        new['target'] = target
+        new['date']   = date
+        new['layer']  = self.layer_keys.index(layer)
+        new['strain'] = strain
+        self.n = n_total
+        return
+
+
+    @property
+    def source(self):
+        ''' The source of each infection, or -1 if there is no source '''
+        return self.data['source'][:self.n]
+
+    @property
+    def target(self):
+        ''' The target of each infection '''
+        return self.data['target'][:self.n]
+
+    @property
+    def date(self):
+        ''' The date of each infection '''
+        return self.data['date'][:self.n]
+
+    @property
+    def layer_code(self):
+        ''' The code for the layer of each infection; see log.layer_keys '''
+        return self.data['layer'][:self.n]
+
+    @property
+    def layer(self):
+        ''' The layer key of each infection, as an object array '''
+        keys = np.empty(len(self.layer_keys), dtype=object)
+        keys[:] = self.layer_keys
+        return keys[self.layer_code]
+
+    @property
+    def strain(self):
+        ''' The strain of each infection '''
+        return self.data['strain'][:self.n]
+
+
+    def to_df(self, uids=None):
+        '''
+        Convert the log to a dataframe, with NaN as the source if there is no source.
+
+        Args:
+            uids (array): if supplied (e.g. people.uid), list the sources and targets by UID rather than by index, which differ if the people have been reordered
+        '''
+        source = self.source
+        target = self.target
+        if uids is not None:
+            source = np.where(source >= 0, uids[source], -1)
+            target = uids[target]
+        df = pd.DataFrame(dict(
+            source = np.where(source >= 0, source, np.nan),
+            target = target,
+            date   = self.date,
+            layer  = self.layer,
+            strain = self.strain,
+        ))
+        return df
+
+
+    @classmethod
+    def from_list(cls, entries):
+        ''' Create a log from a list of dicts, e.g. from a sim saved with an earlier version of Covasim '''
+        log = cls(size=max(16, len(entries)))
+        for entry in entries:
+            source = entry['source']
+            log.append([entry['target']], source=None if source is None else [source], date=entry['date'], layer=entry['layer'], strain=entry.get('strain', 0))
+        return log
+
+
+class BufferArena(sc.prettyobj):
+    '''
+    A set of named scratch arrays that are reused from one timestep to the next,
+    rather than being allocated (and freed) each time they're needed. Usually
+    accessed via People.get_buffer().
+
+    An array is only allocated the first time a key is requested, or if the
+    requested size or type has changed since; the number of allocations is stored
+    in n_allocs, so once a simulation reaches steady state, this should stop
+    increasing. The buffers aren't saved when the people are pickled or copied.
+
+    **Example**::
+
+        n_allocs = sim.people.buffers.n_allocs
+        sim.step()
+        assert sim.people.buffers.n_allocs == n_allocs
+    '''
+
+    def __init__(self):
+        self.buffers = {}
+        self.n_allocs = 0 # Number of arrays allocated
+        return
+
+
+    def __getstate__(self):
+        ''' Don't store the buffers themselves when pickling '''
+        state = self.__dict__.copy()
+        state['buffers'] = {}
+        return state
+
+
+    def __len__(self):
+        return len(self.buffers)
+
+
+    @property
+    def nbytes(self):
+        ''' The total size of the buffers in bytes '''
+        return sum(arr.nbytes for arr in self.buffers.values())
+
+
+    def get(self, key, size, dtype=None, fill=None):
+        ''' Get the buffer for this key, allocating it if needed, and optionally fill it with a value '''
+        dtype = np.dtype(cvd.default_float if dtype is None else dtype)
+        arr = self.buffers.get(key)
+        if arr is None or len(arr) != size or arr.dtype != dtype:
+            arr = np.empty(size, dtype=dtype)
+            self.buffers[key] = arr
+            self.n_allocs += 1
+        if fill is not None:
+            arr.fill(fill)
+        return arr
+
+
+class EventCalendar(sc.prettyobj):
+    '''
+    A calendar of scheduled events, used by People if cv.options.event_calendar
+    is set. For each date key (e.g. 'date_infectious'), people are stored in a
+    bucket for the day their event is due, so the people whose events are due on
+    a given day can be found without checking everyone's dates.
+
+    Entries are not removed if a date changes, so the people returned by pop()
+    are only candidates, which still need to be checked against their actual
+    dates (see People.check_events()).
+
+    Args:
+        keys (list): the date keys to track
+        t (int): the first day that will be popped
+    '''
+
+    def __init__(self, keys, t=0):
+        self.buckets = {key:defaultdict(list) for key in keys} # Arrays of people, by key and by day
+        self.popped  = {key:t-1 for key in keys} # The last day popped for each key
+        return
+
+
+    def push(self, key, inds, dates):
+        '''
+        Schedule events for people on the specified (possibly fractional) dates;
+        undefined dates are skipped. Events on or before the last day popped are
+        scheduled for the next day that will be popped, since the check is t >= date.
+        '''
+        inds = np.asarray(inds)
+        dates = np.asarray(dates)
+        defined = ~cvu.isnan(dates)
+        inds = inds[defined]
+        if not len(inds):
+            return
+        dates = dates[defined]
+        if dates.dtype.kind == 'f':
+            dates = np.ceil(dates)
+        days = np.maximum(dates, self.popped[key]+1).astype(np.int64)
+        order = np.argsort(days, kind='stable')
+        days, inds = days[order], inds[order]
+        uniq, starts = np.unique(days, return_index=True)
+        bucket = self.buckets[key]
+        for day,group in zip(uniq, np.split(inds, starts[1:])):
+            bucket[day].append(group)
+        return
+
+
+    def pop(self, key, t):
+        ''' Remove and return the (sorted, unique) people with events due on or before day t '''
+        bucket = self.buckets[key]
+        groups = []
+        for day in range(self.popped[key]+1, t+1):
+            groups.extend(bucket.pop(day, []))
+        self.popped[key] = max(self.popped[key], t)
+        if groups:
+            return np.unique(np.concatenate(groups))
+        else:
+            return np.empty(0, dtype=np.int64)
@@ -7,14 +7,16 @@ webapp.
 '''
 
 import numpy as np
-import pylab as pl
 import sciris as sc
 import datetime as dt
-import matplotlib.ticker as ticker
 from . import misc as cvm
 from . import defaults as cvd
 from . import settings as cvset
 
+# Plotting libraries -- only imported when first used if running headless
+pl     = cvset.lazy_import('pylab')
+ticker = cvset.lazy_import('matplotlib.ticker')
+
 
 __all__ = ['date_formatter', 'plot_sim', 'plot_scens', 'plot_result', 'plot_compare', 'plot_people', 'plotly_sim', 'plotly_people', 'plotly_animate']
 
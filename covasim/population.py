@@ -5,23 +5,24 @@ Defines functions for making the population.
 #%% Imports
 import numpy as np # Needed for a few things not provided by pl
 import sciris as sc
-from collections import defaultdict
 from . import requirements as cvreq
 from . import utils as cvu
 from . import misc as cvm
 from . import data as cvdata
 from . import defaults as cvd
 from . import parameters as cvpar
+from . import base as cvb
 from . import people as cvppl
 
 
 # Specify all externally visible functions this file defines
 __all__ = ['make_people', 'make_randpop', 'make_random_contacts',
            'make_microstructured_contacts', 'make_hybrid_contacts',
+           'make_random_edges', 'make_microstructured_edges', 'make_hybrid_edges',
            'make_synthpop']
 
 
-def make_people(sim, popdict=None, save_pop=False, popfile=None, die=True, reset=False, verbose=None, **kwargs):
+def make_people(sim, popdict=None, save_pop=False, popfile=None, die=True, reset=False, reorder=None, compact=None, verbose=None, **kwargs):
     '''
     Make the actual people for the simulation. Usually called via sim.initialize(),
     not directly by the user.
@@ -33,6 +34,8 @@ def make_people(sim, popdict=None, save_pop=False, popfile=None, die=True, reset
         popfile  (bool) : if so, the filename to save to
         die      (bool) : whether or not to fail if synthetic populations are requested but not available
         reset    (bool) : whether to force population creation even if self.popdict/self.people exists
+        reorder  (bool) : whether to reorder the people so that people in contact are close together in memory (see People.reorder()); can also be the order to use
+        compact  (bool) : whether to store the static layers in a compact format that takes less memory (see cv.CompactLayer); can also be a list of the layers to do this for
         verbose  (bool) : level of detail to print
         kwargs   (dict) : passed to make_randpop() or make_synthpop()
 
@@ -87,6 +90,27 @@ def make_people(sim, popdict=None, save_pop=False, popfile=None, die=True, reset
 
     # Actually create the people
     people = cvppl.People(sim.pars, uid=popdict['uid'], age=popdict['age'], sex=popdict['sex'], contacts=popdict['contacts']) # List for storing the people
+    for lkey,n_contacts in popdict.get('mass_action', {}).items(): # Replace the (empty) random layers with implicit ones
+        people.contacts[lkey] = cvb.MassActionLayer(n_contacts=n_contacts, label=lkey)
+    for lkey,cluster_ids in popdict.get('clusters', {}).items(): # Index the members of each cluster (e.g. household), for finding contacts
+        if lkey in popdict.get('cliques', []): # Or replace the edges with the clusters themselves
+            people.contacts[lkey] = cvb.CliqueLayer(cluster_ids=cluster_ids, label=lkey)
+        else:
+            people.contacts[lkey].set_clusters(cluster_ids)
+    if reorder is not None and reorder is not False:
+        people.reorder('rcm' if reorder is True else reorder)
+    if compact is not None and compact is not False: # Replace the edges of static layers with the compact format, after reordering since this relabels them
+        if compact is True:
+            compact = [lkey for lkey,layer in people.contacts.items() if type(layer) == cvb.Layer and not sim['dynam_layer'].get(lkey, False)]
+        for lkey in sc.tolist(compact):
+            layer = people.contacts[lkey]
+            if type(layer) != cvb.Layer or sim['dynam_layer'].get(lkey, False):
+                errormsg = f'Cannot store layer "{lkey}" in the compact format, since only static layers with stored edges can be'
+                raise ValueError(errormsg)
+            compact_layer = cvb.CompactLayer(p1=layer['p1'], p2=layer['p2'], beta=layer['beta'], n=len(people), label=lkey)
+            if layer.clusters is not None:
+                compact_layer.set_clusters(layer.clusters.ids)
+            people.contacts[lkey] = compact_layer
 
     average_age = sum(popdict['age']/pop_size)
     sc.printv(f'Created {pop_size} people, average age {average_age:0.2f} years', 2, verbose)
@@ -104,7 +128,7 @@ def make_people(sim, popdict=None, save_pop=False, popfile=None, die=True, reset
     return people
 
 
-def make_randpop(sim, use_age_data=True, use_household_data=True, sex_ratio=0.5, microstructure=False):
+def make_randpop(sim, use_age_data=True, use_household_data=True, sex_ratio=0.5, microstructure=False, mass_action=None, cliques=None, vectorized=False):
     '''
     Make a random population, with contacts.
 
@@ -113,8 +137,9 @@ def make_randpop(sim, use_age_data=True, use_household_data=True, sex_ratio=0.5,
         - uid: an array of (usually consecutive) integers of length N, uniquely identifying each agent
         - age: an array of floats of length N, the age in years of each agent
         - sex: an array of integers of length N (not currently used, so does not have to be binary)
-        - contacts: list of length N listing the contacts; see make_random_contacts() for details
+        - contacts: list of length N listing the contacts, or the contact layers themselves if vectorized=True; see make_random_contacts() for details
         - layer_keys: a list of strings representing the different contact layers in the population; see make_random_contacts() for details
+        - clusters: a dictionary of arrays of length N giving the cluster (e.g. household) ID of each agent, for each microstructured layer
 
     Args:
         sim (Sim): the simulation object
@@ -122,6 +147,9 @@ def make_randpop(sim, use_age_data=True, use_household_data=True, sex_ratio=0.5,
         use_household_data (bool): whether to use location-specific household size data
         sex_ratio (float): proportion of the population that is male (not currently used)
         microstructure (bool): whether or not to use the microstructuring algorithm to group contacts
+        mass_action (bool/list): if True, don't store the contacts of the random layers ('a' for random populations, 'c' for hybrid ones), but draw the contacts of infectious people on each timestep instead (see cv.MassActionLayer); or a list of the layers to do this for
+        cliques (bool/list): if True, store the microstructured layers ('h' for hybrid populations) as the members of each cluster rather than as edges (see cv.CliqueLayer); or a list of the layers to do this for
+        vectorized (bool): if True, build the edge list of each layer directly rather than a list of contacts per person (see make_random_edges()); much faster for large populations, and gives identical contacts
 
     Returns:
         popdict (dict): a dictionary representing the population, with the following keys for a population of N agents with M contacts between them:
@@ -169,16 +197,46 @@ def make_randpop(sim, use_age_data=True, use_household_data=True, sex_ratio=0.5,
     popdict['age'] = ages
     popdict['sex'] = sexes
 
+    # Handle mass-action layers, which are created without any contacts
+    layer_contacts = sc.dcp(sim['contacts'])
+    if mass_action is True:
+        mass_action = {'random':['a'], 'hybrid':['c']}.get(microstructure, [])
+    mass_action = sc.promotetolist(mass_action) if mass_action else []
+    for lkey in mass_action:
+        if lkey not in layer_contacts or microstructure not in ['random', 'hybrid'] or (microstructure == 'hybrid' and lkey != 'c'):
+            errormsg = f'Layer "{lkey}" cannot be a mass-action layer for a "{microstructure}" population; only random layers can'
+            raise ValueError(errormsg)
+    popdict['mass_action'] = {lkey:layer_contacts[lkey] for lkey in mass_action}
+    layer_contacts.update({lkey:0 for lkey in mass_action})
+
     # Actually create the contacts
-    if   microstructure == 'random':    contacts, layer_keys    = make_random_contacts(pop_size, sim['contacts'])
-    elif microstructure == 'clustered': contacts, layer_keys, _ = make_microstructured_contacts(pop_size, sim['contacts'])
-    elif microstructure == 'hybrid':    contacts, layer_keys, _ = make_hybrid_contacts(pop_size, ages, sim['contacts'])
+    clusters = {}
+    if   microstructure == 'random'    and vectorized: contacts, layer_keys           = make_random_edges(pop_size, layer_contacts)
+    elif microstructure == 'clustered' and vectorized: contacts, layer_keys, clusters = make_microstructured_edges(pop_size, layer_contacts)
+    elif microstructure == 'hybrid'    and vectorized: contacts, layer_keys, clusters = make_hybrid_edges(pop_size, ages, layer_contacts)
+    elif microstructure == 'random':    contacts, layer_keys           = make_random_contacts(pop_size, layer_contacts)
+    elif microstructure == 'clustered': contacts, layer_keys, clusters = make_microstructured_contacts(pop_size, layer_contacts)
+    elif microstructure == 'hybrid':    contacts, layer_keys, clusters = make_hybrid_contacts(pop_size, ages, layer_contacts)
     else: # pragma: no cover
         errormsg = f'Microstructure type "{microstructure}" not found; choices are random, clustered, or hybrid'
         raise NotImplementedError(errormsg)
+    if not vectorized: # Convert the clusters from the indices of the people in each cluster to the cluster ID of each person
+        for lkey,cluster_dict in clusters.items():
+            clusters[lkey] = np.repeat(np.array(list(cluster_dict.keys()), dtype=cvd.default_int), [len(inds) for inds in cluster_dict.values()])
+
+    # Handle clique layers, which are stored as clusters
+    if cliques is True:
+        cliques = list(clusters.keys())
+    cliques = sc.promotetolist(cliques) if cliques else []
+    for lkey in cliques:
+        if lkey not in clusters:
+            errormsg = f'Layer "{lkey}" cannot be a clique layer for a "{microstructure}" population; only microstructured layers can'
+            raise ValueError(errormsg)
 
     popdict['contacts']   = contacts
     popdict['layer_keys'] = layer_keys
+    popdict['clusters']   = clusters
+    popdict['cliques']    = cliques
 
     return popdict
 
@@ -229,8 +287,34 @@ def make_random_contacts(pop_size, contacts, overshoot=1.2, dispersion=None):
     return contacts_list, layer_keys
 
 
+def get_set_sizes(n):
+    '''
+    Find the size of the hash table of a Python set of m consecutive integers, for
+    m = 0 to n. Within each cluster, people's contacts are listed in the order of such
+    a set, as in previous versions, so populations are unchanged for a given seed (see
+    utils.make_cluster_edges()). The size is the smallest power of two t for which the
+    set starting at t-1 wraps around to start at t.
+
+    Note: this relies on how CPython lays out sets of small integers (hashed by value
+    into a power-of-two table), which is an implementation detail rather than part of
+    the language. On an interpreter where it differs, clustered and hybrid populations
+    are still valid, but differ from previous versions for the same seed; the tests
+    check this against real sets (see test_other.test_cluster_order()).
+    '''
+    sizes = np.zeros(n+1, dtype=np.int64)
+    table = 8 # The minimum size of a set's table
+    for m in range(1, n+1):
+        while list(set(range(table-1, table-1+m))) != list(range(table, table-1+m)) + [table-1]:
+            table *= 2
+        sizes[m] = table
+    return sizes
+
+
 def make_microstructured_contacts(pop_size, contacts):
-    ''' Create microstructured contacts -- i.e. for households '''
+    '''
+    Create microstructured contacts -- i.e. for households. Clusters are returned
+    by layer as a dictionary of the indices of the people in each cluster.
+    '''
 
     # Preprocessing -- same as above
     pop_size = int(pop_size) # Number of people
@@ -239,35 +323,22 @@ def make_microstructured_contacts(pop_size, contacts):
     layer_keys = list(contacts.keys())
     contacts_list = [{c:[] for c in layer_keys} for p in range(pop_size)] # Pre-populate
 
+    clusters = {}
     for layer_name, cluster_size in contacts.items():
 
-        # Initialize
-        cluster_dict = dict() # Add dictionary for this layer
-        n_remaining = pop_size # Make clusters - each person belongs to one cluster
-        contacts_dict = defaultdict(set) # Use defaultdict of sets for convenience while initializing. Could probably change this as part of performance optimization
-
-        # Loop over the clusters
-        cluster_id = -1
-        while n_remaining > 0:
-            cluster_id += 1 # Assign cluster id
-            this_cluster =  cvu.poisson(cluster_size)  # Sample the cluster size
-            if this_cluster > n_remaining:
-                this_cluster = n_remaining
-
-            # Indices of people in this cluster
-            cluster_indices = (pop_size-n_remaining)+np.arange(this_cluster)
-            cluster_dict[cluster_id] = cluster_indices
-            for i in cluster_indices: # Add symmetric pairwise contacts in each cluster
-                for j in cluster_indices:
-                    if j > i:
-                        contacts_dict[i].add(j)
-
-            n_remaining -= this_cluster
-
-        for key in contacts_dict.keys():
-            contacts_list[key][layer_name] = np.array(list(contacts_dict[key]), dtype=cvd.default_int)
+        # Make clusters - each person belongs to one cluster
+        sizes = cvu.make_clusters(pop_size, cluster_size) # Sample the cluster sizes
+        cluster_indices = np.split(np.arange(pop_size), np.cumsum(sizes)[:-1]) # Indices of people in each cluster
+        clusters[layer_name] = dict(enumerate(cluster_indices))
 
-        clusters = {layer_name: cluster_dict}
+        # Add symmetric pairwise contacts in each cluster, and split them by person
+        max_size = sizes.max() if len(sizes) else 0
+        p1, p2 = cvu.make_cluster_edges(sizes, get_set_sizes(max_size))
+        counts = np.bincount(p1, minlength=pop_size)
+        p2 = np.array(p2, dtype=cvd.default_int)
+        for p,p_contacts in enumerate(np.split(p2, np.cumsum(counts)[:-1])):
+            if len(p_contacts):
+                contacts_list[p][layer_name] = p_contacts
 
     return contacts_list, layer_keys, clusters
 
@@ -315,6 +386,121 @@ def make_hybrid_contacts(pop_size, ages, contacts, school_ages=None, work_ages=N
     return contacts_list, layer_keys, clusters
 
 
+def make_random_edges(pop_size, contacts, overshoot=1.2, dispersion=None):
+    '''
+    Make random static contacts as an edge list. This takes the same random draws
+    as make_random_contacts() and gives the same contacts in the same order, but
+    builds the arrays of each layer directly rather than looping over people, so
+    is much faster for large populations.
+
+    Args:
+        pop_size (int): number of agents to create contacts between (N)
+        contacts (dict): a dictionary with one entry per layer describing the average number of contacts per person for that layer
+        overshoot (float): to avoid needing to take multiple Poisson draws
+        dispersion (float): if not None, use a negative binomial distribution with this dispersion parameter instead of Poisson to make the contacts
+
+    Returns:
+        edges (Contacts): the contacts, with one layer per key of the input "contacts" dictionary
+        layer_keys (list): a list of layer keys, which is the same as the keys of the input "contacts" dictionary
+    '''
+
+    # Preprocessing
+    pop_size = int(pop_size) # Number of people
+    contacts = sc.dcp(contacts)
+    layer_keys = list(contacts.keys())
+
+    # Precalculate contacts -- as in make_random_contacts()
+    n_across_layers = np.sum(list(contacts.values()))
+    n_all_contacts  = int(pop_size*n_across_layers*overshoot)
+    all_contacts    = cvu.choose_r(max_n=pop_size, n=n_all_contacts)
+    counts = np.zeros((pop_size, len(layer_keys)), dtype=np.int64)
+    for l,lkey in enumerate(layer_keys):
+        if dispersion is None:
+            p_count = cvu.n_poisson(contacts[lkey], pop_size)
+        else:
+            p_count = cvu.n_neg_binomial(rate=contacts[lkey], dispersion=dispersion, n=pop_size)
+        counts[:,l] = np.array((p_count/2.0).round(), dtype=cvd.default_int)
+
+    # Each person takes their contacts for each layer in turn from the list of all contacts, so find where each block starts
+    starts = (np.cumsum(counts) - counts.ravel()).reshape(counts.shape)
+
+    # Make contacts
+    edges = cvb.Contacts()
+    for l,lkey in enumerate(layer_keys):
+        n_contacts = counts[:,l]
+        n_total = n_contacts.sum()
+        offsets = np.arange(n_total) - np.repeat(np.cumsum(n_contacts) - n_contacts, n_contacts) # Position of each contact in the person's block
+        inds = np.repeat(starts[:,l], n_contacts) + offsets
+        valid = inds < n_all_contacts # Blocks that run past the end of all_contacts are truncated, as in make_random_contacts()
+        p1 = np.repeat(np.arange(pop_size), n_contacts)[valid]
+        p2 = all_contacts[inds[valid]]
+        edges[lkey] = cvb.Layer(label=lkey, p1=p1, p2=p2, beta=np.ones(len(p1)))
+
+    return edges, layer_keys
+
+
+def make_microstructured_edges(pop_size, contacts):
+    '''
+    Create microstructured contacts as an edge list. As with make_random_edges(),
+    this gives the same contacts as make_microstructured_contacts(), but builds the
+    arrays of each layer directly. Clusters are returned by layer as the cluster ID
+    of each person.
+    '''
+
+    # Preprocessing -- same as above
+    pop_size = int(pop_size) # Number of people
+    contacts = sc.dcp(contacts)
+    contacts.pop('c', None) # Remove community
+    layer_keys = list(contacts.keys())
+    edges = cvb.Contacts()
+    clusters = {}
+
+    for layer_name, cluster_size in contacts.items():
+        sizes = cvu.make_clusters(pop_size, cluster_size) # Sample the cluster sizes
+        max_size = sizes.max() if len(sizes) else 0
+        p1, p2 = cvu.make_cluster_edges(sizes, get_set_sizes(max_size)) # Add symmetric pairwise contacts in each cluster
+        edges[layer_name] = cvb.Layer(label=layer_name, p1=p1, p2=p2, beta=np.ones(len(p1)))
+        clusters[layer_name] = np.repeat(np.arange(len(sizes), dtype=cvd.default_int), sizes)
+
+    return edges, layer_keys, clusters
+
+
+def make_hybrid_edges(pop_size, ages, contacts, school_ages=None, work_ages=None):
+    '''
+    Create "hybrid" contacts as an edge list; see make_hybrid_contacts() and make_random_edges().
+    '''
+
+    # Handle inputs and defaults
+    layer_keys = ['h', 's', 'w', 'c']
+    contacts = sc.mergedicts({'h':4, 's':20, 'w':20, 'c':20}, contacts) # Ensure essential keys are populated
+    if school_ages is None:
+        school_ages = [6, 22]
+    if work_ages is None:
+        work_ages   = [22, 65]
+
+    # Make the household and community contacts, in the same order as make_hybrid_contacts()
+    h_edges, _, clusters = make_microstructured_edges(pop_size, {'h':contacts['h']})
+    c_edges, _ = make_random_edges(pop_size, {'c':contacts['c']})
+
+    # Get the indices of people in each age bin
+    ages = np.array(ages)
+    s_inds = sc.findinds((ages >= school_ages[0]) * (ages < school_ages[1]))
+    w_inds = sc.findinds((ages >= work_ages[0])   * (ages < work_ages[1]))
+
+    # Create the school and work contacts, and map them back onto the whole population
+    s_edges, _ = make_random_edges(len(s_inds), {'s':contacts['s']})
+    w_edges, _ = make_random_edges(len(w_inds), {'w':contacts['w']})
+    for layer,inds in [(s_edges['s'], s_inds), (w_edges['w'], w_inds)]:
+        for key in ['p1', 'p2']:
+            layer[key] = np.array(inds[layer[key]], dtype=layer.meta[key])
+
+    edges = cvb.Contacts()
+    for lkey,layer_edges in zip(layer_keys, [h_edges, s_edges, w_edges, c_edges]):
+        edges[lkey] = layer_edges[lkey]
+
+    return edges, layer_keys, clusters
+
+
 
 def make_synthpop(sim=None, population=None, layer_mapping=None, community_contacts=None, **kwargs):
     '''
@@ -9,14 +9,17 @@ import sciris as sc
 from collections import defaultdict
 from . import misc as cvm
 from . import defaults as cvd
+from . import utils as cvu
 from . import base as cvb
 from . import sim as cvs
+from . import interventions as cvi
+from . import immunity as cvimm
 from . import plotting as cvplt
 from .settings import options as cvo
 
 
 # Specify all externally visible functions this file defines
-__all__ = ['make_metapars', 'MultiSim', 'Scenarios', 'single_run', 'multi_run']
+__all__ = ['make_metapars', 'MultiSim', 'Ensemble', 'Scenarios', 'single_run', 'multi_run']
 
 
 
@@ -831,6 +834,281 @@ class MultiSim(cvb.FlexPretty):
         return self.base_sim.to_excel(*args, **kwargs)
 
 
+class Ensemble(MultiSim):
+    '''
+    Class for running multiple replicates of a simulation together in a single
+    process. Whereas a MultiSim runs each sim separately (usually in separate
+    processes), the replicates in an ensemble share the same population and
+    static contact layers, and are stepped forward together: people's states are
+    stored in arrays with a leading replicate axis (see ensemble.people_arrays),
+    and transmission in each shared static layer is calculated for all replicates
+    with a single call. This uses much less memory than a MultiSim for large
+    populations, and avoids the overhead of creating and pickling each sim.
+
+    Note that only transmission in the shared layers is batched: the rest of each
+    timestep (updating states, interventions, immunity, and infecting people) is
+    still run for each replicate in turn. Layers that interventions can change,
+    i.e. those used by clip_edges() and all layers if there are custom interventions
+    (which may edit the contacts), are copied for each replicate rather than shared.
+
+    Replicate i uses the random seed of the base sim plus i. Transmission is
+    calculated with trans_mode='fused' and trans_rng='counter', and each replicate
+    has its own random number stream for everything else, which is switched in
+    whenever that replicate is updated (see replicates()). Each replicate therefore
+    gives the same results as a separate sim with the same seed, population, and
+    transmission options, regardless of the number of replicates, unless parallel
+    random numbers are used (cv.options.numba_parallel='full'). Once run, an
+    ensemble can be used in the same way as a MultiSim (e.g. reduce() and plot()).
+
+    Args:
+        sim         (Sim)  : the sim to replicate
+        n_runs      (int)  : the number of replicates
+        label       (str)  : the name of the ensemble
+        keep_people (bool) : whether to keep the people after the run
+        verbose     (int)  : detail to print
+
+    **Example**::
+
+        sim = cv.Sim(pop_size=100e3)
+        ens = cv.Ensemble(sim, n_runs=32)
+        ens.run()
+        ens.reduce()
+        ens.plot()
+    '''
+
+    def __init__(self, sim, n_runs=4, label=None, keep_people=False, verbose=None):
+        if not isinstance(sim, cvs.Sim):
+            errormsg = f'An ensemble must be created from a single sim, not {type(sim)}'
+            raise TypeError(errormsg)
+        super().__init__(sims=sim, label=label)
+        self.n_runs        = n_runs
+        self.keep_people   = keep_people
+        self.verbose       = verbose
+        self.people_arrays = None # The people's states for all replicates, with a leading replicate axis
+        self.shared_layers = None # The keys of the static layers shared by all replicates; see init_sims()
+        self.rng_states    = None # The state of each replicate's random number streams; see replicates()
+        return
+
+
+    def init_sims(self):
+        '''
+        Create and initialize the replicates. The population is created once, and
+        each replicate is initialized with its own seed, sharing the population's
+        static layers (dynamic layers, and layers that interventions can change,
+        are copied, since they can differ between replicates; see changed_layers()).
+        The people's states are then moved into arrays with a leading replicate axis,
+        with the people in each replicate storing views into them. Called automatically
+        by run().
+        '''
+        base_sim = self.base_sim
+        if base_sim['rand_seed'] is None:
+            errormsg = 'An ensemble requires the base sim to have a random seed, since the seeds of the replicates are offset from it'
+            raise ValueError(errormsg)
+
+        # Create the population
+        base = base_sim.copy()
+        base.update_pars(trans_mode='fused', trans_rng='counter', verbose=0)
+        base.initialize()
+        popdict = dict(uid=base.people.uid, age=base.people.age, sex=base.people.sex, contacts=cvb.Contacts())
+        contacts = base.people.contacts
+        changed = self.changed_layers(base)
+        self.shared_layers = [lkey for lkey,layer in contacts.items() if not (base['dynam_layer'].get(lkey, False) or layer.dynamic or lkey in changed)]
+
+        # Create the replicates
+        sims = []
+        for r in range(self.n_runs):
+            sim = base_sim.copy()
+            sim.people = None
+            sim.popdict = None
+            sim.update_pars(rand_seed=base_sim['rand_seed']+r, trans_mode='fused', trans_rng='counter', verbose=0)
+            if not sim.label:
+                sim.label = f'Sim {r:d}'
+            sim.initialize(popdict=popdict)
+            sim._orig_pars = sc.dcp(sim.pars) # As in sim.run()
+            for lkey,layer in contacts.items():
+                sim.people.contacts[lkey] = layer if lkey in self.shared_layers else sc.dcp(layer)
+            sims.append(sim)
+
+        # Store people's states with a leading replicate axis
+        self.people_arrays = sc.objdict()
+        for key in sims[0].people.keys():
+            arrs = [sim.people[key] for sim in sims]
+            if isinstance(arrs[0], cvb.BitArray): # States stored as bits (see cv.options.packed_states) are stacked as bits
+                self.people_arrays[key] = cvb.BitArray(shape=(len(sims),) + arrs[0].shape, words=np.stack([arr.words for arr in arrs]))
+            else:
+                self.people_arrays[key] = np.stack(arrs)
+            for r,sim in enumerate(sims):
+                sim.people[key] = self.people_arrays[key][r]
+
+        # Start each replicate's random number streams from its seed, as sim.run() does
+        self.rng_states = []
+        for sim in sims:
+            sim.set_seed()
+            self.rng_states.append(cvu.get_rng_state())
+
+        self.sims = sims
+        cvu.set_seed(base_sim['rand_seed']) # Reset the seed so the random number stream is consistent
+        return
+
+
+    def replicates(self):
+        '''
+        Iterate over the replicates, as (index, sim) pairs, switching to each
+        replicate's own random number streams while it's being updated and saving
+        them afterwards, so the random numbers a replicate draws don't depend on
+        the others.
+        '''
+        for r,sim in enumerate(self.sims):
+            cvu.set_rng_state(self.rng_states[r])
+            yield r, sim
+            self.rng_states[r] = cvu.get_rng_state()
+        return
+
+
+    @staticmethod
+    def changed_layers(sim):
+        '''
+        Return the keys of the layers that the sim's interventions can change, and
+        which therefore can't be shared between replicates: the layers used by
+        clip_edges(), and all layers if there are custom interventions.
+        '''
+        lkeys = list(sim.people.contacts.keys())
+        changed = set()
+        for intervention in sc.promotetolist(sim['interventions']):
+            if isinstance(intervention, cvi.clip_edges):
+                changed.update(lkeys if intervention.layers is None else sc.promotetolist(intervention.layers))
+            elif type(intervention).__module__ != cvi.__name__: # Custom interventions, including functions, may edit any layer
+                changed.update(lkeys)
+        return changed
+
+
+    def run(self, reduce=False, combine=False, verbose=None):
+        '''
+        Run the replicates.
+
+        Args:
+            reduce  (bool): whether or not to reduce after running (see reduce())
+            combine (bool): whether or not to combine after running (see combine(), not compatible with reduce)
+            verbose (int):  detail to print
+
+        Returns:
+            The ensemble (modified in place)
+        '''
+        T = sc.tic()
+        if verbose is None:
+            verbose = self.verbose if self.verbose is not None else self.base_sim['verbose']
+        if self.people_arrays is None:
+            self.init_sims()
+
+        # Main simulation loop
+        sims = self.sims
+        while not sims[0].complete:
+            t = sims[0].t
+            if verbose:
+                elapsed = sc.toc(T, output=True)
+                string = f'  Running ensemble of {len(sims)} sims: {sims[0].datevec[t]} ({t:2.0f}/{sims[0]["n_days"]}) ({elapsed:0.2f} s) '
+                if not (t % int(1.0/verbose)):
+                    sc.progressbar(t+1, sims[0].npts, label=string, length=20, newline=True)
+            self.step()
+
+        # Finalize the results
+        for sim in sims:
+            sim.finalize(verbose=0)
+            if not self.keep_people:
+                sim.shrink()
+        if not self.keep_people:
+            self.people_arrays = None
+
+        # Reduce or combine
+        if reduce:
+            self.reduce()
+        elif combine:
+            self.combine()
+
+        return self
+
+
+    def step(self):
+        ''' Step all the replicates forward in time; see sim.step() '''
+        if self.sims[0].complete:
+            raise cvs.AlreadyRunError('Ensemble already complete')
+        bed_limits = [sim.step_states() for r,sim in self.replicates()]
+        self.compute_transmission(bed_limits)
+        for r,sim in self.replicates():
+            sim.step_results()
+        return
+
+
+    def compute_transmission(self, bed_limits):
+        '''
+        Calculate transmission for all replicates; see sim.compute_transmission().
+        Each shared static layer is the same for all the replicates, so its infections
+        are calculated for all replicates at once, while other layers are calculated
+        for each replicate separately.
+
+        Args:
+            bed_limits (list): for each replicate, whether the acute bed and ICU constraints are active
+        '''
+        sims = self.sims
+        arrs = self.people_arrays
+        base = sims[0]
+        n_reps = len(sims)
+        n_people = len(base.people)
+        t = base.t
+
+        # Check immunity
+        for sim in sims:
+            if sim['use_waning']:
+                for strain in range(sim['n_strains']):
+                    cvimm.check_immunity(sim.people, strain, sus=True)
+
+        # Compute viral loads for all replicates at once
+        ftype, itype = base.people.float_type, base.people.int_type # All replicates have the same precision as the base sim
+        frac_time  = ftype(base['viral_dist']['frac_time'])
+        load_ratio = ftype(base['viral_dist']['load_ratio'])
+        infectious = np.asarray(arrs.infectious) # Unpack the states if they're stored as bits
+        all_inds   = cvu.true(infectious.reshape(-1))
+        viral_load = np.empty(n_reps*n_people, dtype=ftype)
+        viral_load = cvu.compute_viral_load_switch(t, arrs.date_viral_switch.reshape(-1), all_inds, frac_time, load_ratio, viral_load).reshape(n_reps, n_people)
+
+        # Compute relative transmission and susceptibility, excluding the layer-specific factors
+        asymp_factor = np.array([[sim['asymp_factor']] for sim in sims], dtype=ftype)
+        f_asymp      = np.where(np.asarray(arrs.symptomatic), ftype(1.0), asymp_factor)
+        rel_trans    = np.where(infectious, arrs.rel_trans * f_asymp * viral_load, 0).astype(ftype)
+        rel_sus      = (arrs.rel_sus * np.asarray(arrs.susceptible)).astype(ftype)
+        strains      = np.where(infectious, arrs.infectious_strain, 0).astype(itype)
+        strain_betas = np.array([sim.get_strain_betas() for sim in sims], dtype=ftype)
+        keys         = np.array([sim.get_trans_key() for sim in sims], dtype=np.uint64)
+        inf_inds     = [cvu.true(row) for row in infectious]
+        inf_ptr      = np.concatenate([[0], np.cumsum([len(inds) for inds in inf_inds])]).astype(np.int64)
+        all_inf_inds = np.concatenate(inf_inds).astype(np.int64)
+
+        # Calculate candidate infections for each layer
+        candidates = [[] for r in range(n_reps)]
+        for l,lkey in enumerate(base.people.contacts.keys()):
+            if lkey not in self.shared_layers or isinstance(base.people.contacts[lkey], (cvb.CliqueLayer, cvb.CompactLayer)): # Each replicate has its own copy of dynamic and changed layers, and clique and compact layers are calculated per replicate
+                for r,sim in enumerate(sims):
+                    candidates[r].append(sim.compute_layer_infections(l, lkey, rel_trans[r], rel_sus[r], strains[r], strain_betas[r], inf_inds[r], key=keys[r]))
+            else:
+                layer = base.people.contacts[lkey]
+                index = layer.get_index(n_people)
+                layer_pars = [np.array([sim[par][lkey] for sim in sims], dtype=ftype) for par in ['beta_layer', 'iso_factor', 'quar_factor']]
+                args = (layer['beta'], *layer_pars, rel_trans, rel_sus, np.asarray(arrs.diagnosed), np.asarray(arrs.quarantined), strains, strain_betas, arrs.sus_imm, keys, np.uint64(t), np.uint64(l))
+                rep_inds, source_inds, target_inds, strain_inds, slot_inds = cvu.compute_infections_ensemble(index.indptr, index.slots, layer['p1'], layer['p2'], all_inf_inds, inf_ptr, *args)
+                order = np.lexsort((slot_inds, rep_inds)) # Sort by slot within each replicate, as in sim.compute_layer_infections()
+                bounds = np.searchsorted(rep_inds[order], np.arange(n_reps+1))
+                for r in range(n_reps):
+                    o = order[bounds[r]:bounds[r+1]]
+                    candidates[r].append((source_inds[o], target_inds[o], strain_inds[o]))
+
+        # Infect people
+        for r,sim in self.replicates():
+            hosp_max, icu_max = bed_limits[r]
+            sim.infect_candidates(candidates[r], hosp_max=hosp_max, icu_max=icu_max)
+
+        return
+
+
 class Scenarios(cvb.ParsObj):
     '''
     Class for running multiple sets of multiple simulations -- e.g., scenarios.
@@ -10,12 +10,54 @@ To reset default options, use::
 '''
 
 import os
-import pylab as pl
+import importlib
 import sciris as sc
 
 __all__ = ['options']
 
 
+class LazyModule:
+    '''
+    A stand-in for a module that is only imported when one of its attributes is
+    first accessed; see lazy_import().
+    '''
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        return
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not yet loaded'
+        return f'<lazy module "{self._name}" ({state})>'
+
+
+def lazy_import(name):
+    '''
+    Import a module used only by some functions (e.g. pylab for plotting). Normally
+    the module is imported immediately, but with ``options.headless``, it's only
+    imported the first time it's used -- not for users.
+
+    **Example**::
+
+        pl = lazy_import('pylab')
+    '''
+    if options.headless:
+        return LazyModule(name)
+    else:
+        return importlib.import_module(name)
+
+
 def set_default_options():
     '''
     Set the default options for Covasim -- not to be called by the user, use
@@ -26,6 +68,19 @@ def set_default_options():
     optdesc = sc.objdict() # Help for the options
     options = sc.objdict() # The options
 
+    optdesc.headless = 'Set whether to import Covasim without plotting libraries (Matplotlib and SciPy are imported when first used) and compile the Numba functions when the first sim is initialized, for faster imports; must be set via the environment variable before import'
+    options.headless = bool(int(os.getenv('COVASIM_HEADLESS', 0)))
+
+    # Matplotlib defaults: don't import pylab if running headless
+    if options.headless:
+        import matplotlib as mpl # Does not import pyplot
+        rc = mpl.rcParams
+        backend = 'agg'
+    else:
+        import pylab as pl
+        rc = pl.rcParams
+        backend = pl.get_backend()
+
     optdesc.verbose = 'Set default level of verbosity (i.e. logging detail)'
     options.verbose = float(os.getenv('COVASIM_VERBOSE', 0.1))
 
@@ -36,29 +91,53 @@ def set_default_options():
     options.close = int(os.getenv('COVASIM_CLOSE', False))
 
     optdesc.backend = 'Set the Matplotlib backend (use "agg" for non-interactive)'
-    options.backend = os.getenv('COVASIM_BACKEND', pl.get_backend())
+    options.backend = os.getenv('COVASIM_BACKEND', backend)
 
     optdesc.interactive = 'Convenience method to set figure backend, showing, and closing behavior'
     options.interactive = os.getenv('COVASIM_INTERACTIVE', True)
 
     optdesc.dpi = 'Set the default DPI -- the larger this is, the larger the figures will be'
-    options.dpi = int(os.getenv('COVASIM_DPI', pl.rcParams['figure.dpi']))
+    options.dpi = int(os.getenv('COVASIM_DPI', rc['figure.dpi']))
 
     optdesc.font_size = 'Set the default font size'
-    options.font_size = int(os.getenv('COVASIM_FONT_SIZE', pl.rcParams['font.size']))
+    options.font_size = int(os.getenv('COVASIM_FONT_SIZE', rc['font.size']))
 
     optdesc.font_family = 'Set the default font family (e.g., Arial)'
-    options.font_family = os.getenv('COVASIM_FONT_FAMILY', pl.rcParams['font.family'])
+    options.font_family = os.getenv('COVASIM_FONT_FAMILY', rc['font.family'])
 
-    optdesc.precision = 'Set arithmetic precision for Numba -- 32-bit by default for efficiency'
+    optdesc.precision = 'Set arithmetic precision for people and contacts created from now on -- 32-bit by default for efficiency, 64-bit for validation; no reload is needed'
     options.precision = int(os.getenv('COVASIM_PRECISION', 32))
 
-    optdesc.numba_parallel = 'Set Numba multithreading -- none, safe, full; full multithreading is ~20% faster, but results become nondeterministic'
+    optdesc.numba_parallel = 'Set Numba multithreading -- none, safe, full; full multithreading is ~20% faster, but results become nondeterministic (except for transmission with trans_rng="counter")'
     options.numba_parallel = str(os.getenv('COVASIM_NUMBA_PARALLEL', 'none'))
 
     optdesc.numba_cache = 'Set Numba caching -- saves on compilation time, but harder to update'
     options.numba_cache = bool(int(os.getenv('COVASIM_NUMBA_CACHE', 1)))
 
+    optdesc.numba_cache_dir = 'Set the folder for the Numba cache, e.g. one created by cv.precompile() (default: Numba\'s own location, next to the source files)'
+    options.numba_cache_dir = os.getenv('COVASIM_NUMBA_CACHE_DIR', None)
+
+    optdesc.numba_report = 'Set whether to print which Numba functions were loaded from the cache and which were compiled when Covasim is imported (see cv.cache_report())'
+    options.numba_report = bool(int(os.getenv('COVASIM_NUMBA_REPORT', 0)))
+
+    optdesc.threads = 'Set the number of threads used to calculate transmission in different layers at the same time -- only used with trans_mode="fused" and trans_rng="counter", where the results are identical to using a single thread, and with numba_parallel="none"'
+    options.threads = int(os.getenv('COVASIM_THREADS', 1))
+
+    optdesc.event_calendar = 'Set whether to find state changes (e.g. becoming infectious) using a calendar of scheduled events rather than by checking everyone\'s dates each day -- faster for large populations, but dates set directly rather than via People methods must be scheduled with people.schedule_events()'
+    options.event_calendar = bool(int(os.getenv('COVASIM_EVENT_CALENDAR', 0)))
+
+    optdesc.packed_states = 'Set whether to store people\'s boolean states (e.g. infectious) as bits rather than bytes, for people created from now on -- 8 times less memory for these states, but slower to access them (see cv.BitArray)'
+    options.packed_states = bool(int(os.getenv('COVASIM_PACKED_STATES', 0)))
+
+    optdesc.int_dates = 'Set whether to store people\'s dates and durations (e.g. date_infectious) as 16-bit integer days rather than floats, for people created from now on -- 2-4 times less memory for these arrays, but fractional dates are truncated, and undefined dates are stored as cv.defaults.date_nan rather than NaN'
+    options.int_dates = bool(int(os.getenv('COVASIM_INT_DATES', 0)))
+
+    optdesc.stock_counts = 'Set whether to keep count of the number of people in each state (e.g. exposed) as states change rather than recounting everyone each day -- faster for large populations, but states changed other than via People methods (e.g. people.set_state()) are miscounted'
+    options.stock_counts = bool(int(os.getenv('COVASIM_STOCK_COUNTS', 0)))
+
+    optdesc.check_counts = 'Set whether to check the number of people in each state against a full recount on each timestep, if stock_counts is set (for debugging)'
+    options.check_counts = bool(int(os.getenv('COVASIM_CHECK_COUNTS', 0)))
+
     return options, optdesc
 
 
@@ -68,7 +147,7 @@ orig_options = sc.dcp(options) # Make a copy for referring back to later
 
 # Specify which keys require a reload
 matplotlib_keys = ['font_size', 'font_family', 'dpi', 'backend']
-numba_keys = ['precision', 'numba_parallel', 'numba_cache']
+numba_keys = ['numba_parallel', 'numba_cache', 'numba_cache_dir']
 
 
 def set_option(key=None, value=None, **kwargs):
@@ -84,6 +163,7 @@ def set_option(key=None, value=None, **kwargs):
 
     Options are (see also ``cv.options.help()``):
 
+        - headless:       whether to defer importing plotting libraries and compiling Numba functions (environment variable only)
         - verbose:        default verbosity for simulations to use
         - font_size:      the font size used for the plots
         - font_family:    the font family/face used for the plots
@@ -92,9 +172,17 @@ def set_option(key=None, value=None, **kwargs):
         - close:          whether to close the figures
         - backend:        which Matplotlib backend to use
         - interactive:    convenience method to set show, close, and backend
-        - precision:      the arithmetic to use in calculations
+        - precision:      the arithmetic to use in calculations, for sims created from now on
         - numba_parallel: whether to parallelize Numba functions
         - numba_cache:    whether to cache (precompile) Numba functions
+        - numba_cache_dir: where to store the Numba cache
+        - numba_report:   whether to report which Numba functions were loaded from the cache on import
+        - threads:        the number of threads to use for transmission with trans_rng="counter"
+        - event_calendar: whether to use a calendar of scheduled events to update people's states
+        - packed_states:  whether to store people's boolean states as bits, for people created from now on
+        - int_dates:      whether to store people's dates and durations as integer days, for people created from now on
+        - stock_counts:   whether to keep count of the number of people in each state as states change
+        - check_counts:   whether to check the number of people in each state against a full recount
 
     **Examples**::
 
@@ -135,6 +223,8 @@ def set_option(key=None, value=None, **kwargs):
         else:
             if value in [None, 'default']:
                 value = orig_options[key]
+            if key == 'precision':
+                set_precision(value)
             options[key] = value
             if key in numba_keys:
                 reload_required = True
@@ -208,10 +298,18 @@ def handle_show(do_show):
         if options.backend == 'agg': # Cannot show plots for a non-interactive backend
             do_show = False
     if do_show: # Now check whether to show
+        import pylab as pl
         pl.show()
     return do_show
 
 
+def set_precision(precision):
+    ''' Set the data types used for new sims -- not necessary to call directly if cv.options.set() is used '''
+    from . import defaults as cvd # Not imported at the top since defaults depends on this module
+    cvd.set_precision(int(precision))
+    return
+
+
 def reload_numba():
     '''
     Apply changes to Numba functions -- reloading modules is necessary for
@@ -220,10 +318,7 @@ def reload_numba():
     **Example**::
 
         import covasim as cv
-        cv.options.set(precision=64)
-        sim = cv.Sim()
-        sim.run()
-        assert sim.people.rel_trans.dtype == np.float64
+        cv.options.set(numba_parallel='safe')
     '''
     print('Reloading Covasim so changes take effect...')
     import importlib
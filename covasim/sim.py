@@ -16,6 +16,7 @@ from . import plotting as cvplt
 from . import interventions as cvi
 from . import immunity as cvimm
 from . import analysis as cva
+from .settings import options as cvo
 
 # Almost everything in this file is contained in the Sim class
 __all__ = ['Sim', 'diff_sims', 'demo', 'AlreadyRunError']
@@ -106,6 +107,7 @@ class Sim(cvb.BaseSim):
             kwargs (dict): passed to init_people
         '''
         self.t = 0  # The current time index
+        cvu.compile_lazy() # If running headless, compile the Numba functions if this is the first sim
         self.validate_pars() # Ensure parameters have valid values
         self.set_seed() # Reset the random seed before the population is created
         self.init_strains() # Initialize the strains
@@ -248,6 +250,29 @@ class Sim(cvb.BaseSim):
             errormsg = f'Population type "{choice}" not available; choices are: {choicestr}'
             raise ValueError(errormsg)
 
+        # Handle the transmission engine
+        trans_choices = ['layered', 'fused', 'hazard']
+        choice = self['trans_mode']
+        if choice not in trans_choices:
+            choicestr = ', '.join(trans_choices)
+            errormsg = f'Transmission mode "{choice}" not available; choices are: {choicestr}'
+            raise ValueError(errormsg)
+        rng_choices = ['stream', 'counter']
+        choice = self['trans_rng']
+        if choice not in rng_choices:
+            choicestr = ', '.join(rng_choices)
+            errormsg = f'Transmission random number generator "{choice}" not available; choices are: {choicestr}'
+            raise ValueError(errormsg)
+        if choice == 'counter' and self['trans_mode'] == 'layered':
+            errormsg = 'Counter-based random numbers (trans_rng="counter") are not available with trans_mode="layered"; use trans_mode="fused" or "hazard" instead'
+            raise ValueError(errormsg)
+        prog_choices = ['exact', 'compiled']
+        choice = self['prog_mode']
+        if choice not in prog_choices:
+            choicestr = ', '.join(prog_choices)
+            errormsg = f'Prognosis mode "{choice}" not available; choices are: {choicestr}'
+            raise ValueError(errormsg)
+
         # Handle interventions, analyzers, and strains
         self['interventions'] = sc.promotetolist(self['interventions'], keepnone=False)
         for i,interv in enumerate(self['interventions']):
@@ -556,19 +581,103 @@ class Sim(cvb.BaseSim):
         if self.complete:
             raise AlreadyRunError('Simulation already complete (call sim.initialize() to re-run)')
 
+        people = self.people
+        hosp_max, icu_max = self.step_states()
+
+        # Compute viral loads
+        viral_load = people.get_viral_load()
+
+        # Shorten useful parameters
+        ns = self['n_strains'] # Shorten number of strains
+        prel_trans = people.rel_trans
+        prel_sus = people.rel_sus
+
+        # Calculate transmission in a single pass over each layer
+        if self['trans_mode'] in ['fused', 'hazard']:
+            self.compute_transmission(viral_load, hosp_max=hosp_max, icu_max=icu_max)
+
+        # Iterate through n_strains to calculate infections
+        else:
+            ptr, strain_inds = cvu.group_strains(people.infectious_strain, cvu.true(people.infectious), ns) # Find who is infectious with each strain in a single pass
+            for strain in range(ns):
+
+                # Check immunity
+                if self['use_waning']:
+                    cvimm.check_immunity(people, strain, sus=True)
+
+                # Deal with strain parameters
+                rel_beta = self['rel_beta']
+                asymp_factor = self['asymp_factor']
+                if strain:
+                    strain_label = self.pars['strain_map'][strain]
+                    rel_beta *= self['strain_pars'][strain_label]['rel_beta']
+                beta = people.float_type(self['beta'] * rel_beta)
+
+                # Find who is infectious with this strain, using scratch arrays rather than allocating new ones
+                inf_inds = strain_inds[ptr[strain]:ptr[strain+1]]
+                inf_strain = people.get_buffer('inf_strain', dtype=bool, fill=False)
+                inf_strain[inf_inds] = True
+                sus_imm = people.sus_imm[strain,:]
+                out_trans = people.get_buffer('rel_trans')
+                out_sus   = people.get_buffer('rel_sus')
+
+                for lkey, layer in people.contacts.items():
+                    p1 = layer['p1']
+                    p2 = layer['p2']
+                    betas = layer['beta']
+
+                    # Compute relative transmission and susceptibility, unpacking the states if they're stored as bits (see cv.BitArray), since infections in previous layers change them
+                    sus  = np.asarray(people.susceptible)
+                    symp = np.asarray(people.symptomatic)
+                    diag = np.asarray(people.diagnosed)
+                    quar = np.asarray(people.quarantined)
+                    iso_factor  = people.float_type(self['iso_factor'][lkey])
+                    quar_factor = people.float_type(self['quar_factor'][lkey])
+                    beta_layer  = people.float_type(self['beta_layer'][lkey])
+                    rel_trans, rel_sus = cvu.compute_trans_sus(prel_trans, prel_sus, inf_strain, sus, beta_layer, viral_load, symp, diag, quar, asymp_factor, iso_factor, quar_factor, sus_imm, out_trans, out_sus)
+
+                    # Calculate actual transmission
+                    if isinstance(layer, cvb.CliqueLayer): # Both directions are calculated at once, from each infectious person to the rest of their cluster
+                        clusters = layer.clusters
+                        source_inds, target_inds = cvu.compute_infections_cliques(beta, clusters.indptr, clusters.members, clusters.ids, inf_inds, clusters.beta, rel_trans, rel_sus)
+                        people.infect(inds=target_inds, hosp_max=hosp_max, icu_max=icu_max, source=source_inds, layer=lkey, strain=strain)
+                        continue
+                    if isinstance(layer, cvb.CompactLayer): # Likewise, from each infectious person to each of their contacts
+                        adjacency = layer.adjacency
+                        source_inds, target_inds = cvu.compute_infections_compact(beta, adjacency.indptr, adjacency.contacts, inf_inds, adjacency.beta, rel_trans, rel_sus)
+                        people.infect(inds=target_inds, hosp_max=hosp_max, icu_max=icu_max, source=source_inds, layer=lkey, strain=strain)
+                        continue
+                    for sources, targets in [[p1, p2], [p2, p1]]:  # Loop over the contact network from p1->p2 and p2->p1
+                        source_inds, target_inds = cvu.compute_infections(beta, sources, targets, betas, rel_trans, rel_sus)  # Calculate transmission!
+                        people.infect(inds=target_inds, hosp_max=hosp_max, icu_max=icu_max, source=source_inds, layer=lkey, strain=strain)  # Actually infect people
+
+        self.step_results()
+
+        return
+
+
+    def step_states(self):
+        '''
+        The first part of sim.step(): rescale the population, update people's states
+        and contacts, and apply importations, strains, and interventions. Usually
+        called by sim.step() rather than directly by the user.
+
+        Returns:
+            hosp_max, icu_max (bool): whether the acute bed and ICU constraints are active
+        '''
         t = self.t
 
         # Perform initial operations
         self.rescale() # Check if we need to rescale
         people   = self.people # Shorten this for later use
         people.update_states_pre(t=t) # Update the state of everyone and count the flows
-        contacts = people.update_contacts() # Compute new contacts
-        hosp_max = people.count('severe')   > self['n_beds_hosp'] if self['n_beds_hosp'] else False # Check for acute bed constraint
-        icu_max  = people.count('critical') > self['n_beds_icu']  if self['n_beds_icu']  else False # Check for ICU bed constraint
+        people.update_contacts() # Compute new contacts
+        hosp_max = people.count_stock('severe')   > self['n_beds_hosp'] if self['n_beds_hosp'] else False # Check for acute bed constraint
+        icu_max  = people.count_stock('critical') > self['n_beds_icu']  if self['n_beds_icu']  else False # Check for ICU bed constraint
 
         # Randomly infect some people (imported infections)
         if self['n_imports']:
-            n_imports = cvu.poisson(self['n_imports']/self.rescale_vec[self.t]) # Imported cases
+            n_imports = cvu.poisson(people.float_type(self['n_imports']/self.rescale_vec[self.t])) # Imported cases
             if n_imports>0:
                 importation_inds = cvu.choose(max_n=self['pop_size'], n=n_imports)
                 people.infect(inds=importation_inds, hosp_max=hosp_max, icu_max=icu_max, layer='importation')
@@ -593,75 +702,36 @@ class Sim(cvb.BaseSim):
 
         people.update_states_post() # Check for state changes after interventions
 
-        # Compute viral loads
-        frac_time = cvd.default_float(self['viral_dist']['frac_time'])
-        load_ratio = cvd.default_float(self['viral_dist']['load_ratio'])
-        high_cap = cvd.default_float(self['viral_dist']['high_cap'])
-        date_inf = people.date_infectious
-        date_rec = people.date_recovered
-        date_dead = people.date_dead
-        viral_load = cvu.compute_viral_load(t, date_inf, date_rec, date_dead, frac_time, load_ratio, high_cap)
-
-        # Shorten useful parameters
-        ns = self['n_strains'] # Shorten number of strains
-        sus = people.susceptible
-        symp = people.symptomatic
-        diag = people.diagnosed
-        quar = people.quarantined
-        prel_trans = people.rel_trans
-        prel_sus = people.rel_sus
-
         # Check nabs. Take set difference so we don't compute nabs for anyone currently infected
         if self['use_waning']:
             has_nabs = np.setdiff1d(cvu.defined(people.init_nab), cvu.false(people.susceptible))
             if len(has_nabs): cvimm.check_nab(t, people, inds=has_nabs)
 
-        # Iterate through n_strains to calculate infections
-        for strain in range(ns):
-
-            # Check immunity
-            if self['use_waning']:
-                cvimm.check_immunity(people, strain, sus=True)
-
-            # Deal with strain parameters
-            rel_beta = self['rel_beta']
-            asymp_factor = self['asymp_factor']
-            if strain:
-                strain_label = self.pars['strain_map'][strain]
-                rel_beta *= self['strain_pars'][strain_label]['rel_beta']
-            beta = cvd.default_float(self['beta'] * rel_beta)
-
-            for lkey, layer in contacts.items():
-                p1 = layer['p1']
-                p2 = layer['p2']
-                betas = layer['beta']
+        return hosp_max, icu_max
 
-                # Compute relative transmission and susceptibility
-                inf_strain = people.infectious * (people.infectious_strain == strain) # TODO: move out of loop?
-                sus_imm = people.sus_imm[strain,:]
-                iso_factor  = cvd.default_float(self['iso_factor'][lkey])
-                quar_factor = cvd.default_float(self['quar_factor'][lkey])
-                beta_layer  = cvd.default_float(self['beta_layer'][lkey])
-                rel_trans, rel_sus = cvu.compute_trans_sus(prel_trans, prel_sus, inf_strain, sus, beta_layer, viral_load, symp, diag, quar, asymp_factor, iso_factor, quar_factor, sus_imm)
 
-                # Calculate actual transmission
-                for sources, targets in [[p1, p2], [p2, p1]]:  # Loop over the contact network from p1->p2 and p2->p1
-                    source_inds, target_inds = cvu.compute_infections(beta, sources, targets, betas, rel_trans, rel_sus)  # Calculate transmission!
-                    people.infect(inds=target_inds, hosp_max=hosp_max, icu_max=icu_max, source=source_inds, layer=lkey, strain=strain)  # Actually infect people
+    def step_results(self):
+        '''
+        The last part of sim.step(): store the results for this timestep, apply
+        the analyzers, and advance the time. Usually called by sim.step() rather
+        than directly by the user.
+        '''
+        t = self.t
+        people = self.people
 
         # Update counts for this time step: stocks
+        if cvo.check_counts:
+            people.check_counts()
         for key in cvd.result_stocks.keys():
-            self.results[f'n_{key}'][t] = people.count(key)
+            self.results[f'n_{key}'][t] = people.count_stock(key)
         for key in cvd.result_stocks_by_strain.keys():
-            for strain in range(ns):
-                self.results['strain'][f'n_{key}'][strain, t] = people.count_by_strain(key, strain)
+            self.results['strain'][f'n_{key}'][:, t] = people.count_stock(key)
 
         # Update counts for this time step: flows
         for key,count in people.flows.items():
             self.results[key][t] += count
         for key,count in people.flows_strain.items():
-            for strain in range(ns):
-                self.results['strain'][key][strain][t] += count[strain]
+            self.results['strain'][key][:, t] += count
 
         # Update nab and immunity for this time step
         inds_alive = cvu.false(people.dead)
@@ -690,6 +760,272 @@ class Sim(cvb.BaseSim):
         return
 
 
+    def compute_transmission(self, viral_load, hosp_max=False, icu_max=False):
+        '''
+        Calculate transmission for all strains and both directions of each layer
+        in a single pass over the layer's edges; used when trans_mode='fused' or
+        'hazard' (see compute_hazard_infections()).
+        For static layers, only the edges of infectious people are visited, using
+        the layer's neighbor index (see Layer.make_index()). With trans_rng='counter',
+        random numbers are keyed by the seed, day, layer, and edge, so results are
+        the same however the edges are visited, including in parallel; in this case,
+        the layers are also calculated at the same time if cv.options.threads > 1.
+
+        Candidate infections are deduplicated so that each person is infected at
+        most once, giving priority to lower strain numbers and then to earlier
+        layers, as in the layered calculation. Usually called by sim.step() rather
+        than directly by the user.
+
+        Args:
+            viral_load (array): the viral load of each person on this timestep
+            hosp_max (bool): whether the acute bed constraint is active
+            icu_max (bool): whether the ICU bed constraint is active
+        '''
+        people = self.people
+        ns = self['n_strains']
+
+        # Check immunity
+        if self['use_waning']:
+            for strain in range(ns):
+                cvimm.check_immunity(people, strain, sus=True)
+
+        # Compute relative transmission and susceptibility, excluding the layer-specific factors
+        inf_inds = cvu.true(people.infectious)
+        f_asymp = np.where(people.symptomatic[inf_inds], 1.0, self['asymp_factor'])
+        rel_trans = people.get_buffer('rel_trans', fill=0)
+        rel_trans[inf_inds] = people.rel_trans[inf_inds] * f_asymp * viral_load[inf_inds]
+        rel_sus = np.multiply(people.rel_sus, people.susceptible, out=people.get_buffer('rel_sus'))
+        strains = people.get_buffer('strains', dtype=people.int_type, fill=0)
+        strains[inf_inds] = people.infectious_strain[inf_inds]
+        strain_betas = self.get_strain_betas()
+
+        # Alternatively, calculate each person's total hazard of infection
+        if self['trans_mode'] == 'hazard':
+            self.compute_hazard_infections(rel_trans, rel_sus, strains, strain_betas, inf_inds, hosp_max=hosp_max, icu_max=icu_max)
+            return
+
+        # Calculate candidate infections for each layer, then infect people
+        key = self.get_trans_key()
+        layer_args = [(l, lkey, rel_trans, rel_sus, strains, strain_betas, inf_inds, key) for l,lkey in enumerate(people.contacts.keys())]
+        pool = get_thread_pool() if key is not None else None # Only use threads if the results don't depend on which thread draws which random numbers
+        if pool is not None and len(layer_args) > 1:
+            candidates = list(pool.map(lambda args: self.compute_layer_infections(*args), layer_args)) # Results are in layer order, so they're merged as for a single thread
+        else:
+            candidates = [self.compute_layer_infections(*args) for args in layer_args]
+        self.infect_candidates(candidates, hosp_max=hosp_max, icu_max=icu_max)
+
+        return
+
+
+    def get_strain_betas(self):
+        ''' Return the overall beta for each strain, i.e. beta*rel_beta; used by compute_transmission() '''
+        ns = self['n_strains']
+        strain_betas = np.zeros(ns, dtype=self.people.float_type)
+        for strain in range(ns):
+            rel_beta = self['rel_beta']
+            if strain:
+                strain_label = self.pars['strain_map'][strain]
+                rel_beta *= self['strain_pars'][strain_label]['rel_beta']
+            strain_betas[strain] = self['beta'] * rel_beta
+        return strain_betas
+
+
+    def get_trans_key(self):
+        ''' Return the key for counter-based random numbers if trans_rng='counter', else None; used by compute_transmission() '''
+        if self['trans_rng'] != 'counter':
+            return None
+        key = self['rand_seed'] if self['rand_seed'] is not None else np.random.randint(2**62)
+        return np.uint64(key)
+
+
+    def compute_layer_infections(self, l, lkey, rel_trans, rel_sus, strains, strain_betas, inf_inds, key=None):
+        '''
+        Calculate the candidate infections in a single layer, for all strains and in
+        both directions; used by compute_transmission().
+
+        Args:
+            l (int): the index of the layer, used as the random number stream
+            lkey (str): the layer key
+            rel_trans (array): relative transmissibility of each person, 0 for noninfectious people
+            rel_sus (array): relative susceptibility of each person, 0 for nonsusceptible people
+            strains (array): the strain each infectious person is infected with
+            strain_betas (array): the overall beta for each strain (see get_strain_betas())
+            inf_inds (array): the indices of infectious people
+            key (uint64): the key for counter-based random numbers (see get_trans_key()); if None, use the random number stream
+
+        Returns:
+            source_inds, target_inds, strain_inds (arrays): the candidate infections
+        '''
+        people = self.people
+        layer = people.contacts[lkey]
+        iso_factor  = people.float_type(self['iso_factor'][lkey])
+        quar_factor = people.float_type(self['quar_factor'][lkey])
+        beta_layer  = people.float_type(self['beta_layer'][lkey])
+        args = (layer['beta'], beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, np.asarray(people.diagnosed), np.asarray(people.quarantined), strains, strain_betas, people.sus_imm)
+
+        # Clique layers visit the other members of each infectious person's cluster
+        if isinstance(layer, cvb.CliqueLayer):
+            clusters = layer.clusters
+            edges = (clusters.indptr, clusters.members, clusters.ids, inf_inds)
+            args = (clusters.beta,) + args[1:]
+            if key is not None:
+                rng = (key, np.uint64(self.t), np.uint64(l))
+                source_inds, target_inds, strain_inds, slot_inds = cvu.compute_infections_cliques_counter(*edges, *args, *rng)
+                order = np.argsort(slot_inds)
+                return source_inds[order], target_inds[order], strain_inds[order]
+            else:
+                return cvu.compute_infections_cliques_fused(*edges, *args)
+
+        # Compact layers visit the contacts of each infectious person directly
+        if isinstance(layer, cvb.CompactLayer):
+            adjacency = layer.adjacency
+            edges = (adjacency.indptr, adjacency.contacts, inf_inds)
+            args = (adjacency.beta,) + args[1:]
+            if key is not None:
+                rng = (key, np.uint64(self.t), np.uint64(l))
+                source_inds, target_inds, strain_inds, slot_inds = cvu.compute_infections_compact_counter(*edges, *args, *rng)
+                order = np.argsort(slot_inds)
+                return source_inds[order], target_inds[order], strain_inds[order]
+            else:
+                return cvu.compute_infections_compact_fused(*edges, *args)
+
+        dynamic = self['dynam_layer'].get(lkey, False) or layer.dynamic # Dynamic layers change every timestep, so walk the edges directly; otherwise, only visit the edges of infectious people
+        if dynamic:
+            edges = (layer['p1'], layer['p2'])
+        else:
+            index = layer.get_index(len(people))
+            edges = (index.indptr, index.slots, layer['p1'], layer['p2'], inf_inds)
+        if key is not None: # Sort by slot so the order doesn't depend on how the edges were visited
+            rng = (key, np.uint64(self.t), np.uint64(l))
+            if dynamic:
+                source_inds, target_inds, strain_inds, slot_inds = cvu.compute_infections_counter(*edges, *args, *rng)
+            else:
+                source_inds, target_inds, strain_inds, slot_inds = cvu.compute_infections_index_counter(*edges, *args, *rng)
+                order = np.argsort(slot_inds)
+                source_inds, target_inds, strain_inds = source_inds[order], target_inds[order], strain_inds[order]
+        else:
+            if dynamic:
+                source_inds, target_inds, strain_inds = cvu.compute_infections_fused(*edges, *args)
+            else:
+                source_inds, target_inds, strain_inds = cvu.compute_infections_index(*edges, *args)
+        return source_inds, target_inds, strain_inds
+
+
+    def compute_hazard_infections(self, rel_trans, rel_sus, strains, strain_betas, inf_inds, hosp_max=False, icu_max=False):
+        '''
+        Calculate transmission by adding up each person's hazard of infection,
+        -log(1-beta), over the edges of all layers, then drawing one random number
+        per exposed person to decide whether they're infected, and one more per newly
+        infected person to pick who infected them (in proportion to the hazard along
+        each edge, see cvu.compute_hazards()); used when trans_mode='hazard'.
+
+        Each person's probability of infection is the same as with the other modes,
+        1 minus the product of 1-beta over the edges, but far fewer random numbers
+        are drawn, and since each person is infected at most once, the infections
+        don't need to be deduplicated.
+
+        Args:
+            rel_trans, rel_sus, strains, strain_betas, inf_inds: as for compute_layer_infections()
+            hosp_max (bool): whether the acute bed constraint is active
+            icu_max (bool): whether the ICU bed constraint is active
+        '''
+        people     = self.people
+        hazard     = people.get_buffer('hazard', dtype=np.float64, fill=0)
+        thresholds = people.get_buffer('hazard_thresholds', dtype=np.float64, fill=np.inf)
+        sources    = people.get_buffer('hazard_sources', dtype=people.int_type)
+        layers     = people.get_buffer('hazard_layers', dtype=people.int_type)
+
+        diag = np.asarray(people.diagnosed) # Unpack the states if they're stored as bits (see cv.BitArray)
+        quar = np.asarray(people.quarantined)
+
+        def scan_layers():
+            for l,lkey in enumerate(people.contacts.keys()):
+                layer = people.contacts[lkey]
+                iso_factor  = people.float_type(self['iso_factor'][lkey])
+                quar_factor = people.float_type(self['quar_factor'][lkey])
+                beta_layer  = people.float_type(self['beta_layer'][lkey])
+                args = (layer['beta'], beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, people.sus_imm, l, hazard, thresholds, sources, layers)
+                if isinstance(layer, cvb.CliqueLayer):
+                    clusters = layer.clusters
+                    cvu.compute_hazards_cliques(clusters.indptr, clusters.members, clusters.ids, inf_inds, clusters.beta, *args[1:])
+                elif isinstance(layer, cvb.CompactLayer):
+                    adjacency = layer.adjacency
+                    cvu.compute_hazards_compact(adjacency.indptr, adjacency.contacts, inf_inds, adjacency.beta, *args[1:])
+                elif self['dynam_layer'].get(lkey, False) or layer.dynamic:
+                    cvu.compute_hazards(layer['p1'], layer['p2'], *args)
+                else:
+                    index = layer.get_index(len(people))
+                    cvu.compute_hazards_index(index.indptr, index.slots, layer['p1'], layer['p2'], inf_inds, *args)
+            return
+
+        # Calculate everyone's total hazard, and draw who is infected
+        scan_layers()
+        exposed = cvu.true(hazard)
+        totals  = hazard[exposed]
+        key = self.get_trans_key()
+        draws = self.draw_hazard_randoms(exposed, key=key, stream=0)
+        infected = draws < -np.expm1(-totals) # The probability of at least one transmission
+        inds, totals = exposed[infected], totals[infected]
+        if not len(inds):
+            return
+
+        # Repeat the calculation to find who infected each person
+        hazard[exposed] = 0
+        thresholds[inds] = self.draw_hazard_randoms(inds, key=key, stream=1) * totals
+        scan_layers()
+        inf_sources = sources[inds]
+        inf_layers  = layers[inds]
+        inf_strains = strains[inf_sources]
+
+        # Infect people, one batch per strain and layer
+        for strain in range(self['n_strains']):
+            for l,lkey in enumerate(people.contacts.keys()):
+                batch = cvu.true((inf_strains == strain) & (inf_layers == l))
+                if len(batch):
+                    people.infect(inds=inds[batch], hosp_max=hosp_max, icu_max=icu_max, source=inf_sources[batch], layer=lkey, strain=strain, dedup=False)
+
+        return
+
+
+    def draw_hazard_randoms(self, inds, key=None, stream=0):
+        ''' Draw a uniform random number for each person in inds, from the stream or keyed by person if trans_rng='counter'; used by compute_hazard_infections() '''
+        if key is None:
+            return np.random.random(len(inds))
+        else:
+            return cvu.counter_randoms(key, np.uint64(self.t), np.uint64(stream), inds.astype(np.int64))
+
+
+    def infect_candidates(self, candidates, hosp_max=False, icu_max=False):
+        '''
+        Infect people from the candidate infections in each layer, keeping only the
+        first infection of each person, ordered by strain, then layer, then edge;
+        used by compute_transmission().
+
+        Args:
+            candidates (list): for each layer, the source, target, and strain indices of the candidate infections
+            hosp_max (bool): whether the acute bed constraint is active
+            icu_max (bool): whether the ICU bed constraint is active
+        '''
+        sources     = np.concatenate([c[0] for c in candidates])
+        targets     = np.concatenate([c[1] for c in candidates])
+        inf_strains = np.concatenate([c[2] for c in candidates])
+        layers      = np.concatenate([np.full(len(c[1]), l) for l,c in enumerate(candidates)])
+
+        # Keep only the first infection of each target, ordered by strain, then layer, then edge
+        order = np.argsort(inf_strains, kind='stable')
+        _, first = np.unique(targets[order], return_index=True)
+        keep = np.sort(order[first])
+
+        # Infect people, one batch per strain and layer
+        for strain in range(self['n_strains']):
+            for l,lkey in enumerate(self.people.contacts.keys()):
+                batch = keep[(inf_strains[keep] == strain) & (layers[keep] == l)]
+                if len(batch):
+                    self.people.infect(inds=targets[batch], hosp_max=hosp_max, icu_max=icu_max, source=sources[batch], layer=lkey, strain=strain)
+
+        return
+
+
     def run(self, do_plot=False, until=None, restore_pars=True, reset_seed=True, verbose=None):
         '''
         Run the simulation.
@@ -711,6 +1047,7 @@ class Sim(cvb.BaseSim):
         if not self.initialized:
             self.initialize()
             self._orig_pars = sc.dcp(self.pars) # Create a copy of the parameters, to restore after the run, in case they are dynamically modified
+        cvu.compile_lazy() # Likewise, e.g. for a sim loaded from disk
 
         if verbose is None:
             verbose = self['verbose']
@@ -919,11 +1256,11 @@ class Sim(cvb.BaseSim):
             # Find the dates that everyone became infectious and recovered, and hence calculate infectious duration
             recov_inds   = self.people.defined('date_recovered')
             dead_inds    = self.people.defined('date_dead')
-            date_recov   = self.people.date_recovered[recov_inds]
-            date_dead    = self.people.date_dead[dead_inds]
+            date_recov   = cvu.to_float(self.people.date_recovered[recov_inds])
+            date_dead    = cvu.to_float(self.people.date_dead[dead_inds])
             date_outcome = np.concatenate((date_recov, date_dead))
             inds         = np.concatenate((recov_inds, dead_inds))
-            date_inf     = self.people.date_infectious[inds]
+            date_inf     = cvu.to_float(self.people.date_infectious[inds])
             mean_inf     = date_outcome.mean() - date_inf.mean()
 
             # Calculate R_eff as the mean infectious duration times the number of new infectious divided by the number of infectious people on a given day
@@ -946,7 +1283,7 @@ class Sim(cvb.BaseSim):
         elif method in ['infectious', 'outcome']:
 
             # Store a mapping from each source to their date
-            source_dates = {}
+            source_dates = np.full(len(self.people), -1, dtype=np.int64)
 
             for t in self.tvec:
 
@@ -960,18 +1297,13 @@ class Sim(cvb.BaseSim):
                 sources[t] = len(inds)
 
                 # Create the mapping from sources to dates
-                for ind in inds:
-                    source_dates[ind] = t
-
-            # Targets are hard -- loop over the transmission tree
-            for transdict in self.people.infection_log:
-                source = transdict['source']
-                if source is not None and source in source_dates: # Skip seed infections and people with e.g. recovery after the end of the sim
-                    source_date = source_dates[source]
-                    targets[source_date] += 1
+                source_dates[inds] = t
 
-                # for ind in inds:
-                #     targets[t] += len(self.people.transtree.targets[ind])
+            # Targets are hard -- count the infections in the log by the date of their source
+            log = self.people.infection_log
+            log_dates = source_dates[log.source[log.source >= 0]]
+            log_dates = log_dates[log_dates >= 0] # Skip seed infections and people with e.g. recovery after the end of the sim
+            targets += np.bincount(log_dates, minlength=self.npts)[:self.npts]
 
             # Populate the array -- to avoid divide-by-zero, skip indices that are 0
             r_eff = np.divide(targets, sources, out=np.full(self.npts, np.nan), where=sources > 0)
@@ -1004,28 +1336,22 @@ class Sim(cvb.BaseSim):
             gen_time (dict): the generation time results
         '''
 
-        intervals1 = np.zeros(len(self.people))
-        intervals2 = np.zeros(len(self.people))
-        pos1 = 0
-        pos2 = 0
-        date_exposed = self.people.date_exposed
-        date_symptomatic = self.people.date_symptomatic
-
-        for infection in self.people.infection_log:
-            if infection['source'] is not None:
-                source_ind = infection['source']
-                target_ind = infection['target']
-                intervals1[pos1] = date_exposed[target_ind] - date_exposed[source_ind]
-                pos1 += 1
-                if np.isfinite(date_symptomatic[source_ind]) and np.isfinite(date_symptomatic[target_ind]):
-                    intervals2[pos2] = date_symptomatic[target_ind] - date_symptomatic[source_ind]
-                    pos2 += 1
+        log = self.people.infection_log
+        has_source = log.source >= 0
+        source_inds = log.source[has_source]
+        target_inds = log.target[has_source]
+        date_exposed = cvu.to_float(self.people.date_exposed)
+        date_symptomatic = cvu.to_float(self.people.date_symptomatic)
+
+        intervals1 = np.array(date_exposed[target_inds] - date_exposed[source_inds], dtype=np.float64)
+        intervals2 = np.array(date_symptomatic[target_inds] - date_symptomatic[source_inds], dtype=np.float64)
+        intervals2 = intervals2[np.isfinite(intervals2)]
 
         self.results['gen_time'] = {
-                'true':         np.mean(intervals1[:pos1]),
-                'true_std':     np.std(intervals1[:pos1]),
-                'clinical':     np.mean(intervals2[:pos2]),
-                'clinical_std': np.std(intervals2[:pos2])}
+                'true':         np.mean(intervals1),
+                'true_std':     np.std(intervals1),
+                'clinical':     np.mean(intervals2),
+                'clinical_std': np.std(intervals2)}
         return self.results['gen_time']
 
 
@@ -1490,6 +1816,25 @@ def demo(preset=None, to_plot=None, scens=None, run_args=None, plot_args=None, *
         raise NotImplementedError(errormsg)
 
 
+thread_pools = {} # Shared by all sims, by number of threads
+
+
+def get_thread_pool():
+    '''
+    Return the thread pool used to calculate transmission in different layers at
+    the same time, or None if cv.options.threads is 1 or Numba parallelization is
+    on (since its default threading layer can't run functions from several threads
+    at once). The Numba functions used release the GIL.
+    '''
+    n_threads = cvo.threads
+    if n_threads <= 1 or cvu.safe_parallel:
+        return None
+    if n_threads not in thread_pools:
+        from concurrent.futures import ThreadPoolExecutor
+        thread_pools[n_threads] = ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix='covasim')
+    return thread_pools[n_threads]
+
+
 class AlreadyRunError(RuntimeError):
     '''
     This error is raised if a simulation is run in such a way that no timesteps
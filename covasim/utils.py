@@ -10,18 +10,22 @@ at the heart of the integration loop.
 import numba  as nb # For faster computations
 import numpy  as np # For numerics
 import random # Used only for resetting the seed
-import scipy.stats as sps # For distributions
 from .settings import options as cvo # To set options
-from . import defaults as cvd # To set default types
+from .settings import lazy_import # To defer imports
+from . import defaults as cvd # For the integer date type
+sps = lazy_import('scipy.stats') # For distributions; only imported when first used if running headless
 
 
 # What functions are externally visible -- note, this gets populated in each section below
 __all__ = []
 
-# Set dtypes -- note, these cannot be changed after import since Numba functions are precompiled
+# Set dtypes -- signatures are written in 32-bit types, and each function is also compiled with nbint and nbfloat widened to 64 bits (see njit())
 nbbool  = nb.bool_
-nbint   = cvd.nbint
-nbfloat = cvd.nbfloat
+nbint   = nb.int32
+nbfloat = nb.float32
+nbdate  = nb.from_dtype(cvd.date_int) # For dates stored as integers; see cv.options.int_dates
+nbstrain = nb.from_dtype(cvd.strain_int) # For people's strains, e.g. people.exposed_strain
+widen   = {nbint:nb.int64, nbfloat:nb.float64}
 
 # Specify whether to allow parallel Numba calculation -- 10% faster for safe and 20% faster for random, but the random number stream becomes nondeterministic for the latter
 safe_opts = [1, '1', 'safe']
@@ -32,11 +36,146 @@ if cvo.numba_parallel not in [0, 1, 2, '0', '1', '2', 'none', 'safe', 'full']:
     errormsg = f'Numba parallel must be "none", "safe", or "full", not "{cvo.numba_parallel}"'
     raise ValueError(errormsg)
 cache = cvo.numba_cache # Turning this off can help switching parallelization options
+if cvo.numba_cache_dir: # Use a shared cache, e.g. one created by precompile(), rather than the default location next to the source files
+    nb.config.CACHE_DIR = cvo.numba_cache_dir
+
+
+def widen_signature(signature):
+    ''' Return the 64-bit version of a 32-bit signature, e.g. (nbint, nbfloat[:]) -> (nb.int64, nb.float64[:]) '''
+    def widen_type(nbtype):
+        if isinstance(nbtype, nb.types.Array):
+            return nbtype.copy(dtype=widen.get(nbtype.dtype, nbtype.dtype))
+        return widen.get(nbtype, nbtype)
+    return tuple(widen_type(nbtype) for nbtype in signature)
+
+
+# With cv.options.headless, the signatures of each Numba function that are still to be compiled; see compile_lazy()
+lazy_kernels = {}
+
+
+def njit(signature=None, **kwargs):
+    '''
+    Wrapper for nb.njit() used by the functions below. Each function with an explicit
+    signature is compiled for both 32 and 64 bit precision, and Numba picks the version
+    that matches the arrays it's given, so sims with either precision can be run in
+    the same session (see cv.options.precision). A list of signatures can also be
+    given, e.g. for dates stored as either floats or integers (see cv.options.int_dates),
+    in which case each is compiled for both precisions. Normally, all versions are
+    compiled (or loaded from the cache) on import; with cv.options.headless, they
+    are instead compiled when the first sim is initialized or run (see compile_lazy()),
+    so results are identical, but importing Covasim is faster.
+    '''
+    if signature is None:
+        return nb.njit(**kwargs)
+
+    signatures = signature if isinstance(signature, list) else [signature]
+    signatures = signatures + [widen_signature(sig) for sig in signatures]
+    if not cvo.headless:
+        return nb.njit(signatures, **kwargs)
+
+    def decorator(func):
+        dispatcher = nb.njit(**kwargs)(func)
+        lazy_kernels[dispatcher] = signatures
+        return dispatcher
+
+    return decorator
+
+
+def compile_lazy():
+    '''
+    With cv.options.headless, compile the Numba functions that njit() has deferred,
+    as nb.njit() does on import otherwise. Called automatically when a sim is
+    initialized or run; does nothing if there is nothing left to compile. Before
+    then, functions that are called directly are compiled for the exact types of
+    their arguments, as for nb.njit() without a signature.
+    '''
+    pending = list(lazy_kernels.items())
+    lazy_kernels.clear()
+    for dispatcher,signatures in pending:
+        dispatcher.disable_compile(False) # In case it's been compiled since, e.g. as part of another function
+        for sig in signatures:
+            dispatcher.compile(sig)
+    for dispatcher,signatures in pending:
+        dispatcher.disable_compile() # As nb.njit() does, so other types are converted to the signatures rather than compiled
+    return
+
+
+#%% Dates -- stored as floats, or as integers if cv.options.int_dates is set
+
+date_nan = int(cvd.date_nan) # Undefined integer dates
+
+
+def isnan(arr):
+    '''
+    Like np.isnan(), but also works for dates stored as integers (see cv.options.int_dates),
+    where undefined dates are stored as cv.defaults.date_nan. Can also be used on
+    single values in Numba functions.
+
+    **Example**::
+
+        cv.utils.isnan(np.array([3, cv.defaults.date_nan, 4], dtype=np.int16)) # Returns array([False, True, False])
+    '''
+    arr = np.asarray(arr)
+    if arr.dtype.kind == 'f':
+        return np.isnan(arr)
+    return arr == date_nan
+
+
+def nan_value(arr):
+    '''
+    Return the value used for undefined entries of the array: NaN for floats, or
+    cv.defaults.date_nan for dates stored as integers. Can also be used in Numba functions.
+
+    **Example**::
+
+        people.date_recovered[inds] = cv.utils.nan_value(people.date_recovered)
+    '''
+    if np.asarray(arr).dtype.kind == 'f':
+        return np.nan
+    return date_nan
+
+
+def to_float(arr):
+    '''
+    Return dates as floats, with NaN for undefined dates, so they can be used in
+    calculations (e.g. intervals between dates); float arrays are returned unchanged.
+    '''
+    arr = np.asarray(arr)
+    if arr.dtype.kind == 'f':
+        return arr
+    out = arr.astype(cvd.default_float)
+    out[arr == date_nan] = np.nan
+    return out
+
+
+@nb.extending.overload(isnan)
+def isnan_compiled(x): # pragma: no cover
+    ''' The Numba version of isnan() '''
+    if isinstance(x, nb.types.Integer):
+        return lambda x: x == date_nan
+    return lambda x: np.isnan(x)
+
+
+@nb.extending.overload(nan_value)
+def nan_value_compiled(arr): # pragma: no cover
+    ''' The Numba version of nan_value() '''
+    if isinstance(arr.dtype, nb.types.Integer):
+        return lambda arr: date_nan
+    return lambda arr: np.nan
+
 
 
 #%% The core Covasim functions -- compute the infections
 
-@nb.njit(             (nbint, nbfloat[:], nbfloat[:],     nbfloat[:], nbfloat,   nbfloat,    nbfloat), cache=cache, parallel=safe_parallel)
+@njit(cache=cache)
+def grow(arr, size): # pragma: no cover
+    ''' Return a copy of a 1D array resized to the given size, for output arrays of unknown length '''
+    out = np.empty(size, dtype=arr.dtype)
+    out[:len(arr)] = arr
+    return out
+
+
+@njit(                (nbint, nbfloat[:], nbfloat[:],     nbfloat[:], nbfloat,   nbfloat,    nbfloat), cache=cache, parallel=safe_parallel)
 def compute_viral_load(t,     time_start, time_recovered, time_dead,  frac_time, load_ratio, high_cap): # pragma: no cover
     '''
     Calculate relative transmissibility for time t. Includes time varying
@@ -57,7 +196,7 @@ def compute_viral_load(t,     time_start, time_recovered, time_dead,  frac_time,
 
     # Get the end date from recover or death
     n = len(time_dead)
-    time_stop = np.ones(n, dtype=cvd.default_float)*time_recovered # This is needed to make a copy
+    time_stop = np.ones(n, dtype=time_start.dtype)*time_recovered # This is needed to make a copy
     inds = ~np.isnan(time_dead)
     time_stop[inds] = time_dead[inds]
 
@@ -68,29 +207,108 @@ def compute_viral_load(t,     time_start, time_recovered, time_dead,  frac_time,
     cap_frac = high_cap/infect_days_total[inds]
 
     # Get corrected time to switch from high to low
-    trans_point = np.ones(n,dtype=cvd.default_float)*frac_time
+    trans_point = np.ones(n,dtype=time_start.dtype)*frac_time
     trans_point[inds] = cap_frac
 
     # Calculate load
-    load = np.ones(n, dtype=cvd.default_float) # allocate an array of ones with the correct dtype
+    load = np.ones(n, dtype=time_start.dtype) # allocate an array of ones with the correct dtype
     early = (t-time_start)/infect_days_total < trans_point # are we in the early or late phase
     load = (load_ratio * early + load * ~early)/(load+frac_time*(load_ratio-load)) # calculate load
 
     return load
 
 
-@nb.njit(            (nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbfloat,    nbfloat[:], nbbool[:], nbbool[:], nbbool[:], nbfloat,      nbfloat,    nbfloat,     nbfloat[:]), cache=cache, parallel=safe_parallel)
-def compute_trans_sus(rel_trans,  rel_sus,    inf,       sus,       beta_layer, viral_load, symp,      diag,      quar,      asymp_factor, iso_factor, quar_factor, immunity_factors): # pragma: no cover
-    ''' Calculate relative transmissibility and susceptibility '''
-    f_asymp   =  symp + ~symp * asymp_factor # Asymptomatic factor, changes e.g. [0,1] with a factor of 0.8 to [0.8,1.0]
-    f_iso     = ~diag +  diag * iso_factor # Isolation factor, changes e.g. [0,1] with a factor of 0.2 to [1,0.2]
-    f_quar    = ~quar +  quar * quar_factor # Quarantine, changes e.g. [0,1] with a factor of 0.5 to [1,0.5]
-    rel_trans = rel_trans * inf * f_quar * f_asymp * f_iso * beta_layer * viral_load # Recalculate transmissibility
-    rel_sus   = rel_sus * sus * f_quar * (1-immunity_factors) # Recalculate susceptibility
-    return rel_trans, rel_sus
+@njit(               [(nbfloat[:], nbfloat[:],     nbfloat[:], nbfloat,   nbfloat),
+                      (nbdate[:],  nbdate[:],      nbdate[:],  nbfloat,   nbfloat)], cache=cache)
+def compute_viral_switch(time_start, time_recovered, time_dead, frac_time, high_cap): # pragma: no cover
+    '''
+    Calculate the day on which each individual's viral load drops from high to
+    low, i.e. the first day on which compute_viral_load() would put them in the
+    late phase. Called once on infection, so the viral load on each timestep is
+    just a comparison against this date.
+
+    Args:
+        time_start: (float[]) individuals' infectious date
+        time_recovered: (float[]) individuals' recovered date
+        time_dead: (float[]) individuals' death date
+        frac_time: (float) fraction of time in high load
+        high_cap: (float) cap on the number of days with high viral load
+
+    Returns:
+        switch (float[]): the first day with low viral load
+    '''
+    n = len(time_start)
+    switch = np.empty(n, dtype=time_start.dtype)
+    zero = frac_time - frac_time # Dates stored as integers are converted to floats of this precision, so the results don't depend on how dates are stored
+    for i in range(n):
+
+        # Use the same arithmetic as compute_viral_load() so the phases match exactly
+        time_stop = time_dead[i] if not isnan(time_dead[i]) else time_recovered[i]
+        if isnan(time_start[i]) or isnan(time_stop):
+            switch[i] = nan_value(switch)
+            continue
+        start = zero + time_start[i]
+        infect_days_total = (zero + time_stop) - start
+        trans_point = frac_time
+        if frac_time*infect_days_total > high_cap:
+            trans_point = high_cap/infect_days_total
+        if infect_days_total <= 0: # Never in the early phase from the infectious date on
+            switch[i] = time_start[i]
+        else:
+            day = np.int64(np.ceil(start + trans_point*infect_days_total)) # Initial guess, then correct for rounding
+            while (day - 1 - start)/infect_days_total >= trans_point:
+                day -= 1
+            while (day - start)/infect_days_total < trans_point:
+                day += 1
+            switch[i] = day
+    return switch
+
+
+@njit(               [(nbint, nbfloat[:],  nb.int64[:], nbfloat,   nbfloat,    nbfloat[:]),
+                      (nbint, nbdate[:],   nb.int64[:], nbfloat,   nbfloat,    nbfloat[:])], cache=cache)
+def compute_viral_load_switch(t, date_switch, inds, frac_time, load_ratio, load): # pragma: no cover
+    '''
+    Calculate the viral load for time t from each individual's precomputed switch
+    day (see compute_viral_switch()). Identical to compute_viral_load() for the
+    given indices, typically the people who are currently infectious; everyone
+    else is assigned the low viral load.
+
+    Args:
+        t: (int) timestep
+        date_switch: (float[]) individuals' first day with low viral load
+        inds: (int[]) indices of the individuals to compute the viral load for
+        frac_time: (float) fraction of time in high load
+        load_ratio: (float) ratio for high to low viral load
+        load: (float[]) the output array, the same length as date_switch
+
+    Returns:
+        load (float): viral load
+    '''
+    one = load.dtype.type(1.0)
+    denom = one + frac_time*(load_ratio - one)
+    high = load_ratio/denom
+    low = one/denom
+    load[:] = low
+    for i in inds:
+        if t < date_switch[i]:
+            load[i] = high
+    return load
 
 
-@nb.njit(             (nbfloat,  nbint[:], nbint[:],  nbfloat[:],  nbfloat[:], nbfloat[:]), cache=cache, parallel=rand_parallel)
+@njit(               (nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbfloat,    nbfloat[:], nbbool[:], nbbool[:], nbbool[:], nbfloat,      nbfloat,    nbfloat,     nbfloat[:],       nbfloat[:], nbfloat[:]), cache=cache, parallel=safe_parallel)
+def compute_trans_sus(rel_trans,  rel_sus,    inf,       sus,       beta_layer, viral_load, symp,      diag,      quar,      asymp_factor, iso_factor, quar_factor, immunity_factors, out_trans,  out_sus): # pragma: no cover
+    ''' Calculate relative transmissibility and susceptibility, writing them into the output arrays out_trans and out_sus '''
+    one = rel_trans.dtype.type(1.0)
+    for i in nb.prange(len(rel_trans)):
+        f_asymp = one if symp[i] else asymp_factor # Asymptomatic factor, changes e.g. [0,1] with a factor of 0.8 to [0.8,1.0]
+        f_iso   = iso_factor if diag[i] else one # Isolation factor, changes e.g. [0,1] with a factor of 0.2 to [1,0.2]
+        f_quar  = quar_factor if quar[i] else one # Quarantine, changes e.g. [0,1] with a factor of 0.5 to [1,0.5]
+        out_trans[i] = rel_trans[i] * inf[i] * f_quar * f_asymp * f_iso * beta_layer * viral_load[i] # Recalculate transmissibility
+        out_sus[i]   = rel_sus[i] * sus[i] * f_quar * (1-immunity_factors[i]) # Recalculate susceptibility
+    return out_trans, out_sus
+
+
+@njit(                (nbfloat,  nbint[:], nbint[:],  nbfloat[:],  nbfloat[:], nbfloat[:]), cache=cache, parallel=rand_parallel)
 def compute_infections(beta,     sources,  targets,   layer_betas, rel_trans,  rel_sus): # pragma: no cover
     '''
     Compute who infects whom
@@ -113,7 +331,725 @@ def compute_infections(beta,     sources,  targets,   layer_betas, rel_trans,  r
     return source_inds, target_inds
 
 
-@nb.njit((nbint[:], nbint[:], nb.int64[:]), cache=cache)
+@njit(cache=cache)
+def compute_edge_beta(source, target, edge, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm): # pragma: no cover
+    ''' Calculate the probability of transmission from source to target along a single edge; used by the fused infection calculations '''
+    if rel_trans[source] == 0 or rel_sus[target] == 0:
+        return 0.0
+    strain = strains[source]
+    f_source = rel_trans[source] * beta_layer
+    if diag[source]:
+        f_source *= iso_factor
+    if quar[source]:
+        f_source *= quar_factor
+    f_target = rel_sus[target] * (1 - sus_imm[strain, target])
+    if quar[target]:
+        f_target *= quar_factor
+    return strain_betas[strain] * layer_betas[edge] * f_source * f_target
+
+
+@njit(                      (nbint[:], nbint[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:]), cache=cache)
+def compute_infections_fused(p1,       p2,       layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm): # pragma: no cover
+    '''
+    Compute who infects whom in a single layer, for all strains and in both
+    directions, in a single pass over the edges. Used by trans_mode='fused'.
+
+    Unlike compute_trans_sus(), the layer-specific isolation and quarantine
+    factors are applied per edge, so rel_trans and rel_sus only need to be
+    computed once per timestep rather than once per layer and strain.
+
+    Args:
+        p1, p2: (int[]) the edges of the layer
+        layer_betas: (float[]) the per-edge transmissibility
+        beta_layer, iso_factor, quar_factor: (float) the layer-specific parameters
+        rel_trans: (float[]) relative transmissibility of each person, 0 for noninfectious people
+        rel_sus: (float[]) relative susceptibility of each person, 0 for nonsusceptible people
+        diag, quar: (bool[]) whether each person is diagnosed or quarantined
+        strains: (int[]) the strain each infectious person is infected with
+        strain_betas: (float[]) the overall beta for each strain
+        sus_imm: (float[:,:]) immunity of each person to each strain
+
+    Returns:
+        source_inds, target_inds, strain_inds: (int[]) the candidate infections,
+        in edge order; a target may appear more than once
+    '''
+    n = 0
+    size = 16
+    source_inds = np.empty(size, dtype=p1.dtype)
+    target_inds = np.empty(size, dtype=p1.dtype)
+    strain_inds = np.empty(size, dtype=p1.dtype)
+    for e in range(len(p1)):
+        for d in range(2): # Loop over p1->p2 and p2->p1
+            if d == 0:
+                source, target = p1[e], p2[e]
+            else:
+                source, target = p2[e], p1[e]
+            beta = compute_edge_beta(source, target, e, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0 and np.random.random() < beta:
+                if n == size: # Grow the output arrays
+                    size *= 2
+                    source_inds = grow(source_inds, size)
+                    target_inds = grow(target_inds, size)
+                    strain_inds = grow(strain_inds, size)
+                source_inds[n] = source
+                target_inds[n] = target
+                strain_inds[n] = strains[source]
+                n += 1
+    return source_inds[:n], target_inds[:n], strain_inds[:n]
+
+
+@njit(                      (nb.int64[:], nbint[:], nbint[:], nbint[:], nb.int64[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:]), cache=cache)
+def compute_infections_index(indptr,      slots,    p1,       p2,       inf_inds,    layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm): # pragma: no cover
+    '''
+    As compute_infections_fused(), but only visit the edges of infectious people,
+    using the layer's neighbor index (see make_index()), so the cost scales with
+    the number of infectious people rather than the number of edges.
+
+    Args:
+        indptr, slots: the layer's neighbor index
+        inf_inds: (int[]) indices of the infectious people
+        other args: as for compute_infections_fused()
+
+    Returns:
+        source_inds, target_inds, strain_inds: (int[]) the candidate infections,
+        in source order; a target may appear more than once
+    '''
+    n = 0
+    size = 16
+    source_inds = np.empty(size, dtype=p1.dtype)
+    target_inds = np.empty(size, dtype=p1.dtype)
+    strain_inds = np.empty(size, dtype=p1.dtype)
+    for source in inf_inds:
+        if rel_trans[source] == 0:
+            continue
+        for k in range(indptr[source], indptr[source+1]):
+            e = slots[k] >> 1 # Recover the edge, and which side of it the source is on
+            if slots[k] & 1:
+                target = p1[e]
+            else:
+                target = p2[e]
+            beta = compute_edge_beta(source, target, e, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0 and np.random.random() < beta:
+                if n == size: # Grow the output arrays
+                    size *= 2
+                    source_inds = grow(source_inds, size)
+                    target_inds = grow(target_inds, size)
+                    strain_inds = grow(strain_inds, size)
+                source_inds[n] = source
+                target_inds[n] = target
+                strain_inds[n] = strains[source]
+                n += 1
+    return source_inds[:n], target_inds[:n], strain_inds[:n]
+
+
+# Constants for the Philox4x32-10 counter-based random number generator (Salmon et al., 2011, https://doi.org/10.1145/2063384.2063405)
+philox_m0 = np.uint64(0xD2511F53)
+philox_m1 = np.uint64(0xCD9E8D57)
+philox_w0 = np.uint64(0x9E3779B9)
+philox_w1 = np.uint64(0xBB67AE85)
+mask32    = np.uint64(0xFFFFFFFF)
+shift32   = np.uint64(32)
+
+
+@njit((nb.uint64, nb.uint64, nb.uint64, nb.uint64, nb.uint64), cache=cache)
+def philox(key, c0, c1, c2, c3): # pragma: no cover
+    '''
+    The Philox4x32-10 counter-based random number generator: returns four
+    independent random 32-bit words for a 64-bit key and a counter made up of
+    four 32-bit words. Unlike a stream generator, each output depends only on its
+    key and counter, so random numbers can be drawn in any order, on any thread,
+    and still be reproducible.
+    '''
+    k0 = key & mask32
+    k1 = (key >> shift32) & mask32
+    for r in range(10):
+        p0 = philox_m0 * (c0 & mask32)
+        p1 = philox_m1 * (c2 & mask32)
+        c0, c1, c2, c3 = (p1 >> shift32) ^ c1 ^ k0, p1 & mask32, (p0 >> shift32) ^ c3 ^ k1, p0 & mask32
+        k0 = (k0 + philox_w0) & mask32
+        k1 = (k1 + philox_w1) & mask32
+    return c0, c1, c2, c3
+
+
+@njit((nb.uint64, nb.uint64, nb.uint64, nb.uint64), cache=cache)
+def counter_random(key, day, stream, slot): # pragma: no cover
+    '''
+    Draw a uniform random number in [0,1) using the Philox generator, with the
+    counter formed from the slot (e.g. the edge), day, and stream (e.g. the layer).
+    '''
+    x0, x1, x2, x3 = philox(key, slot & mask32, slot >> shift32, day, stream)
+    return ((x0 >> np.uint64(5)) * 67108864.0 + (x1 >> np.uint64(6))) / 9007199254740992.0 # Combine into 53 bits
+
+
+@njit(                        (nbint[:], nbint[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:], nb.uint64, nb.uint64, nb.uint64), cache=cache, parallel=safe_parallel, nogil=True)
+def compute_infections_counter(p1,       p2,       layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm,      key,       day,       stream): # pragma: no cover
+    '''
+    As compute_infections_fused(), but using counter-based random numbers keyed
+    by the edge, so the results are identical regardless of the number of threads
+    or of the order in which edges are visited.
+
+    Args:
+        key: (uint64) the random seed
+        day: (uint64) the timestep
+        stream: (uint64) the stream, typically the layer number
+        other args: as for compute_infections_fused()
+
+    Returns:
+        source_inds, target_inds, strain_inds, slot_inds: (int[]) the candidate
+        infections, in slot order, where the slot is 2*edge for p1->p2 and 2*edge+1
+        for p2->p1
+    '''
+    hits = np.zeros(2*len(p1), dtype=np.bool_)
+    for e in nb.prange(len(p1)):
+        for d in range(2): # Loop over p1->p2 and p2->p1
+            if d == 0:
+                source, target = p1[e], p2[e]
+            else:
+                source, target = p2[e], p1[e]
+            beta = compute_edge_beta(source, target, e, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0 and counter_random(key, day, stream, np.uint64(2*e+d)) < beta:
+                hits[2*e+d] = True
+    slot_inds = hits.nonzero()[0]
+    edges = slot_inds >> 1
+    p2p1 = (slot_inds & 1) == 1
+    source_inds = np.where(p2p1, p2[edges], p1[edges])
+    target_inds = np.where(p2p1, p1[edges], p2[edges])
+    return source_inds, target_inds, strains[source_inds], slot_inds
+
+
+@njit(                              (nb.int64[:], nbint[:], nbint[:], nbint[:], nb.int64[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:], nb.uint64, nb.uint64, nb.uint64), cache=cache, parallel=safe_parallel, nogil=True)
+def compute_infections_index_counter(indptr,      slots,    p1,       p2,       inf_inds,    layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm,      key,       day,       stream): # pragma: no cover
+    '''
+    As compute_infections_index(), but using counter-based random numbers; see
+    compute_infections_counter(). For the same key, day, and stream, this gives
+    the same infections as compute_infections_counter(), in source order rather
+    than slot order.
+    '''
+    n_inf = len(inf_inds)
+    offsets = np.zeros(n_inf+1, dtype=np.int64)
+    for i in range(n_inf):
+        source = inf_inds[i]
+        offsets[i+1] = offsets[i] + indptr[source+1] - indptr[source]
+    hits = np.zeros(offsets[-1], dtype=np.bool_)
+    for i in nb.prange(n_inf):
+        source = inf_inds[i]
+        if rel_trans[source] == 0:
+            continue
+        for k in range(indptr[source], indptr[source+1]):
+            e = slots[k] >> 1
+            if slots[k] & 1:
+                target = p1[e]
+            else:
+                target = p2[e]
+            beta = compute_edge_beta(source, target, e, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0 and counter_random(key, day, stream, np.uint64(slots[k])) < beta:
+                hits[offsets[i] + k - indptr[source]] = True
+
+    # Collect the infections
+    n = hits.sum()
+    source_inds = np.empty(n, dtype=p1.dtype)
+    target_inds = np.empty(n, dtype=p1.dtype)
+    slot_inds   = np.empty(n, dtype=np.int64)
+    count = 0
+    for i in range(n_inf):
+        source = inf_inds[i]
+        for k in range(indptr[source], indptr[source+1]):
+            if hits[offsets[i] + k - indptr[source]]:
+                slot = slots[k]
+                source_inds[count] = source
+                target_inds[count] = p1[slot >> 1] if slot & 1 else p2[slot >> 1]
+                slot_inds[count]   = slot
+                count += 1
+    return source_inds, target_inds, strains[source_inds], slot_inds
+
+
+@njit(                            (nb.int64[:], nbint[:], nbint[:], nbint[:], nb.int64[:], nb.int64[:], nbfloat[:],  nbfloat[:], nbfloat[:], nbfloat[:],  nbfloat[:,:], nbfloat[:,:], nbbool[:,:], nbbool[:,:], nbint[:,:], nbfloat[:,:], nbfloat[:,:,:], nb.uint64[:], nb.uint64, nb.uint64), cache=cache, parallel=safe_parallel)
+def compute_infections_ensemble(indptr,      slots,    p1,       p2,       inf_inds,    inf_ptr,     layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,    rel_sus,      diag,        quar,        strains,    strain_betas, sus_imm,        keys,         day,       stream): # pragma: no cover
+    '''
+    As compute_infections_index_counter(), but for several replicates of a sim
+    that share the same layer; used by cv.Ensemble. The person arrays have a
+    leading replicate axis, and the layer parameters, strain betas, and keys
+    have one entry per replicate. For each replicate, the infections are the
+    same as compute_infections_index_counter() would give for that replicate alone.
+
+    Args:
+        inf_inds: (int[]) the infectious people in each replicate, concatenated
+        inf_ptr: (int[]) the infectious people of replicate r are inf_inds[inf_ptr[r]:inf_ptr[r+1]]
+        other args: as for compute_infections_index_counter()
+
+    Returns:
+        rep_inds, source_inds, target_inds, strain_inds, slot_inds: (int[]) the
+        candidate infections, in replicate and then source order
+    '''
+    n_reps = len(inf_ptr) - 1
+    n_inf = len(inf_inds)
+    reps = np.empty(n_inf, dtype=np.int64)
+    offsets = np.zeros(n_inf+1, dtype=np.int64)
+    for r in range(n_reps):
+        for i in range(inf_ptr[r], inf_ptr[r+1]):
+            source = inf_inds[i]
+            reps[i] = r
+            offsets[i+1] = offsets[i] + indptr[source+1] - indptr[source]
+    hits = np.zeros(offsets[-1], dtype=np.bool_)
+    for i in nb.prange(n_inf):
+        r = reps[i]
+        source = inf_inds[i]
+        if rel_trans[r, source] == 0:
+            continue
+        for k in range(indptr[source], indptr[source+1]):
+            e = slots[k] >> 1
+            if slots[k] & 1:
+                target = p1[e]
+            else:
+                target = p2[e]
+            beta = compute_edge_beta(source, target, e, layer_betas, beta_layer[r], iso_factor[r], quar_factor[r], rel_trans[r], rel_sus[r], diag[r], quar[r], strains[r], strain_betas[r], sus_imm[r])
+            if beta > 0 and counter_random(keys[r], day, stream, np.uint64(slots[k])) < beta:
+                hits[offsets[i] + k - indptr[source]] = True
+
+    # Collect the infections
+    n = hits.sum()
+    rep_inds    = np.empty(n, dtype=np.int64)
+    source_inds = np.empty(n, dtype=p1.dtype)
+    target_inds = np.empty(n, dtype=p1.dtype)
+    strain_inds = np.empty(n, dtype=p1.dtype)
+    slot_inds   = np.empty(n, dtype=np.int64)
+    count = 0
+    for i in range(n_inf):
+        r = reps[i]
+        source = inf_inds[i]
+        for k in range(indptr[source], indptr[source+1]):
+            if hits[offsets[i] + k - indptr[source]]:
+                slot = slots[k]
+                rep_inds[count]    = r
+                source_inds[count] = source
+                target_inds[count] = p1[slot >> 1] if slot & 1 else p2[slot >> 1]
+                strain_inds[count] = strains[r, source]
+                slot_inds[count]   = slot
+                count += 1
+    return rep_inds, source_inds, target_inds, strain_inds, slot_inds
+
+
+max_hazard = 50.0 # The hazard used for an edge with a transmission probability of 1, i.e. 1-exp(-50) = 1 to double precision
+
+
+@njit(               (nbint[:], nbint[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:], nbint, nb.float64[:], nb.float64[:], nbint[:], nbint[:]), cache=cache)
+def compute_hazards(p1,       p2,       layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm,      layer, hazard,        thresholds,    sources,  layers): # pragma: no cover
+    '''
+    Add the hazard of infection, -log(1-beta), along each edge of a layer to the
+    total hazard of its target, for all strains and in both directions; used by
+    trans_mode='hazard'. Once a target's total reaches its threshold, the current
+    edge is recorded as the one that infected them.
+
+    The first pass over the layers, with thresholds of infinity, gives the total
+    hazard of each person, from which the new infections are drawn. A second,
+    identical pass with the total reset to zero and a threshold drawn uniformly
+    between 0 and the total for each newly infected person then picks the edge
+    that infected them, with probability proportional to its hazard.
+
+    Args:
+        layer: (int) the index of the layer
+        hazard: (float64[]) the total hazard of each person, modified in place
+        thresholds: (float64[]) the hazard at which to record each person's source, modified in place
+        sources, layers: (int[]) the source and layer of each newly infected person, modified in place
+        other args: as for compute_infections_fused()
+    '''
+    for e in range(len(p1)):
+        for d in range(2): # Loop over p1->p2 and p2->p1
+            if d == 0:
+                source, target = p1[e], p2[e]
+            else:
+                source, target = p2[e], p1[e]
+            beta = compute_edge_beta(source, target, e, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0:
+                hazard[target] += -np.log1p(-np.float64(beta)) if beta < 1 else max_hazard
+                if hazard[target] >= thresholds[target]:
+                    sources[target] = source
+                    layers[target] = layer
+                    thresholds[target] = np.inf
+    return
+
+
+@njit(                     (nb.int64[:], nbint[:], nbint[:], nbint[:], nb.int64[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:], nbint, nb.float64[:], nb.float64[:], nbint[:], nbint[:]), cache=cache)
+def compute_hazards_index(indptr,      slots,    p1,       p2,       inf_inds,    layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm,      layer, hazard,        thresholds,    sources,  layers): # pragma: no cover
+    '''
+    As compute_hazards(), but only visit the edges of infectious people, using
+    the layer's neighbor index (see make_index()).
+    '''
+    for source in inf_inds:
+        if rel_trans[source] == 0:
+            continue
+        for k in range(indptr[source], indptr[source+1]):
+            e = slots[k] >> 1
+            if slots[k] & 1:
+                target = p1[e]
+            else:
+                target = p2[e]
+            beta = compute_edge_beta(source, target, e, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0:
+                hazard[target] += -np.log1p(-np.float64(beta)) if beta < 1 else max_hazard
+                if hazard[target] >= thresholds[target]:
+                    sources[target] = source
+                    layers[target] = layer
+                    thresholds[target] = np.inf
+    return
+
+
+@njit(                       (nbfloat, nb.int64[:], nbint[:], nbint[:],    nb.int64[:], nbfloat[:],    nbfloat[:], nbfloat[:]), cache=cache)
+def compute_infections_cliques(beta,    indptr,      members,  cluster_ids, inf_inds,    cluster_betas, rel_trans,  rel_sus): # pragma: no cover
+    '''
+    As compute_infections(), in both directions, for a clique layer (see cv.CliqueLayer),
+    where each infectious person can infect every other member of their cluster, i.e.
+    members[indptr[c]:indptr[c+1]] for cluster c, with transmissibility cluster_betas[c].
+    '''
+    n = 0
+    size = 16
+    source_inds = np.empty(size, dtype=members.dtype)
+    target_inds = np.empty(size, dtype=members.dtype)
+    for source in inf_inds:
+        c = cluster_ids[source]
+        if rel_trans[source] == 0 or c < 0:
+            continue
+        for k in range(indptr[c], indptr[c+1]):
+            target = members[k]
+            if target == source:
+                continue
+            this_beta = beta * cluster_betas[c] * rel_trans[source] * rel_sus[target]
+            if this_beta > 0 and np.random.random() < this_beta:
+                if n == size: # Grow the output arrays
+                    size *= 2
+                    source_inds = grow(source_inds, size)
+                    target_inds = grow(target_inds, size)
+                source_inds[n] = source
+                target_inds[n] = target
+                n += 1
+    return source_inds[:n], target_inds[:n]
+
+
+@njit(                             (nb.int64[:], nbint[:], nbint[:],    nb.int64[:], nbfloat[:],    nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:]), cache=cache)
+def compute_infections_cliques_fused(indptr,      members,  cluster_ids, inf_inds,    cluster_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm): # pragma: no cover
+    '''
+    As compute_infections_index(), but for a clique layer; see compute_infections_cliques().
+    The cluster is used in place of the edge, to look up the transmissibility.
+    '''
+    n = 0
+    size = 16
+    source_inds = np.empty(size, dtype=members.dtype)
+    target_inds = np.empty(size, dtype=members.dtype)
+    strain_inds = np.empty(size, dtype=members.dtype)
+    for source in inf_inds:
+        c = cluster_ids[source]
+        if rel_trans[source] == 0 or c < 0:
+            continue
+        for k in range(indptr[c], indptr[c+1]):
+            target = members[k]
+            if target == source:
+                continue
+            beta = compute_edge_beta(source, target, c, cluster_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0 and np.random.random() < beta:
+                if n == size: # Grow the output arrays
+                    size *= 2
+                    source_inds = grow(source_inds, size)
+                    target_inds = grow(target_inds, size)
+                    strain_inds = grow(strain_inds, size)
+                source_inds[n] = source
+                target_inds[n] = target
+                strain_inds[n] = strains[source]
+                n += 1
+    return source_inds[:n], target_inds[:n], strain_inds[:n]
+
+
+@njit(                               (nb.int64[:], nbint[:], nbint[:],    nb.int64[:], nbfloat[:],    nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:], nb.uint64, nb.uint64, nb.uint64), cache=cache, parallel=safe_parallel, nogil=True)
+def compute_infections_cliques_counter(indptr,      members,  cluster_ids, inf_inds,    cluster_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm,      key,       day,       stream): # pragma: no cover
+    '''
+    As compute_infections_cliques_fused(), but using counter-based random numbers;
+    see compute_infections_counter(). Each pair of members is a slot, numbered by
+    the position of the source in members (times 2**32) plus the position of the
+    target within the cluster.
+    '''
+    n_inf = len(inf_inds)
+    offsets = np.zeros(n_inf+1, dtype=np.int64)
+    for i in range(n_inf):
+        c = cluster_ids[inf_inds[i]]
+        offsets[i+1] = offsets[i] + (indptr[c+1] - indptr[c] if c >= 0 else 0)
+    hits = np.zeros(offsets[-1], dtype=np.bool_)
+    for i in nb.prange(n_inf):
+        source = inf_inds[i]
+        c = cluster_ids[source]
+        if rel_trans[source] == 0 or c < 0:
+            continue
+        start = indptr[c]
+        end = indptr[c+1]
+        pos = start
+        while members[pos] != source: # Find the source's own position, which numbers its slots
+            pos += 1
+        for k in range(start, end):
+            target = members[k]
+            if target == source:
+                continue
+            beta = compute_edge_beta(source, target, c, cluster_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0 and counter_random(key, day, stream, np.uint64((pos << 32) + k - start)) < beta:
+                hits[offsets[i] + k - start] = True
+
+    # Collect the infections
+    n = hits.sum()
+    source_inds = np.empty(n, dtype=members.dtype)
+    target_inds = np.empty(n, dtype=members.dtype)
+    slot_inds   = np.empty(n, dtype=np.int64)
+    count = 0
+    for i in range(n_inf):
+        for j in range(offsets[i+1] - offsets[i]):
+            if hits[offsets[i] + j]:
+                source = inf_inds[i]
+                start = indptr[cluster_ids[source]]
+                pos = start
+                while members[pos] != source:
+                    pos += 1
+                source_inds[count] = source
+                target_inds[count] = members[start + j]
+                slot_inds[count]   = (pos << 32) + j
+                count += 1
+    return source_inds, target_inds, strains[source_inds], slot_inds
+
+
+@njit(                       (nb.int64[:], nbint[:], nbint[:],    nb.int64[:], nbfloat[:],    nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:], nbint, nb.float64[:], nb.float64[:], nbint[:], nbint[:]), cache=cache)
+def compute_hazards_cliques(indptr,      members,  cluster_ids, inf_inds,    cluster_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm,      layer, hazard,        thresholds,    sources,  layers): # pragma: no cover
+    '''
+    As compute_hazards(), but for a clique layer: the hazard from each infectious
+    person is added to every other member of their cluster; see compute_infections_cliques().
+    '''
+    for source in inf_inds:
+        c = cluster_ids[source]
+        if rel_trans[source] == 0 or c < 0:
+            continue
+        for k in range(indptr[c], indptr[c+1]):
+            target = members[k]
+            if target == source:
+                continue
+            beta = compute_edge_beta(source, target, c, cluster_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0:
+                hazard[target] += -np.log1p(-np.float64(beta)) if beta < 1 else max_hazard
+                if hazard[target] >= thresholds[target]:
+                    sources[target] = source
+                    layers[target] = layer
+                    thresholds[target] = np.inf
+    return
+
+
+@njit((nb.int64[:], nbint[:]), cache=cache)
+def make_clique_edges(indptr, members): # pragma: no cover
+    ''' Numba for CliqueLayer.to_layer(): list the edges between every pair of members of each cluster, cluster by cluster '''
+    n_edges = 0
+    for c in range(len(indptr)-1):
+        k = indptr[c+1] - indptr[c]
+        n_edges += k*(k-1)//2
+    p1 = np.empty(n_edges, dtype=members.dtype)
+    p2 = np.empty(n_edges, dtype=members.dtype)
+    e = 0
+    for c in range(len(indptr)-1):
+        for a in range(indptr[c], indptr[c+1]):
+            for b in range(a+1, indptr[c+1]):
+                p1[e] = members[a]
+                p2[e] = members[b]
+                e += 1
+    return p1, p2
+
+
+@njit(                       (nbfloat, nb.int64[:], nb.uint32[:], nb.int64[:], nbfloat[:],  nbfloat[:], nbfloat[:]), cache=cache)
+def compute_infections_compact(beta,    indptr,      contacts,     inf_inds,    layer_betas, rel_trans,  rel_sus): # pragma: no cover
+    '''
+    As compute_infections(), in both directions, for a compact layer (see cv.CompactLayer),
+    where the contacts of person i are contacts[indptr[i]:indptr[i+1]]. The transmissibility
+    of slot k is layer_betas[k], or layer_betas[0] for every slot if all edges are equal.
+    '''
+    n = 0
+    size = 16
+    source_inds = np.empty(size, dtype=inf_inds.dtype)
+    target_inds = np.empty(size, dtype=inf_inds.dtype)
+    scalar = len(layer_betas) == 1
+    for source in inf_inds:
+        if rel_trans[source] == 0:
+            continue
+        for k in range(indptr[source], indptr[source+1]):
+            target = contacts[k]
+            this_beta = beta * layer_betas[0 if scalar else k] * rel_trans[source] * rel_sus[target]
+            if this_beta > 0 and np.random.random() < this_beta:
+                if n == size: # Grow the output arrays
+                    size *= 2
+                    source_inds = grow(source_inds, size)
+                    target_inds = grow(target_inds, size)
+                source_inds[n] = source
+                target_inds[n] = target
+                n += 1
+    return source_inds[:n], target_inds[:n]
+
+
+@njit(                             (nb.int64[:], nb.uint32[:], nb.int64[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:]), cache=cache)
+def compute_infections_compact_fused(indptr,      contacts,     inf_inds,    layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm): # pragma: no cover
+    '''
+    As compute_infections_index(), but for a compact layer; see compute_infections_compact().
+    Since the contacts of each person are in the same order as in the neighbor index,
+    this gives the same infections as compute_infections_index() on the original layer.
+    '''
+    n = 0
+    size = 16
+    source_inds = np.empty(size, dtype=strains.dtype)
+    target_inds = np.empty(size, dtype=strains.dtype)
+    strain_inds = np.empty(size, dtype=strains.dtype)
+    scalar = len(layer_betas) == 1
+    for source in inf_inds:
+        if rel_trans[source] == 0:
+            continue
+        for k in range(indptr[source], indptr[source+1]):
+            target = contacts[k]
+            beta = compute_edge_beta(source, target, 0 if scalar else k, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0 and np.random.random() < beta:
+                if n == size: # Grow the output arrays
+                    size *= 2
+                    source_inds = grow(source_inds, size)
+                    target_inds = grow(target_inds, size)
+                    strain_inds = grow(strain_inds, size)
+                source_inds[n] = source
+                target_inds[n] = target
+                strain_inds[n] = strains[source]
+                n += 1
+    return source_inds[:n], target_inds[:n], strain_inds[:n]
+
+
+@njit(                               (nb.int64[:], nb.uint32[:], nb.int64[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:], nb.uint64, nb.uint64, nb.uint64), cache=cache, parallel=safe_parallel, nogil=True)
+def compute_infections_compact_counter(indptr,      contacts,     inf_inds,    layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm,      key,       day,       stream): # pragma: no cover
+    '''
+    As compute_infections_compact_fused(), but using counter-based random numbers;
+    see compute_infections_counter(). The slot is the position k in contacts.
+    '''
+    n_inf = len(inf_inds)
+    offsets = np.zeros(n_inf+1, dtype=np.int64)
+    for i in range(n_inf):
+        source = inf_inds[i]
+        offsets[i+1] = offsets[i] + indptr[source+1] - indptr[source]
+    hits = np.zeros(offsets[-1], dtype=np.bool_)
+    scalar = len(layer_betas) == 1
+    for i in nb.prange(n_inf):
+        source = inf_inds[i]
+        if rel_trans[source] == 0:
+            continue
+        for k in range(indptr[source], indptr[source+1]):
+            beta = compute_edge_beta(source, contacts[k], 0 if scalar else k, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0 and counter_random(key, day, stream, np.uint64(k)) < beta:
+                hits[offsets[i] + k - indptr[source]] = True
+
+    # Collect the infections
+    n = hits.sum()
+    source_inds = np.empty(n, dtype=strains.dtype)
+    target_inds = np.empty(n, dtype=strains.dtype)
+    slot_inds   = np.empty(n, dtype=np.int64)
+    count = 0
+    for i in range(n_inf):
+        source = inf_inds[i]
+        for k in range(indptr[source], indptr[source+1]):
+            if hits[offsets[i] + k - indptr[source]]:
+                source_inds[count] = source
+                target_inds[count] = contacts[k]
+                slot_inds[count]   = k
+                count += 1
+    return source_inds, target_inds, strains[source_inds], slot_inds
+
+
+@njit(                       (nb.int64[:], nb.uint32[:], nb.int64[:], nbfloat[:],  nbfloat,    nbfloat,    nbfloat,     nbfloat[:], nbfloat[:], nbbool[:], nbbool[:], nbint[:], nbfloat[:],   nbfloat[:,:], nbint, nb.float64[:], nb.float64[:], nbint[:], nbint[:]), cache=cache)
+def compute_hazards_compact(indptr,      contacts,     inf_inds,    layer_betas, beta_layer, iso_factor, quar_factor, rel_trans,  rel_sus,    diag,      quar,      strains,  strain_betas, sus_imm,      layer, hazard,        thresholds,    sources,  layers): # pragma: no cover
+    '''
+    As compute_hazards_index(), but for a compact layer; see compute_infections_compact().
+    '''
+    scalar = len(layer_betas) == 1
+    for source in inf_inds:
+        if rel_trans[source] == 0:
+            continue
+        for k in range(indptr[source], indptr[source+1]):
+            target = contacts[k]
+            beta = compute_edge_beta(source, target, 0 if scalar else k, layer_betas, beta_layer, iso_factor, quar_factor, rel_trans, rel_sus, diag, quar, strains, strain_betas, sus_imm)
+            if beta > 0:
+                hazard[target] += -np.log1p(-np.float64(beta)) if beta < 1 else max_hazard
+                if hazard[target] >= thresholds[target]:
+                    sources[target] = source
+                    layers[target] = layer
+                    thresholds[target] = np.inf
+    return
+
+
+@njit((nb.uint64, nb.uint64, nb.uint64, nb.int64[:]), cache=cache, parallel=safe_parallel)
+def counter_randoms(key, day, stream, slots): # pragma: no cover
+    ''' Draw a uniform random number for each slot (e.g. each person) using counter_random() '''
+    out = np.empty(len(slots), dtype=np.float64)
+    for i in nb.prange(len(slots)):
+        out[i] = counter_random(key, day, stream, np.uint64(slots[i]))
+    return out
+
+
+@njit((nbint[:], nbint[:], nb.int64), cache=cache, nogil=True)
+def make_index(p1, p2, n): # pragma: no cover
+    '''
+    Numba for Layer.make_index()
+
+    Build a compressed sparse row (CSR) neighbor index for a layer: the contacts
+    of person i are given by slots[indptr[i]:indptr[i+1]], where each slot
+    encodes the edge and the side of it the person is on as 2*edge + (0 if p1 else 1).
+    '''
+    counts = np.zeros(n+1, dtype=np.int64)
+    for e in range(len(p1)):
+        counts[p1[e]+1] += 1
+        counts[p2[e]+1] += 1
+    indptr = np.cumsum(counts)
+    fill = indptr[:-1].copy()
+    slots = np.empty(2*len(p1), dtype=p1.dtype)
+    for e in range(len(p1)):
+        slots[fill[p1[e]]] = 2*e
+        fill[p1[e]] += 1
+        slots[fill[p2[e]]] = 2*e + 1
+        fill[p2[e]] += 1
+    return indptr, slots
+
+
+@njit((nb.int64[:], nbint[:], nbint[:], nbint[:], nb.int64[:]), cache=cache)
+def find_contacts_index(indptr, slots, p1, p2, inds): # pragma: no cover
+    ''' As find_contacts(), but using the layer's neighbor index to only visit the edges of the specified people '''
+    pairing_partners = set()
+    for i in inds:
+        for k in range(indptr[i], indptr[i+1]):
+            e = slots[k] >> 1
+            if slots[k] & 1:
+                pairing_partners.add(p1[e])
+            else:
+                pairing_partners.add(p2[e])
+    return pairing_partners
+
+
+@njit((nb.int64[:], nbint[:], nbint[:], nb.int64[:]), cache=cache)
+def find_contacts_clusters(indptr, members, cluster_ids, inds): # pragma: no cover
+    '''
+    As find_contacts(), but for a layer that connects everyone in each cluster, so
+    the contacts of each person are the other members of their cluster, which are
+    members[indptr[c]:indptr[c+1]] for cluster c (see Layer.set_clusters())
+    '''
+    pairing_partners = set()
+    for i in inds:
+        c = cluster_ids[i]
+        if c >= 0:
+            for k in range(indptr[c], indptr[c+1]):
+                if members[k] != i:
+                    pairing_partners.add(members[k])
+    return pairing_partners
+
+
+@njit((nb.int64[:], nb.uint32[:], nb.int64[:]), cache=cache)
+def find_contacts_compact(indptr, contacts, inds): # pragma: no cover
+    ''' As find_contacts(), but for a compact layer, where the contacts of person i are contacts[indptr[i]:indptr[i+1]] (see cv.CompactLayer) '''
+    pairing_partners = set()
+    for i in inds:
+        for k in range(indptr[i], indptr[i+1]):
+            pairing_partners.add(np.int64(contacts[k]))
+    return pairing_partners
+
+
+@njit((nbint[:], nbint[:], nb.int64[:]), cache=cache)
 def find_contacts(p1, p2, inds): # pragma: no cover
     """
     Numba for Layer.find_contacts()
@@ -132,6 +1068,214 @@ def find_contacts(p1, p2, inds): # pragma: no cover
     return pairing_partners
 
 
+def make_clusters(pop_size, cluster_size):
+    '''
+    For make_microstructured_contacts(): draw Poisson cluster sizes until everyone
+    belongs to a cluster. The sizes are drawn one at a time, rather than all at
+    once, since the number of clusters isn't known in advance and extra draws would
+    change the rest of the population. The mean cluster size is converted as for
+    poisson().
+    '''
+    return _make_clusters(pop_size, default_rate(cluster_size))
+
+
+@njit((nb.int64, nbfloat), cache=cache)
+def _make_clusters(pop_size, cluster_size): # pragma: no cover
+    ''' Numba for make_clusters() '''
+    sizes = np.empty(16, dtype=np.int64)
+    n = 0
+    n_remaining = pop_size
+    while n_remaining > 0:
+        this_cluster = min(np.random.poisson(cluster_size, 1)[0], n_remaining)
+        if n == len(sizes):
+            sizes = grow(sizes, 2*n)
+        sizes[n] = this_cluster
+        n += 1
+        n_remaining -= this_cluster
+    return sizes[:n]
+
+
+@njit((nb.int64[:], nb.int64[:]), cache=cache)
+def make_cluster_edges(sizes, set_sizes): # pragma: no cover
+    '''
+    Numba for make_microstructured_contacts(): connect everyone in each cluster of
+    consecutive people. Each person's contacts are listed in the iteration order of
+    a Python set of consecutive integers (which is how they were previously stored),
+    i.e. by value modulo the size of the set's hash table (set_sizes[m] for m integers).
+    This copies CPython's set layout; see population.get_set_sizes() for caveats.
+    '''
+    n_edges = 0
+    for k in sizes:
+        n_edges += k*(k-1)//2
+    p1 = np.empty(n_edges, dtype=np.int64)
+    p2 = np.empty(n_edges, dtype=np.int64)
+    e = 0
+    start = 0
+    for k in sizes:
+        end = start + k
+        for i in range(start, end-1):
+            first = i + 1
+            table = set_sizes[end-first]
+            wrap = (first//table + 1)*table # The set starts from the first multiple of the table size, if the contacts span one
+            for j in range(wrap, end):
+                p1[e] = i
+                p2[e] = j
+                e += 1
+            for j in range(first, min(wrap, end)):
+                p1[e] = i
+                p2[e] = j
+                e += 1
+        start = end
+    return p1, p2
+
+
+@njit((nb.int64, nb.float64, nb.float64), cache=cache)
+def sample_compiled(code, par1, par2): # pragma: no cover
+    ''' Draw a single sample from a distribution converted by get_dist_pars(), using Numba's random number stream '''
+    if   code == 0: return np.random.uniform(par1, par2)
+    elif code == 1: return np.random.normal(par1, par2)
+    elif code == 2: return np.abs(np.random.normal(par1, par2))
+    elif code == 3: return np.round(np.abs(np.random.normal(par1, par2)))
+    elif code == 4: return np.random.lognormal(par1, par2)
+    elif code == 5: return np.round(np.random.lognormal(par1, par2))
+    elif code == 6: return float(np.random.poisson(par1))
+    else:           return 0.0
+
+
+@njit(             [(nb.int64[:], nbint, nb.float64[:,:], nb.float64[:], nbfloat[:], nbfloat[:],  nbfloat[:], nbfloat[:], nbfloat[:], nbfloat[:],
+                     nbfloat[:],  nbfloat[:],  nbfloat[:],  nbfloat[:],   nbfloat[:],  nbfloat[:],      nbfloat[:],       nbfloat[:],  nbfloat[:],    nbfloat[:],     nbfloat[:]),
+                    (nb.int64[:], nbint, nb.float64[:,:], nb.float64[:], nbfloat[:], nbfloat[:],  nbfloat[:], nbfloat[:], nbfloat[:], nbfloat[:],
+                     nbdate[:],   nbdate[:],   nbdate[:],   nbdate[:],    nbdate[:],   nbdate[:],       nbdate[:],        nbdate[:],   nbdate[:],     nbdate[:],      nbdate[:])], cache=cache)
+def compute_prognoses(inds, t,     dist_pars,       rel_probs,     symp_prob,  severe_prob, crit_prob,  death_prob, symp_imm,   sev_imm,
+                     dur_exp2inf, dur_inf2sym, dur_sym2sev, dur_sev2crit, dur_disease, date_infectious, date_symptomatic, date_severe, date_critical, date_recovered, date_dead): # pragma: no cover
+    '''
+    Assign the durations and dates of the disease course for newly infected people
+    in a single pass, using Numba's random number stream; used by People.infect()
+    with prog_mode='compiled'. Statistically equivalent to the NumPy cascade used
+    with prog_mode='exact'. The arrays of durations and dates are modified in place.
+
+    Args:
+        inds: (int[]) indices of the people being infected
+        t: (int) timestep
+        dist_pars: (float[9,3]) duration distributions from get_dist_pars(), in the order exp2inf, asym2rec, inf2sym, mild2rec, sym2sev, sev2rec, sev2crit, crit2rec, crit2die
+        rel_probs: (float[4]) multipliers for the symptomatic, severe, critical, and death probabilities, including strain and bed-capacity effects
+        symp_prob, severe_prob, crit_prob, death_prob: (float[]) people's prognosis probabilities
+        symp_imm, sev_imm: (float[]) people's immunity against symptoms and severe disease for this strain
+    '''
+    for i in inds:
+
+        # Exposed to infectious
+        dur_exp2inf[i] = sample_compiled(np.int64(dist_pars[0,0]), dist_pars[0,1], dist_pars[0,2])
+        date_infectious[i] = dur_exp2inf[i] + t
+        dur = dur_exp2inf[i]
+
+        # CASE 1: Asymptomatic
+        if not np.random.random() < rel_probs[0]*symp_prob[i]*(1-symp_imm[i]):
+            rec = sample_compiled(np.int64(dist_pars[1,0]), dist_pars[1,1], dist_pars[1,2])
+            date_recovered[i] = date_infectious[i] + rec
+            dur_disease[i] = dur + rec
+            continue
+
+        # CASE 2: Symptomatic
+        dur_inf2sym[i] = sample_compiled(np.int64(dist_pars[2,0]), dist_pars[2,1], dist_pars[2,2])
+        date_symptomatic[i] = date_infectious[i] + dur_inf2sym[i]
+        dur += dur_inf2sym[i]
+
+        # CASE 2.1: Mild symptoms
+        if not np.random.random() < rel_probs[1]*severe_prob[i]*(1-sev_imm[i]):
+            rec = sample_compiled(np.int64(dist_pars[3,0]), dist_pars[3,1], dist_pars[3,2])
+            date_recovered[i] = date_symptomatic[i] + rec
+            dur_disease[i] = dur + rec
+            continue
+
+        # CASE 2.2: Severe
+        dur_sym2sev[i] = sample_compiled(np.int64(dist_pars[4,0]), dist_pars[4,1], dist_pars[4,2])
+        date_severe[i] = date_symptomatic[i] + dur_sym2sev[i]
+        dur += dur_sym2sev[i]
+
+        # CASE 2.2.1: Not critical
+        if not np.random.random() < rel_probs[2]*crit_prob[i]:
+            rec = sample_compiled(np.int64(dist_pars[5,0]), dist_pars[5,1], dist_pars[5,2])
+            date_recovered[i] = date_severe[i] + rec
+            dur_disease[i] = dur + rec
+            continue
+
+        # CASE 2.2.2: Critical
+        dur_sev2crit[i] = sample_compiled(np.int64(dist_pars[6,0]), dist_pars[6,1], dist_pars[6,2])
+        date_critical[i] = date_severe[i] + dur_sev2crit[i]
+        dur += dur_sev2crit[i]
+
+        # CASE 2.2.2.1: Did not die
+        if not np.random.random() < rel_probs[3]*death_prob[i]:
+            rec = sample_compiled(np.int64(dist_pars[7,0]), dist_pars[7,1], dist_pars[7,2])
+            date_recovered[i] = date_critical[i] + rec
+            dur_disease[i] = dur + rec
+
+        # CASE 2.2.2.2: Did die
+        else:
+            die = sample_compiled(np.int64(dist_pars[8,0]), dist_pars[8,1], dist_pars[8,2])
+            date_dead[i] = date_critical[i] + die
+            dur_disease[i] = dur + die
+            date_recovered[i] = nan_value(date_recovered)
+
+    return
+
+
+
+#%% Strain counts -- used by People.check_infectious() and Sim.step()
+
+@njit((nbstrain[:], nbint[:], nb.int64), cache=cache)
+def count_strains(strains, inds, n_strains): # pragma: no cover
+    '''
+    Count the people with each strain, like np.bincount(strains[inds], minlength=n_strains),
+    but skipping people with no strain (-1).
+
+    Args:
+        strains: (int[]) people's strains, e.g. people.infectious_strain
+        inds: (int[]) indices of the people to count
+        n_strains: (int) the number of strains
+
+    Returns:
+        counts (int[]): the number of people with each strain
+    '''
+    counts = np.zeros(n_strains, dtype=np.int64)
+    for i in inds:
+        strain = strains[i]
+        if strain >= 0:
+            counts[strain] += 1
+    return counts
+
+
+@njit((nbstrain[:], nbint[:], nb.int64), cache=cache)
+def group_strains(strains, inds, n_strains): # pragma: no cover
+    '''
+    Group people by strain with a counting sort, so the people with each strain are
+    found in a single pass rather than one pass per strain. The people with strain s
+    are grouped[ptr[s]:ptr[s+1]], in the same order as in inds; people with no strain
+    (-1) are skipped.
+
+    Args:
+        strains: (int[]) people's strains, e.g. people.infectious_strain
+        inds: (int[]) indices of the people to group
+        n_strains: (int) the number of strains
+
+    Returns:
+        ptr (int[]): the start of each strain's group, plus the total, of length n_strains+1
+        grouped (int[]): the indices of the people, grouped by strain
+    '''
+    counts = count_strains(strains, inds, n_strains)
+    ptr = np.zeros(n_strains+1, dtype=np.int64)
+    ptr[1:] = np.cumsum(counts)
+    grouped = np.empty(ptr[-1], dtype=np.int64)
+    pos = ptr[:-1].copy()
+    for i in inds:
+        strain = strains[i]
+        if strain >= 0:
+            grouped[pos[strain]] = i
+            pos[strain] += 1
+    return ptr, grouped
+
+
 
 #%% Sampling and seed methods
 
@@ -253,6 +1397,42 @@ def get_pdf(dist=None, par1=None, par2=None):
     return pdf
 
 
+def get_dist_pars(dist=None, par1=None, par2=None):
+    '''
+    Convert a distribution as used by sample() into the [code, par1, par2] form
+    used by the compiled sampler (see compute_prognoses()); lognormal parameters
+    are converted to those of the underlying normal distribution, as in sample().
+    '''
+    codes = {
+        'uniform'       : 0,
+        'unif'          : 0,
+        'normal'        : 1,
+        'norm'          : 1,
+        'normal_pos'    : 2,
+        'normal_int'    : 3,
+        'lognormal'     : 4,
+        'lognorm'       : 4,
+        'lognormal_int' : 5,
+        'lognorm_int'   : 5,
+        'poisson'       : 6,
+    }
+    if dist not in codes:
+        choicestr = '\n'.join(codes.keys())
+        errormsg = f'The distribution "{dist}" is not available with compiled sampling (e.g. prog_mode="compiled"); choices are: {choicestr}'
+        raise NotImplementedError(errormsg)
+    code = codes[dist]
+    if code in [4, 5]:
+        if par1 > 0:
+            mean  = np.log(par1**2 / np.sqrt(par2**2 + par1**2)) # Computes the mean of the underlying normal distribution
+            sigma = np.sqrt(np.log(par2**2/par1**2 + 1)) # Computes sigma for the underlying normal distribution
+            par1, par2 = mean, sigma
+        else:
+            code = -1 # Always zero, as in sample()
+    if par2 is None:
+        par2 = 0
+    return [code, par1, par2]
+
+
 def set_seed(seed=None):
     '''
     Reset the random seed -- complicated because of Numba, which requires special
@@ -263,7 +1443,7 @@ def set_seed(seed=None):
         seed (int): the random seed
     '''
 
-    @nb.njit((nbint,), cache=cache)
+    @nb.njit((nb.int64,), cache=cache)
     def set_seed_numba(seed):
         return np.random.seed(seed)
 
@@ -283,6 +1463,28 @@ def set_seed(seed=None):
     return
 
 
+def get_rng_state():
+    '''
+    Return the state of the random number streams that set_seed() resets (NumPy's,
+    Numba's, and Python's), so that it can be restored with set_rng_state(), e.g. to
+    give each replicate of an ensemble its own stream. Numba doesn't expose its
+    stream's state publicly, so this uses its internal helpers; the stream used by
+    parallel Numba functions (see cv.options.numba_parallel) is not included.
+    '''
+    import numba._helperlib as nbh # Not imported by "import numba"
+    numba_state = nbh.rnd_get_state(nbh.rnd_get_np_state_ptr())
+    return dict(numpy=np.random.get_state(), numba=numba_state, python=random.getstate())
+
+
+def set_rng_state(state):
+    ''' Restore the random number streams from the output of get_rng_state() '''
+    import numba._helperlib as nbh
+    np.random.set_state(state['numpy'])
+    nbh.rnd_set_state(nbh.rnd_get_np_state_ptr(), state['numba'])
+    random.setstate(state['python'])
+    return
+
+
 #%% Probabilities -- mostly not jitted since performance gain is minimal
 
 __all__ += ['n_binomial', 'binomial_filter', 'binomial_arr', 'n_multinomial',
@@ -360,7 +1562,16 @@ def n_multinomial(probs, n): # No speed gain from Numba
     return np.searchsorted(np.cumsum(probs), np.random.random(n))
 
 
-@nb.njit((nbfloat,), cache=cache, parallel=rand_parallel) # Numba hugely increases performance
+def default_rate(rate):
+    '''
+    Convert a rate given as a Python number to the default precision (cv.options.precision).
+    Since the Numba functions are compiled for both precisions, a Python float would
+    otherwise always use the 64-bit version, giving different draws for rates that
+    can't be represented exactly in 32 bits; NumPy floats are left as they are.
+    '''
+    return rate if isinstance(rate, np.floating) else cvd.default_float(rate)
+
+
 def poisson(rate):
     '''
     A Poisson trial.
@@ -372,10 +1583,9 @@ def poisson(rate):
 
         outcome = cv.poisson(100) # Single Poisson trial with mean 100
     '''
-    return np.random.poisson(rate, 1)[0]
+    return _poisson(default_rate(rate))
 
 
-@nb.njit((nbfloat, nbint), cache=cache, parallel=rand_parallel) # Numba hugely increases performance
 def n_poisson(rate, n):
     '''
     An array of Poisson trials.
@@ -388,6 +1598,18 @@ def n_poisson(rate, n):
 
         outcomes = cv.n_poisson(100, 20) # 20 Poisson trials with mean 100
     '''
+    return _n_poisson(default_rate(rate), n)
+
+
+@njit((nbfloat,), cache=cache, parallel=rand_parallel) # Numba hugely increases performance
+def _poisson(rate):
+    ''' Numba for poisson() '''
+    return np.random.poisson(rate, 1)[0]
+
+
+@njit((nbfloat, nbint), cache=cache, parallel=rand_parallel) # Numba hugely increases performance
+def _n_poisson(rate, n):
+    ''' Numba for n_poisson() '''
     return np.random.poisson(rate, n)
 
 
@@ -412,7 +1634,7 @@ def n_neg_binomial(rate, dispersion, n, step=1): # Numba not used due to incompa
     return samples
 
 
-@nb.njit((nbint, nbint), cache=cache) # Numba hugely increases performance
+@njit((nbint, nbint), cache=cache) # Numba hugely increases performance
 def choose(max_n, n):
     '''
     Choose a subset of items (e.g., people) without replacement.
@@ -428,7 +1650,7 @@ def choose(max_n, n):
     return np.random.choice(max_n, n, replace=False)
 
 
-@nb.njit((nbint, nbint), cache=cache) # Numba hugely increases performance
+@njit((nbint, nbint), cache=cache) # Numba hugely increases performance
 def choose_r(max_n, n):
     '''
     Choose a subset of items (e.g., people), with replacement.
@@ -507,7 +1729,8 @@ def false(arr):
 
 def defined(arr):
     '''
-    Returns the indices of the values of the array that are not-nan.
+    Returns the indices of the values of the array that are not-nan (or, for dates
+    stored as integers, not cv.defaults.date_nan).
 
     Args:
         arr (array): any array
@@ -516,7 +1739,7 @@ def defined(arr):
 
         inds = cv.defined(np.array([1,np.nan,0,np.nan,1,0,1]))
     '''
-    return (~np.isnan(arr)).nonzero()[0]
+    return (~isnan(arr)).nonzero()[0]
 
 
 def undefined(arr):
@@ -530,7 +1753,7 @@ def undefined(arr):
 
         inds = cv.defined(np.array([1,np.nan,0,np.nan,1,0,1]))
     '''
-    return np.isnan(arr).nonzero()[0]
+    return isnan(arr).nonzero()[0]
 
 
 def itrue(arr, inds):
@@ -575,7 +1798,7 @@ def idefined(arr, inds):
 
         inds = cv.idefined(np.array([3,np.nan,np.nan,4]), inds=np.array([5,22,47,93]))
     '''
-    return inds[~np.isnan(arr)]
+    return inds[~isnan(arr)]
 
 
 def iundefined(arr, inds):
@@ -590,7 +1813,7 @@ def iundefined(arr, inds):
 
         inds = cv.iundefined(np.array([3,np.nan,np.nan,4]), inds=np.array([5,22,47,93]))
     '''
-    return inds[np.isnan(arr)]
+    return inds[isnan(arr)]
 
 
 
@@ -636,7 +1859,7 @@ def idefinedi(arr, inds):
 
         inds = cv.idefinedi(np.array([4,np.nan,0,np.nan,np.nan,4,7,4,np.nan]), inds=np.array([0,1,3,5]))
     '''
-    return inds[~np.isnan(arr[inds])]
+    return inds[~isnan(arr[inds])]
 
 
 def iundefinedi(arr, inds):
@@ -651,4 +1874,230 @@ def iundefinedi(arr, inds):
 
         inds = cv.iundefinedi(np.array([4,np.nan,0,np.nan,np.nan,4,7,4,np.nan]), inds=np.array([0,1,3,5]))
     '''
-    return inds[np.isnan(arr[inds])]
\ No newline at end of file
+    return inds[isnan(arr[inds])]
+
+
+
+#%% Bit-packed states -- used by cv.BitArray
+
+word_bits = 64 # Number of people per word
+pop_m1  = np.uint64(0x5555555555555555)
+pop_m2  = np.uint64(0x3333333333333333)
+pop_m4  = np.uint64(0x0F0F0F0F0F0F0F0F)
+pop_h01 = np.uint64(0x0101010101010101)
+
+
+@njit((nb.uint64,), cache=cache)
+def popcount(x): # pragma: no cover
+    ''' Count the bits that are set in a 64-bit word '''
+    x = x - ((x >> np.uint64(1)) & pop_m1)
+    x = (x & pop_m2) + ((x >> np.uint64(2)) & pop_m2)
+    x = (x + (x >> np.uint64(4))) & pop_m4
+    return (x * pop_h01) >> np.uint64(56)
+
+
+@njit((nbbool[:,:],), cache=cache)
+def pack_bits(arr): # pragma: no cover
+    ''' Pack each row of a boolean array into 64-bit words, with person i in bit i%64 of word i//64 '''
+    n_rows, n = arr.shape
+    words = np.zeros((n_rows, (n + word_bits - 1)//word_bits), dtype=np.uint64)
+    for r in range(n_rows):
+        for i in range(n):
+            if arr[r,i]:
+                words[r,i >> 6] |= np.uint64(1) << np.uint64(i & 63)
+    return words
+
+
+@njit((nb.uint64[:,:], nb.int64), cache=cache)
+def unpack_bits(words, n): # pragma: no cover
+    ''' Unpack each row of 64-bit words into a boolean array of length n; the inverse of pack_bits() '''
+    n_rows = words.shape[0]
+    arr = np.empty((n_rows, n), dtype=np.bool_)
+    for r in range(n_rows):
+        for i in range(n):
+            arr[r,i] = (words[r,i >> 6] >> np.uint64(i & 63)) & np.uint64(1)
+    return arr
+
+
+@njit((nb.uint64[:,:], nb.int64[:]), cache=cache)
+def get_bits(words, inds): # pragma: no cover
+    ''' Test the bits of the specified people in each row '''
+    n_rows = words.shape[0]
+    out = np.empty((n_rows, len(inds)), dtype=np.bool_)
+    for r in range(n_rows):
+        for k in range(len(inds)):
+            i = inds[k]
+            out[r,k] = (words[r,i >> 6] >> np.uint64(i & 63)) & np.uint64(1)
+    return out
+
+
+@njit((nb.uint64[:,:], nb.int64[:], nbbool[:,:]), cache=cache)
+def set_bits(words, inds, values): # pragma: no cover
+    '''
+    Set the bits of the specified people in each row, in place, to the values,
+    which are broadcast if they have only one row or column. As for NumPy
+    assignment, if a person appears more than once, the last value is used.
+    '''
+    n_rows = words.shape[0]
+    v_rows, v_cols = values.shape
+    for r in range(n_rows):
+        vr = r if v_rows > 1 else 0
+        for k in range(len(inds)):
+            i = inds[k]
+            bit = np.uint64(1) << np.uint64(i & 63)
+            if values[vr, k if v_cols > 1 else 0]:
+                words[r,i >> 6] |= bit
+            else:
+                words[r,i >> 6] &= ~bit
+    return
+
+
+@njit((nb.uint64[:,:],), cache=cache)
+def count_bits(words): # pragma: no cover
+    ''' Count the bits that are set in each row, using popcount() on each word '''
+    n_rows, n_words = words.shape
+    counts = np.zeros(n_rows, dtype=np.int64)
+    for r in range(n_rows):
+        for w in range(n_words):
+            counts[r] += popcount(words[r,w])
+    return counts
+
+
+@njit((nb.uint64[:],), cache=cache)
+def find_bits(words): # pragma: no cover
+    ''' Return the indices of the bits that are set, in order, skipping empty words '''
+    n = 0
+    for w in range(len(words)):
+        n += popcount(words[w])
+    inds = np.empty(n, dtype=np.int64)
+    k = 0
+    for w in range(len(words)):
+        word = words[w]
+        while word:
+            low = word & (~word + np.uint64(1)) # Lowest bit that is set
+            inds[k] = (w << 6) + popcount(low - np.uint64(1))
+            k += 1
+            word ^= low
+    return inds
+
+
+
+#%% Compilation
+
+__all__ += ['precompile', 'cache_report']
+
+
+def get_kernels():
+    ''' Return the Numba functions defined in this module, by name '''
+    return {key:val for key,val in globals().items() if isinstance(val, nb.core.dispatcher.Dispatcher)}
+
+
+def cache_report(output=False, verbose=True):
+    '''
+    Report whether each Numba function in this process was loaded from the on-disk
+    cache, compiled, or not compiled yet (e.g. with cv.options.headless, or for
+    helpers that are only compiled as part of other functions). To print this
+    report when Covasim is imported, set ``COVASIM_NUMBA_REPORT=1``.
+
+    Args:
+        output (bool): whether to return the report as a dict
+        verbose (bool): whether to print the report
+
+    **Example**::
+
+        report = cv.cache_report(output=True)
+    '''
+    report = {}
+    cache_paths = set()
+    for name,kernel in get_kernels().items():
+        stats = kernel.stats
+        hits = sum(stats.cache_hits.values())
+        misses = sum(stats.cache_misses.values())
+        if not kernel.signatures:
+            status = 'not compiled'
+        elif hits and not misses:
+            status = 'cached'
+        else:
+            status = 'compiled'
+        if stats.cache_path:
+            cache_paths.add(stats.cache_path)
+        report[name] = dict(status=status, signatures=len(kernel.signatures), cache_hits=hits, cache_misses=misses)
+
+    if verbose:
+        counts = {status:sum(entry['status'] == status for entry in report.values()) for status in ['cached', 'compiled', 'not compiled']}
+        pathstr = ', '.join(sorted(cache_paths)) if cache_paths else 'none (caching is off)'
+        print(f'Numba functions: {counts["cached"]} loaded from cache, {counts["compiled"]} compiled, {counts["not compiled"]} not compiled')
+        print(f'Cache location: {pathstr}')
+        for name,entry in report.items():
+            print(f'  {name:<35} {entry["status"]}')
+
+    if output:
+        return report
+    else:
+        return
+
+
+def precompile(cache_dir=None, verbose=True):
+    '''
+    Compile all of Covasim's Numba functions ahead of time, for both 32 and 64 bit
+    precision, and store them in the Numba cache, so that sims on a new machine (e.g.
+    a freshly built container) don't have to compile them first. The functions are
+    compiled in a separate process, so that all of them are compiled even if this
+    process has already loaded them or is running headless.
+
+    To use the cache, set the environment variable ``COVASIM_NUMBA_CACHE_DIR`` to
+    the same folder before importing Covasim. Note that Numba only reuses cached
+    functions if the Covasim source files have the same location and modification
+    times, and if the Numba parallelization option (cv.options.numba_parallel) is
+    the same; the current value of this option is used here.
+
+    Can also be run from the command line via ``bin/covasim_precompile``.
+
+    Args:
+        cache_dir (str): the folder to store the cache in (default: cv.options.numba_cache_dir if set, else next to the source files)
+        verbose (bool): whether to print a summary
+
+    Returns:
+        report (dict): the output of cache_report() for the new process
+
+    **Example**::
+
+        cv.precompile('/opt/covasim/numba_cache') # Then set COVASIM_NUMBA_CACHE_DIR=/opt/covasim/numba_cache on each worker
+    '''
+    import os
+    import sys
+    import json
+    import subprocess
+
+    if cache_dir is None:
+        cache_dir = cvo.numba_cache_dir
+
+    # Make sure the new process imports this copy of Covasim
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pythonpath = os.pathsep.join([root] + [p for p in [os.environ.get('PYTHONPATH')] if p])
+
+    parallel = 'full' if rand_parallel else 'safe' if safe_parallel else 'none' # Use the same parallelization as this process
+    code = 'import json, covasim as cv; cv.set_seed(1); print(json.dumps(cv.cache_report(output=True, verbose=False)))'
+    env = dict(os.environ)
+    env.update(
+        PYTHONPATH             = pythonpath,
+        COVASIM_HEADLESS       = '0', # Compile everything on import
+        COVASIM_NUMBA_CACHE    = '1',
+        COVASIM_NUMBA_PARALLEL = parallel,
+        COVASIM_NUMBA_REPORT   = '0',
+        COVASIM_VERBOSE        = '0',
+    )
+    if cache_dir:
+        env['COVASIM_NUMBA_CACHE_DIR'] = str(cache_dir)
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True)
+    if result.returncode:
+        errormsg = f'Could not precompile Numba functions:\n{result.stderr}'
+        raise RuntimeError(errormsg)
+    report = json.loads(result.stdout.splitlines()[-1])
+
+    if verbose:
+        n_cached   = sum(entry['status'] == 'cached'   for entry in report.values())
+        n_compiled = sum(entry['status'] == 'compiled' for entry in report.values())
+        print(f'Numba functions: {n_compiled} compiled, {n_cached} already cached')
+
+    return report
@@ -0,0 +1,72 @@
+'''
+Benchmark how long it takes to import Covasim, with and without COVASIM_HEADLESS,
+and how long the first small sim then takes to run (which includes compiling any
+Numba functions that were deferred). Each measurement is made in a fresh Python
+process, since imports are only slow the first time. Since the timings depend on
+the machine, they're saved to the temporary folder rather than with the tests.
+'''
+
+import os
+import sys
+import tempfile
+import subprocess
+import sciris as sc
+
+do_save = False
+repeats = 5
+benchmark_filename = os.path.join(tempfile.gettempdir(), 'covasim_benchmark_import.json')
+
+script = '''
+import time
+t0 = time.time()
+import covasim as cv
+t1 = time.time()
+cv.Sim(pop_size=1000, n_days=10, verbose=0).run()
+t2 = time.time()
+print(t1-t0, t2-t1)
+'''
+
+
+def time_import(headless=False):
+    ''' Time importing Covasim and running a small sim in a new process '''
+    env = sc.mergedicts(dict(os.environ), {'COVASIM_HEADLESS':str(int(headless)), 'COVASIM_VERBOSE':'0'})
+    output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+    t_import, t_first = [float(x) for x in output.stdout.split()[-2:]]
+    return t_import, t_first
+
+
+def benchmark_import(do_save=do_save, repeats=repeats):
+    ''' Compare import times with and without headless mode '''
+
+    print('Running import benchmark...')
+    previous = sc.loadjson(benchmark_filename) if os.path.exists(benchmark_filename) else None
+
+    time_import() # Make sure the Numba cache is populated before timing
+
+    json = {'time': {}, 'repeats': repeats}
+    n_decimals = 3
+    for headless in [False, True]:
+        times = [time_import(headless=headless) for r in range(repeats)]
+        label = 'headless' if headless else 'default'
+        json['time'][label] = {
+            'import':    round(min(t[0] for t in times), n_decimals),
+            'first_sim': round(min(t[1] for t in times), n_decimals),
+        }
+
+    if previous is not None:
+        print('Previous benchmark:')
+        sc.pp(previous)
+
+    print('\nNew benchmark:')
+    sc.pp(json)
+
+    if do_save:
+        sc.savejson(filename=benchmark_filename, obj=json, indent=2)
+
+    print('Done.')
+
+    return json
+
+
+if __name__ == '__main__':
+    json = benchmark_import()
@@ -3,6 +3,7 @@ Tests for immune waning, strains, and vaccine intervention.
 '''
 
 #%% Imports and settings
+import numpy as np
 import sciris as sc
 import covasim as cv
 import pandas as pd
@@ -137,6 +138,13 @@ def test_strains(do_plot=False):
     sim  = cv.Sim(base_pars, use_waning=True, strains=[b117, p1, cust])
     sim.run()
 
+    # Strains are stored as small integers, with -1 for none
+    ppl = sim.people
+    assert ppl.exposed_strain.dtype == cv.defaults.strain_int
+    assert np.array_equal(ppl.exposed_strain >= 0, ppl.exposed)
+    counts = cv.utils.count_strains(ppl.exposed_strain, cv.true(ppl.exposed), sim['n_strains'])
+    assert counts.tolist() == [np.count_nonzero(ppl.exposed_strain == strain) for strain in range(sim['n_strains'])]
+
     if do_plot:
         sim.plot('overview-strain')
 
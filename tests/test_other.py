@@ -5,7 +5,9 @@ corner cases or otherwise not part of major workflows.
 
 #%% Imports and settings
 import os
+import sys
 import pytest
+import subprocess
 import numpy as np
 import sciris as sc
 import covasim as cv
@@ -154,6 +156,150 @@ def test_basepeople():
     return
 
 
+def test_neighbor_index():
+    sc.heading('Testing the neighbor index...')
+
+    # Generate an average of 10 contacts for 1000 people
+    n = 10_000
+    n_people = 1000
+    p1 = np.random.randint(n_people, size=n)
+    p2 = np.random.randint(n_people, size=n)
+    layer = cv.Layer(p1=p1, p2=p2, beta=np.ones(n))
+
+    # Test the neighbor index
+    inds = np.arange(0, n_people, 7)
+    orig = layer.find_contacts(inds)
+    index = layer.make_index(n_people)
+    assert len(index.indptr) == n_people + 1
+    assert len(index.slots) == 2*n
+    assert np.array_equal(layer.find_contacts(inds), orig)
+    layer.pop_inds(np.arange(10)) # Modifying the edges discards the index
+    assert layer.neighbor_index is None
+
+    return index
+
+
+def test_infection_log():
+    sc.heading('Testing the infection log...')
+
+    pars = dict(pop_size=100, n_days=10, verbose=verbose, pop_type='hybrid', beta=0.02)
+    s1 = cv.Sim(pars, dynam_layer={'c':1})
+    s1.run()
+
+    # Test the infection log, including converting from a list of dicts
+    log = s1.people.infection_log
+    entries = list(log)
+    assert len(entries) == len(log) == s1.results['cum_infections'][-1]
+    assert entries[0]['source'] is None and entries[0]['layer'] == 'seed_infection'
+    assert log[-1] == entries[-1]
+    assert np.array_equal(log.to_df()['target'].values, [e['target'] for e in entries])
+    log2 = cv.people.InfectionLog.from_list(entries)
+    assert list(log2) == entries
+    s1.people.infection_log = entries
+    s1.people = cv.migrate(s1.people)
+    assert list(s1.people.infection_log) == entries
+
+    return log
+
+
+def test_viral_switch():
+    sc.heading('Testing the precomputed viral load...')
+
+    pars = dict(pop_size=100, n_days=10, verbose=verbose, pop_type='hybrid', beta=0.02)
+    s1 = cv.Sim(pars, dynam_layer={'c':1})
+    s1.run()
+
+    # Test the precomputed viral load against the full calculation, including adding it to older people
+    ppl = s1.people
+    switch = ppl.date_viral_switch.copy()
+    vd = {k:cv.defaults.default_float(v) for k,v in s1['viral_dist'].items()}
+    inds = cv.true(ppl.infectious)
+    orig = cv.utils.compute_viral_load(ppl.t, ppl.date_infectious, ppl.date_recovered, ppl.date_dead, vd['frac_time'], vd['load_ratio'], vd['high_cap'])
+    assert np.array_equal(ppl.get_viral_load()[inds], orig[inds])
+    for states in [ppl.meta.dates, ppl.meta.all_states]:
+        states.remove('date_viral_switch')
+    del ppl.__dict__['date_viral_switch']
+    ppl = cv.migrate(ppl)
+    assert np.array_equal(ppl.date_viral_switch, switch, equal_nan=True)
+
+    return ppl
+
+
+def test_clusters():
+    sc.heading('Testing household clusters...')
+
+    # Test the household clusters
+    sim = cv.Sim(pop_size=1000, pop_type='hybrid', verbose=verbose)
+    sim.initialize()
+    inds = np.arange(0, len(sim.people), 7)
+    layer = sim.people.contacts['h']
+    clusters = layer.clusters
+    assert clusters is not None and len(clusters.members) == len(sim.people)
+    orig = cv.utils.find_contacts(layer['p1'], layer['p2'], inds)
+    assert np.array_equal(layer.find_contacts(inds), sorted(orig))
+    assert np.array_equal(layer.find_cluster_members(inds), np.union1d(sorted(orig), inds))
+    layer.reset_index()
+    assert layer.clusters is None
+    with pytest.raises(ValueError):
+        layer.find_cluster_members(inds)
+
+    return clusters
+
+
+def test_reorder():
+    sc.heading('Testing reordering the agents...')
+
+    pars = dict(pop_size=100, n_days=10, verbose=verbose, pop_type='hybrid', beta=0.02)
+    s2 = cv.Sim(pars, dynam_layer={'c':0})
+    s2.run()
+
+    # Test reordering the agents: the identity is a no-op, and RCM preserves the contacts via the UIDs
+    s3 = cv.Sim(pars, dynam_layer={'c':0})
+    s3.initialize(reorder=np.arange(pars['pop_size']))
+    s3.run()
+    assert not cv.diff_sims(s2, s3, output=True)
+    s4 = cv.Sim(pars, dynam_layer={'c':0})
+    s4.initialize(reorder=True)
+    ppl = s4.people
+    for lkey in ['h', 's', 'w']:
+        orig = s2.people.contacts[lkey]
+        layer = ppl.contacts[lkey]
+        edges = lambda p1, p2: set(zip(*np.sort([p1, p2], axis=0).tolist()))
+        assert edges(ppl.uid[layer['p1']], ppl.uid[layer['p2']]) == edges(orig['p1'], orig['p2'])
+    uids = ppl.uid[::7]
+    assert np.array_equal(ppl.uid[ppl.find_uids(uids)], uids)
+    with pytest.raises(sc.KeyNotFoundError):
+        ppl.find_uids([pars['pop_size']])
+    with pytest.raises(RuntimeError):
+        ppl.reorder()
+    s4.run()
+    s4.people.story(int(s4.people.uid[0]))
+    df = s4.people.infection_log.to_df(uids=s4.people.uid)
+    assert df['target'].isin(s4.people.uid).all()
+
+    # Check that the exports list people by UID, matching the original order
+    ppl = s4.people
+    df = ppl.to_df().set_index('uid').sort_index()
+    assert np.array_equal(df.index, s2.people.uid) and np.array_equal(df['age'], s2.people.age)
+    assert np.array_equal(ppl.to_arr()[:, list(ppl.to_df().columns).index('uid')], ppl.uid)
+    log = ppl.infection_log
+    df = ppl.log_to_df()
+    has_source = log.source >= 0
+    assert np.array_equal(ppl.find_uids(df['target'].values), log.target)
+    assert np.array_equal(ppl.find_uids(df['source'].values[has_source].astype(int)), log.source[has_source])
+    try:
+        import networkx as nx # Optional dependency
+    except ModuleNotFoundError as E:
+        print(f'Could not test conversion to networkx ({str(E)})')
+    else:
+        edges = lambda G: set(G.edges(data='layer'))
+        G = ppl.to_graph()
+        assert edges(G) == edges(s2.people.to_graph())
+        assert all(G.nodes[uid]['age'] == s2.people.age[uid] for uid in G.nodes)
+
+    return s4
+
+
 def test_misc():
     sc.heading('Testing miscellaneous functions')
 
@@ -305,9 +451,54 @@ def test_population():
 
     remove_files(pop_path)
 
+    # Vectorized populations have identical contacts
+    for pop_type in ['random', 'hybrid']:
+        contacts = {}
+        for vectorized in [False, True]:
+            sim = cv.Sim(pop_size=2000, pop_type=pop_type, rand_seed=3)
+            sim.initialize(vectorized=vectorized)
+            contacts[vectorized] = sim.people.contacts
+        for lkey,layer in contacts[False].items():
+            for key in ['p1', 'p2', 'beta']:
+                assert np.array_equal(layer[key], contacts[True][lkey][key]), f'Vectorized {pop_type} population differs for "{lkey}" {key}'
+
+    cv.set_seed(1)
+    contacts_list, layer_keys, clusters = cv.make_microstructured_contacts(2000, {'h':4, 'w':12})
+    cv.set_seed(1)
+    edges, _, cluster_ids = cv.make_microstructured_edges(2000, {'h':4, 'w':12})
+    for lkey in layer_keys:
+        p2 = np.concatenate([person[lkey] for person in contacts_list])
+        assert np.array_equal(p2, edges[lkey]['p2']), f'Vectorized clustered population differs for "{lkey}"'
+        assert np.array_equal(cluster_ids[lkey][edges[lkey]['p1']], cluster_ids[lkey][edges[lkey]['p2']]), f'Contacts in "{lkey}" should be in the same cluster'
+        for cluster_id,inds in clusters[lkey].items():
+            assert (cluster_ids[lkey][inds] == cluster_id).all()
+
     return
 
 
+def test_cluster_order():
+    sc.heading('Testing that clustered contacts are listed in the order of a Python set')
+
+    # Clustered contacts are listed in the order that previous versions stored them
+    # in, i.e. a set per person, for seed compatibility. This depends on CPython's
+    # set layout, so check it against real sets on the interpreter being used.
+    sizes = np.array([300] + list(range(1, 120))*2, dtype=np.int64)
+    p1, p2 = cv.utils.make_cluster_edges(sizes, cv.population.get_set_sizes(sizes.max()))
+    legacy = []
+    start = 0
+    for k in sizes:
+        for i in range(start, start+k):
+            contacts = set()
+            for j in range(i+1, start+k):
+                contacts.add(j)
+            legacy.extend(contacts)
+        start += k
+    errormsg = 'Clustered contacts are not in the order of a Python set on this interpreter, so clustered and hybrid populations will differ from previous versions'
+    assert np.array_equal(p2, legacy), errormsg
+    assert (np.diff(p1) >= 0).all()
+
+    return
+
 
 def test_requirements():
     sc.heading('Testing requirements')
@@ -447,6 +638,28 @@ def test_settings():
     sc.heading('Testing settings')
     cv.options.help()
     cv.options.set(numba_parallel=False) # Don't actually change the default, but call this method
+
+    # Check lazy imports
+    mod = cv.settings.LazyModule('json')
+    assert 'not yet loaded' in repr(mod)
+    assert mod.dumps([1]) == '[1]'
+    assert 'loaded' in repr(mod) and 'not' not in repr(mod)
+
+    # Check that a headless import doesn't import pylab, and gives the same results
+    code = '''
+import sys
+import covasim as cv
+assert 'matplotlib.pyplot' not in sys.modules and 'scipy.stats' not in sys.modules
+assert len(cv.utils.compute_viral_load.signatures) == 0 # Not compiled on import
+sim = cv.Sim(pop_size=500, n_days=20, verbose=0).run()
+assert not cv.utils.lazy_kernels # Compiled for the first sim
+print(sim.results['cum_infections'][-1])
+'''
+    env = sc.mergedicts(dict(os.environ), {'COVASIM_HEADLESS':'1', 'COVASIM_VERBOSE':'0'})
+    output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    sim = cv.Sim(pop_size=500, n_days=20, verbose=0).run()
+    assert float(output.stdout.split()[-1]) == sim.results['cum_infections'][-1]
+
     return
 
 
@@ -459,9 +672,15 @@ if __name__ == '__main__':
 
     test_base()
     test_basepeople()
+    test_neighbor_index()
+    test_infection_log()
+    test_viral_switch()
+    test_clusters()
+    test_reorder()
     test_misc()
     test_plotting()
     test_population()
+    test_cluster_order()
     test_requirements()
     test_run()
     test_sim()
@@ -140,6 +140,51 @@ def test_multisim_advanced():
     return merged1, merged2
 
 
+def test_ensemble(do_plot=do_plot):
+    sc.heading('Ensemble')
+
+    # Run an ensemble with a dynamic layer
+    pars = dict(pop_size=2000, pop_type='hybrid', n_days=40, dynam_layer=dict(c=1), verbose=verbose)
+    ens = cv.Ensemble(cv.Sim(pars), n_runs=3, keep_people=True)
+    ens.run()
+    infs = [sim.results['cum_infections'][-1] for sim in ens.sims]
+    assert len(set(infs)) > 1 # Replicates should differ
+
+    # Check that the replicates share the static layers and the people's states are stored together
+    people = [sim.people for sim in ens.sims]
+    assert people[0].contacts['h'] is people[1].contacts['h']
+    assert people[0].contacts['c'] is not people[1].contacts['c']
+    assert np.shares_memory(people[1].exposed, ens.people_arrays.exposed)
+
+    # Check that it's reproducible, and can be used like a multisim
+    ens2 = cv.Ensemble(cv.Sim(pars), n_runs=3).run(reduce=True)
+    assert infs == [sim.results['cum_infections'][-1] for sim in ens2.sims]
+
+    # Check that each replicate matches a separate sim with the same seed and population, so doesn't depend on the other replicates
+    tp = cv.test_prob(symp_prob=0.1, asymp_prob=0.01)
+    ens4 = cv.Ensemble(cv.Sim(pars, interventions=sc.dcp(tp)), n_runs=2).run()
+    base = cv.Sim(pars).initialize()
+    popdict = dict(uid=base.people.uid, age=base.people.age, sex=base.people.sex, contacts=base.people.contacts)
+    sim = cv.Sim(pars, rand_seed=base['rand_seed']+1, trans_mode='fused', trans_rng='counter', interventions=sc.dcp(tp))
+    sim.initialize(popdict=popdict)
+    sim.run()
+    for key in ['cum_infections', 'cum_tests', 'n_severe']:
+        assert np.array_equal(sim.results[key].values, ens4.sims[1].results[key].values), f'Ensemble replicate differs from separate sim for "{key}"'
+
+    # Check that layers changed by interventions are copied for each replicate, so each replicate's edges are clipped once
+    ce = cv.clip_edges(days=5, changes=0.5, layers='w')
+    ens3 = cv.Ensemble(cv.Sim(pars, interventions=ce), n_runs=3, keep_people=True).run()
+    n_edges = len(cv.Sim(pars).initialize().people.contacts['w'])
+    people = [sim.people for sim in ens3.sims]
+    assert 'w' not in ens3.shared_layers and people[0].contacts['w'] is not people[1].contacts['w']
+    for ppl in people:
+        assert abs(len(ppl.contacts['w'])/n_edges - 0.5) < 0.01
+    if do_plot:
+        ens2.plot()
+
+    return ens2
+
+
 def test_simple_scenarios(do_plot=do_plot):
     sc.heading('Simple scenarios test')
     basepars = {'pop_size':pop_size}
@@ -261,6 +306,7 @@ if __name__ == '__main__':
     msim1  = test_multisim_reduce(do_plot=do_plot)
     msim2  = test_multisim_combine(do_plot=do_plot)
     m1,m2  = test_multisim_advanced()
+    ens    = test_ensemble(do_plot=do_plot)
     scens1 = test_simple_scenarios(do_plot=do_plot)
     scens2 = test_complex_scenarios(do_plot=do_plot)
 
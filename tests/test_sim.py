@@ -5,6 +5,7 @@ Tests for single simulations
 #%% Imports and settings
 import os
 import pytest
+import numpy as np
 import sciris as sc
 import covasim as cv
 
@@ -13,6 +14,55 @@ do_save = 0
 cv.options.set(interactive=False) # Assume not running interactively
 
 
+def make_strain_sim(vaccinate=False, **kwargs):
+    ''' Make a sim with testing, contact tracing, and a second strain, for checking that options don't change the results '''
+    pars = dict(pop_size=5e3, pop_type='hybrid', n_days=60, use_waning=True, verbose=0)
+    interventions = [
+        cv.test_prob(symp_prob=0.1, asymp_prob=0.01, test_delay=2),
+        cv.contact_tracing(trace_probs=0.5, trace_time=1),
+    ]
+    if vaccinate:
+        interventions.append(cv.vaccinate(vaccine='pfizer', days=20, prob=0.1))
+    b117 = cv.strain('b117', days=10, n_imports=20)
+    sim = cv.Sim(sc.mergedicts(pars, kwargs), interventions=interventions, strains=b117)
+    return sim
+
+
+def run_with_options(sim, **kwargs):
+    ''' Run a sim with the given options set, e.g. packed_states=True, then reset them to their defaults '''
+    cv.options.set(**kwargs)
+    try:
+        sim.run()
+    finally:
+        cv.options.set(**{key:'default' for key in kwargs})
+    return sim
+
+
+def sum_results(pars, keys='cum_infections', n_seeds=4, **kwargs):
+    '''
+    Run a sim with several random seeds and sum the final values of the given
+    results; kwargs are passed to sim.initialize(), e.g. mass_action=True. Returns
+    the totals and the last sim.
+    '''
+    keys = sc.promotetolist(keys)
+    totals = {key:0 for key in keys}
+    for seed in range(n_seeds):
+        sim = cv.Sim(pars, rand_seed=seed)
+        sim.initialize(**kwargs)
+        sim.run()
+        for key in keys:
+            totals[key] += sim.results[key][-1]
+    return totals, sim
+
+
+def check_similar(totals, ref, label):
+    ''' Check that the totals from sum_results() are within 25% of the reference ones '''
+    for key in ref:
+        ratio = totals[key]/ref[key]
+        assert 0.8 < ratio < 1.25, f'{label} differ too much for {key}: {totals} vs. {ref}'
+    return
+
+
 #%% Define the tests
 
 def test_parsobj():
@@ -135,6 +185,349 @@ def test_dynamic_resampling(do_plot=False): # If being run via pytest, turn off
 
 
 
+def test_trans_mode():
+    sc.heading('Test fused transmission')
+
+    # Check that the fused engine gives similar results to the layered one
+    pars = dict(pop_size=5e3, pop_type='hybrid', n_days=60, verbose=0)
+    ref, _ = sum_results(sc.mergedicts(pars, trans_mode='layered'))
+    for trans_mode in ['fused', 'hazard']:
+        infs, _ = sum_results(sc.mergedicts(pars, trans_mode=trans_mode))
+        check_similar(infs, ref, f'{trans_mode.title()} and layered transmission')
+
+    # Check that with multiple strains, each person is infected at most once per timestep
+    for trans_mode in ['hazard', 'fused']:
+        b117 = cv.strain('b117', days=5, n_imports=20)
+        sim = cv.Sim(pars, trans_mode=trans_mode, use_waning=True, strains=b117).run()
+        assert sim.results['strain']['cum_infections_by_strain'][1,-1] > 0
+        log = sim.people.infection_log
+        assert len(set(zip(log.target, log.date))) == len(log)
+
+    # Check that counter-based random numbers are reproducible
+    pars.update(trans_mode='fused', trans_rng='counter')
+    sim1 = cv.Sim(pars).run()
+    sim2 = cv.Sim(pars).run()
+    assert np.array_equal(sim1.results['new_infections'].values, sim2.results['new_infections'].values)
+
+    # Check that they're also identical when the layers are calculated on several threads
+    sim3 = run_with_options(cv.Sim(pars), threads=4)
+    assert np.array_equal(sim1.results['new_infections'].values, sim3.results['new_infections'].values)
+
+    # Check that the hazard mode is reproducible with counter-based random numbers too
+    sim4 = cv.Sim(pars, trans_mode='hazard').run()
+    sim5 = cv.Sim(pars, trans_mode='hazard').run()
+    assert np.array_equal(sim4.results['new_infections'].values, sim5.results['new_infections'].values)
+
+    with pytest.raises(ValueError):
+        cv.Sim(trans_mode='not_a_mode').initialize()
+    with pytest.raises(ValueError):
+        cv.Sim(trans_rng='counter').initialize() # Not available with trans_mode='layered'
+
+    return sim
+
+
+def test_mass_action():
+    sc.heading('Test mass-action layers')
+
+    # Check that a mass-action community layer gives similar results to a dynamic random one, in each transmission mode
+    pars = dict(pop_size=5e3, pop_type='hybrid', n_days=60, dynam_layer={'c':1}, verbose=0)
+    for trans_mode in ['layered', 'fused', 'hazard']:
+        ref, _ = sum_results(sc.mergedicts(pars, trans_mode=trans_mode))
+        infs, sim = sum_results(sc.mergedicts(pars, trans_mode=trans_mode), mass_action=True)
+        check_similar(infs, ref, f'Mass-action and random layers ({trans_mode})')
+
+    # Check that only the contacts of infectious people are stored
+    layer = sim.people.contacts['c']
+    assert isinstance(layer, cv.MassActionLayer)
+    assert sim.people.infectious[layer['p1']].all()
+    assert len(layer) < sim['pop_size']*sim['contacts']['c']/2
+
+    with pytest.raises(ValueError):
+        cv.Sim(pars).initialize(mass_action='h')
+
+    return sim
+
+
+def test_cliques():
+    sc.heading('Test clique layers')
+
+    # Check that a clique household layer gives the same results as explicit edges with hazards, and similar results otherwise
+    pars = dict(pop_size=5e3, pop_type='hybrid', n_days=60, verbose=0)
+    for trans_mode in ['layered', 'fused', 'hazard']:
+        ref, _ = sum_results(sc.mergedicts(pars, trans_mode=trans_mode))
+        infs, sim = sum_results(sc.mergedicts(pars, trans_mode=trans_mode), cliques=True)
+        if trans_mode == 'hazard':
+            assert infs == ref, f'Clique and explicit layers differ for {trans_mode}: {infs} vs. {ref}'
+        check_similar(infs, ref, f'Clique and explicit layers ({trans_mode})')
+
+    # Check that the clique layer has the same contacts as the explicit one, without storing the edges
+    layer = sim.people.contacts['h']
+    assert isinstance(layer, cv.CliqueLayer) and len(layer) == 0
+    orig = cv.Sim(pars, rand_seed=sim['rand_seed']).initialize().people.contacts['h']
+    edges = layer.to_layer()
+    assert len(edges) == len(orig)
+    inds = np.arange(0, sim['pop_size'], 5)
+    assert np.array_equal(layer.find_contacts(inds), orig.find_contacts(inds))
+
+    with pytest.raises(ValueError):
+        cv.Sim(pars).initialize(cliques='c')
+    with pytest.raises(ValueError):
+        cv.Sim(pars, n_days=10, interventions=cv.clip_edges(days=5, changes=0.5, layers='h')).initialize(cliques=True).run()
+
+    return sim
+
+
+def test_compact():
+    sc.heading('Test compact layers')
+
+    # Check that compact layers give the same results as regular ones when the edges are visited in the same order
+    pars = dict(pop_size=5e3, pop_type='hybrid', n_days=60, verbose=0)
+    for trans_mode in ['fused', 'hazard']:
+        s1 = cv.Sim(pars, trans_mode=trans_mode).run()
+        s2 = cv.Sim(pars, trans_mode=trans_mode)
+        s2.initialize(compact=True)
+        s2.run()
+        assert not cv.diff_sims(s1, s2, output=True), f'Compact and regular layers differ for {trans_mode}'
+
+    # Check that the default transmission gives similar results
+    ref, _ = sum_results(pars)
+    infs, sim = sum_results(pars, compact=True)
+    check_similar(infs, ref, 'Compact and regular layers')
+
+    # Check that the compact layers have the same edges and contacts, with a single beta and unsigned endpoints
+    orig = cv.Sim(pars, rand_seed=sim['rand_seed']).initialize().people.contacts
+    inds = np.arange(0, sim['pop_size'], 5)
+    for lkey,layer in sim.people.contacts.items():
+        assert isinstance(layer, cv.CompactLayer) and len(layer['p1']) == 0 and len(layer) == len(orig[lkey])
+        assert layer.adjacency.contacts.dtype == np.uint32 and len(layer.adjacency.beta) == 1
+        edges = layer.to_layer()
+        assert sorted(zip(*np.sort([edges['p1'], edges['p2']], axis=0).tolist())) == sorted(zip(*np.sort([orig[lkey]['p1'], orig[lkey]['p2']], axis=0).tolist()))
+        assert np.array_equal(layer.find_contacts(inds), orig[lkey].find_contacts(inds))
+
+    # Per-edge betas are kept
+    beta = np.random.random(len(orig['w']))
+    layer = cv.CompactLayer(p1=orig['w']['p1'], p2=orig['w']['p2'], beta=beta, n=sim['pop_size'])
+    assert np.isclose(layer.to_df()['beta'].sum(), beta.astype(np.float32).sum())
+    popped = layer.pop_inds(np.arange(0, len(beta), 3))
+    assert len(layer) == len(beta) - len(popped['p1'])
+    layer.append(popped)
+    assert len(layer) == len(beta) and np.isclose(layer.to_df()['beta'].sum(), beta.astype(np.float32).sum())
+
+    # Edges can be clipped and restored
+    ce = cv.clip_edges(days=[10, 20], changes=[0.5, 1.0], layers='w')
+    sim = cv.Sim(pars, n_days=30, interventions=ce)
+    sim.initialize(compact=True)
+    orig = sim.people.contacts['w'].get_edges()
+    sim.run(until=15)
+    assert len(sim.people.contacts['w']) == len(orig[0]) - int(0.5*len(orig[0]))
+    sim.run()
+    edges = sim.people.contacts['w'].get_edges()
+    assert sorted(zip(edges[0].tolist(), edges[1].tolist())) == sorted(zip(orig[0].tolist(), orig[1].tolist()))
+
+    with pytest.raises(ValueError):
+        cv.Sim(pars, dynam_layer={'c':1}).initialize(compact='c')
+
+    return sim
+
+
+def test_packed_states():
+    sc.heading('Test packed states')
+
+    # Check that results are identical with and without bit-packed states
+    for trans_mode in ['layered', 'hazard']:
+        sims = {packed_states:run_with_options(make_strain_sim(trans_mode=trans_mode), packed_states=packed_states) for packed_states in [False, True]}
+        assert not cv.diff_sims(sims[False], sims[True], output=True), f'Packed and regular states differ for {trans_mode}'
+
+    # Check that the states are stored as bits and behave like boolean arrays
+    sim = sims[True]
+    ppl = sim.people
+    for key in ppl.meta.states + ppl.meta.by_strain_states:
+        assert isinstance(ppl[key], cv.BitArray), f'State "{key}" is not packed'
+        assert np.array_equal(np.asarray(ppl[key]), np.asarray(sims[False].people[key]))
+    assert ppl.count('recovered') == sims[False].people.count('recovered')
+    assert np.array_equal(ppl.true('dead'), sims[False].people.true('dead'))
+    assert ppl.susceptible.nbytes*8 <= ppl.susceptible.size + 64
+
+    arr = cv.BitArray(np.zeros(100, dtype=bool))
+    inds = np.array([3, 64, 99])
+    arr[inds] = True
+    assert arr.count() == 3 and np.array_equal(arr.nonzero()[0], inds)
+    assert arr[64] and not arr[65] and (~arr).count() == 97
+    arr[64:] = False
+    assert np.array_equal(np.asarray(arr).nonzero()[0], [3])
+
+    return sim
+
+
+def test_int_dates():
+    sc.heading('Test integer dates')
+
+    # Check that results are identical with dates stored as floats and as integers
+    for prog_mode in ['exact', 'compiled']:
+        sims = {int_dates:run_with_options(make_strain_sim(prog_mode=prog_mode), int_dates=int_dates) for int_dates in [False, True]}
+        assert not cv.diff_sims(sims[False], sims[True], output=True), f'Integer and float dates differ for {prog_mode}'
+
+    # Check that the dates are stored as integers, with the same people defined
+    sim = sims[True]
+    for key in sim.people.meta.dates + sim.people.meta.durs:
+        assert sim.people[key].dtype == cv.defaults.date_int
+        assert np.array_equal(sim.people.defined(key), sims[False].people.defined(key))
+    assert sim.compute_gen_time() == sims[False].compute_gen_time()
+
+    return sim
+
+
+def test_event_calendar():
+    sc.heading('Test event calendar')
+
+    # Check that results are identical with and without the event calendar
+    results = {}
+    for event_calendar in [False, True]:
+        sim = run_with_options(make_strain_sim(pop_scale=4, rescale=True), event_calendar=event_calendar)
+        results[event_calendar] = sim.results
+
+    for key in ['cum_infections', 'cum_symptomatic', 'cum_severe', 'cum_deaths', 'cum_recoveries', 'cum_diagnoses', 'cum_quarantined', 'n_quarantined']:
+        assert np.array_equal(results[False][key].values, results[True][key].values), f'Results for "{key}" differ with the event calendar'
+    assert sim.people.calendar is not None
+
+    # Check that dates set directly are the same once scheduled, including for people who stop being exposed during the update
+    def set_dates(sim):
+        if sim.t == 15:
+            inds = cv.true(sim.people.infectious)[:20]
+            for key in ['date_dead', 'date_recovered']:
+                sim.people[key][inds] = sim.t
+                sim.people.schedule_events(key, inds)
+        return
+
+    for event_calendar in [False, True]:
+        sim = make_strain_sim()
+        sim['interventions'].append(set_dates)
+        results[event_calendar] = run_with_options(sim, event_calendar=event_calendar).results
+    for key in ['cum_deaths', 'cum_recoveries', 'n_exposed']:
+        assert np.array_equal(results[False][key].values, results[True][key].values), f'Results for "{key}" differ with the event calendar when dates are set directly'
+    assert results[True]['new_deaths'][16] >= 20
+
+    return sim
+
+
+def test_stock_counts():
+    sc.heading('Test stock counts')
+
+    # Check that the stock counts match a full recount on every timestep
+    pars = dict(pop_scale=4, rescale=True, frac_susceptible=0.9)
+    sim1 = make_strain_sim(vaccinate=True, **pars).run()
+    sim2 = run_with_options(make_strain_sim(vaccinate=True, **pars), stock_counts=True, check_counts=True)
+
+    # Check that states set directly are caught
+    cv.options.set(stock_counts=True)
+    try:
+        sim = make_strain_sim(n_days=5, **pars)
+        sim.run(until=2)
+        sim.people.exposed[:] = True
+        with pytest.raises(RuntimeError):
+            sim.people.check_counts()
+    finally:
+        cv.options.set(stock_counts='default')
+    assert sim2.results['n_vaccinated'][-1] > 0
+    assert sim1.summary == sim2.summary
+
+    # Check that states set directly by an intervention are counted by default
+    def recover(sim):
+        if sim.t == 10:
+            sim.people.recovered[:100] = True
+    sim = cv.Sim(pop_size=5e3, n_days=10, interventions=recover, verbose=0).run()
+    assert sim.results['n_recovered'][-1] == sim.people.count('recovered')
+
+    return sim
+
+
+def test_prog_mode():
+    sc.heading('Test compiled prognoses')
+
+    # Check that the compiled prognoses give similar outcomes to the default ones
+    pars = dict(pop_size=5e3, pop_type='hybrid', n_days=60, pop_infected=100, verbose=0)
+    keys = ['cum_infections', 'cum_symptomatic', 'cum_severe']
+    ref, _ = sum_results(sc.mergedicts(pars, prog_mode='exact'), keys=keys)
+    res, sim = sum_results(sc.mergedicts(pars, prog_mode='compiled'), keys=keys)
+    check_similar(res, ref, 'Compiled and exact prognoses')
+
+    # Check that the dates are consistent with the durations
+    ppl = sim.people
+    inds = ppl.defined('date_exposed')
+    assert np.array_equal(ppl.date_infectious[inds], ppl.date_exposed[inds] + ppl.dur_exp2inf[inds])
+    outcome = np.where(np.isnan(ppl.date_dead[inds]), ppl.date_recovered[inds], ppl.date_dead[inds])
+    assert np.allclose(outcome, ppl.date_exposed[inds] + ppl.dur_disease[inds])
+
+    with pytest.raises(ValueError):
+        cv.Sim(prog_mode='not_a_mode').initialize()
+    with pytest.raises(NotImplementedError):
+        cv.utils.get_dist_pars(dist='neg_binomial', par1=5, par2=1)
+
+    return sim
+
+
+def test_buffers():
+    sc.heading('Test scratch buffers')
+
+    # Check that once the buffers are allocated, stepping the sim allocates no more
+    pars = dict(pop_size=2e3, pop_type='hybrid', n_days=30, use_waning=True, verbose=0)
+    tp = cv.test_prob(symp_prob=0.1, asymp_prob=0.01)
+    tn = cv.test_num(daily_tests=50)
+    vx = cv.vaccinate(vaccine='pfizer', days=5, prob=0.1)
+    for trans_mode in ['layered', 'fused']:
+        sim = cv.Sim(pars, trans_mode=trans_mode, interventions=sc.dcp([tp, tn, vx]))
+        sim.run(until=10)
+        n_allocs = sim.people.buffers.n_allocs
+        assert n_allocs > 0
+        sim.run()
+        assert sim.people.buffers.n_allocs == n_allocs
+
+    # Check that each intervention has its own buffers
+    tp, tn = sim['interventions'][:2]
+    assert tp.get_buffer(sim, 'test_probs') is not tn.get_buffer(sim, 'test_probs')
+
+    # Check that the buffers are reused, and not saved
+    ppl = sim.people
+    arr = ppl.get_buffer('test', fill=3)
+    assert ppl.get_buffer('test') is arr and arr[0] == 3
+    assert ppl.get_buffer('test', dtype=bool) is not arr
+    assert len(sc.dcp(ppl).buffers) == 0
+
+    return sim
+
+
+def test_precision():
+    sc.heading('Test switching precision without reloading')
+
+    # Run sims with each precision in the same session, and check each uses its own data types
+    pars = dict(pop_size=2e3, pop_type='hybrid', n_days=30, verbose=0)
+    sims = {}
+    try:
+        for precision in [32, 64]:
+            cv.options.set(precision=precision)
+            sim = cv.Sim(pars, trans_mode='fused', prog_mode='compiled')
+            sim.initialize()
+            cv.options.set(precision=32) # Changing the precision afterwards doesn't affect sims that have already been created
+            sims[precision] = sim.run()
+    finally:
+        cv.options.set(precision='default')
+    assert sims[32].people.rel_trans.dtype == np.float32 and sims[32].people.contacts['h']['p1'].dtype == np.int32
+    assert sims[64].people.rel_trans.dtype == np.float64 and sims[64].people.contacts['h']['p1'].dtype == np.int64
+    assert cv.default_float == np.float32
+
+    # Check that 64-bit results are close to 32-bit ones, and that rerunning 32-bit gives identical results
+    sim = cv.Sim(pars, trans_mode='fused', prog_mode='compiled').run()
+    assert np.array_equal(sim.results['cum_infections'].values, sims[32].results['cum_infections'].values)
+    ratio = sims[64].results['cum_infections'][-1]/sims[32].results['cum_infections'][-1]
+    assert 0.5 < ratio < 2.0
+
+    with pytest.raises(NotImplementedError):
+        cv.options.set(precision=16)
+
+    return sims[64]
+
+
+
 #%% Run as a script
 if __name__ == '__main__':
 
@@ -142,12 +535,23 @@ if __name__ == '__main__':
     cv.options.set(interactive=do_plot)
     T = sc.tic()
 
-    pars = test_parsobj()
-    sim0 = test_microsim()
-    sim1 = test_sim(do_plot=do_plot, do_save=do_save)
-    json = test_fileio()
-    sim2 = test_sim_data(do_plot=do_plot)
-    sim3 = test_dynamic_resampling(do_plot=do_plot)
+    pars  = test_parsobj()
+    sim0  = test_microsim()
+    sim1  = test_sim(do_plot=do_plot, do_save=do_save)
+    json  = test_fileio()
+    sim2  = test_sim_data(do_plot=do_plot)
+    sim3  = test_dynamic_resampling(do_plot=do_plot)
+    sim4  = test_trans_mode()
+    sim5  = test_mass_action()
+    sim6  = test_cliques()
+    sim7  = test_compact()
+    sim8  = test_packed_states()
+    sim9  = test_int_dates()
+    sim10 = test_event_calendar()
+    sim11 = test_stock_counts()
+    sim12 = test_prog_mode()
+    sim13 = test_buffers()
+    sim14 = test_precision()
 
     sc.toc(T)
     print('Done.')
@@ -3,7 +3,9 @@ Tests of the numerical utilities for the model.
 '''
 
 #%% Imports and settings
+import os
 import pytest
+import tempfile
 import numpy as np
 import numba as nb
 import pylab as pl
@@ -53,6 +55,54 @@ def test_rand():
     return a
 
 
+def test_counter_random():
+    sc.heading('Counter-based random numbers')
+
+    # Check against the reference values for Philox4x32-10 (Random123 known-answer tests)
+    zero = np.uint64(0)
+    ones = np.uint64(0xFFFFFFFF)
+    assert cv.utils.philox(zero, zero, zero, zero, zero) == (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)
+    assert cv.utils.philox(np.uint64(2**64-1), ones, ones, ones, ones) == (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)
+
+    # Check that visiting the edges directly or via the neighbor index gives identical infections
+    np.random.seed(1)
+    n = 1000
+    n_edges = 10_000
+    layer = cv.Layer(p1=np.random.randint(n, size=n_edges), p2=np.random.randint(n, size=n_edges), beta=np.ones(n_edges))
+    rel_trans = np.array(np.random.rand(n) < 0.1, dtype=cv.default_float)
+    rel_sus   = np.array(np.random.rand(n) < 0.8, dtype=cv.default_float)
+    diag      = np.random.rand(n) < 0.1
+    quar      = np.random.rand(n) < 0.1
+    strains   = np.array(np.random.randint(2, size=n), dtype=cv.default_int)
+    beta      = np.array([0.3, 0.5], dtype=cv.default_float)
+    sus_imm   = np.zeros((2, n), dtype=cv.default_float)
+    factors   = [cv.default_float(f) for f in [1.0, 0.5, 0.5]]
+    rng       = [np.uint64(v) for v in [1, 2, 3]]
+    args = (layer['beta'], *factors, rel_trans, rel_sus, diag, quar, strains, beta, sus_imm, *rng)
+    edge_infs = cv.utils.compute_infections_counter(layer['p1'], layer['p2'], *args)
+    index = layer.make_index(n)
+    index_infs = cv.utils.compute_infections_index_counter(index.indptr, index.slots, layer['p1'], layer['p2'], cv.true(rel_trans), *args)
+    order = np.argsort(index_infs[-1])
+    assert len(edge_infs[0])
+    for a,b in zip(edge_infs, index_infs):
+        assert np.array_equal(a, b[order])
+
+    # Check that the ensemble calculation gives the same infections for each replicate
+    reps = [rel_trans, rel_trans[::-1].copy()]
+    inf_inds = [cv.true(r) for r in reps]
+    inf_ptr = np.cumsum([0] + [len(inds) for inds in inf_inds])
+    stack = lambda arr: np.array([arr, arr])
+    ens_args = (layer['beta'], *[stack(f) for f in factors], np.array(reps), stack(rel_sus), stack(diag), stack(quar), stack(strains), stack(beta), stack(sus_imm), stack(rng[0]), *rng[1:])
+    ens_infs = cv.utils.compute_infections_ensemble(index.indptr, index.slots, layer['p1'], layer['p2'], np.concatenate(inf_inds), inf_ptr, *ens_args)
+    for r in range(2):
+        args = (layer['beta'], *factors, reps[r], rel_sus, diag, quar, strains, beta, sus_imm, *rng)
+        rep_infs = cv.utils.compute_infections_index_counter(index.indptr, index.slots, layer['p1'], layer['p2'], inf_inds[r], *args)
+        for a,b in zip(rep_infs, ens_infs[1:]):
+            assert np.array_equal(a, b[ens_infs[0] == r])
+
+    return edge_infs
+
+
 def test_poisson():
     sc.heading('Poisson distribution')
     s1 = cv.poisson_test(10, 10)
@@ -225,9 +275,29 @@ def test_indexing():
     assert cv.idefinedi(darr, inds2).tolist()   == [2,4]
     assert cv.iundefinedi(darr, inds2).tolist() == [1,3]
 
+    # Test with dates stored as integers
+    iarr = np.array(np.nan_to_num(darr, nan=cv.defaults.date_nan), dtype=cv.defaults.date_int)
+    assert cv.defined(iarr).tolist()   == [0,2,4]
+    assert cv.iundefinedi(iarr, inds2).tolist() == [1,3]
+    assert np.array_equal(cv.utils.to_float(iarr), darr, equal_nan=True)
+    assert cv.utils.nan_value(iarr) == cv.defaults.date_nan and np.isnan(cv.utils.nan_value(darr))
+
     return
 
 
+def test_strain_counts():
+    sc.heading('Strain counts')
+
+    strains = np.array([0,-1,2,1,0,2,-1,0], dtype=cv.defaults.strain_int)
+    inds = np.arange(1, len(strains), dtype=np.int64) # Skip the first person
+    counts = cv.utils.count_strains(strains, inds, 4)
+    ptr, grouped = cv.utils.group_strains(strains, inds, 4)
+    assert counts.tolist() == [2,1,2,0]
+    assert ptr.tolist() == [0,2,3,5,5]
+    assert grouped.tolist() == [4,7,3,2,5]
+    return grouped
+
+
 def test_doubling_time():
 
     sim = cv.Sim(pop_size=1000)
@@ -249,6 +319,54 @@ def test_doubling_time():
     return d
 
 
+def test_precompile():
+    sc.heading('Testing precompiling into a separate Numba cache')
+
+    # Functions in this process have either been compiled or loaded from the cache
+    report = cv.cache_report(output=True)
+    assert report['compute_viral_load']['status'] in ['cached', 'compiled', 'not compiled']
+    assert set(report.keys()) >= {'compute_infections', 'choose', '_n_poisson'}
+
+    # Compiling into an empty folder compiles everything, and compiling again reuses it
+    with tempfile.TemporaryDirectory() as cache_dir:
+        first  = cv.precompile(cache_dir=cache_dir)
+        second = cv.precompile(cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir))
+    for key in ['compute_infections', 'compute_viral_load', 'choose']:
+        assert first[key]['status'] == 'compiled'
+        assert second[key]['status'] == 'cached'
+        assert second[key]['signatures'] == 2 # Both precisions
+
+    return second
+
+
+def test_headless_njit():
+    sc.heading('Testing deferring compiling Numba functions')
+
+    def add(x, y):
+        return x + y
+
+    # With cv.options.headless, njit() compiles the functions when compile_lazy() is called, e.g. by the first sim
+    sig = (cv.utils.nbfloat[:], cv.utils.nbfloat)
+    cv.options.set(headless=True)
+    try:
+        lazy = cv.utils.njit(sig)(add)
+    finally:
+        cv.options.set(headless='default')
+    assert len(lazy.signatures) == 0 and cv.utils.lazy_kernels[lazy]
+    cv.utils.compile_lazy()
+    assert set(lazy.signatures) == {sig, cv.utils.widen_signature(sig)} and lazy not in cv.utils.lazy_kernels
+
+    # Other types are converted rather than compiled, as for nb.njit(), including from Numba
+    arr = np.arange(3.0)
+    assert lazy(arr, 1).tolist() == [1, 2, 3]
+    call_lazy = nb.njit(lambda x, y: lazy(x, y))
+    assert call_lazy(arr.astype(np.float32), 1.0).tolist() == [1, 2, 3]
+    assert len(lazy.signatures) == 2
+
+    return lazy
+
+
 #%% Run as a script
 if __name__ == '__main__':
 
@@ -258,11 +376,15 @@ if __name__ == '__main__':
 
     rnd1    = test_rand()
     rnd2    = test_poisson()
+    infs    = test_counter_random()
     samples = test_samples(do_plot=do_plot)
     people1 = test_choose()
     people2 = test_choose_w()
     inds    = test_indexing()
+    groups  = test_strain_counts()
     dt      = test_doubling_time()
+    report  = test_precompile()
+    lazy    = test_headless_njit()
 
     print('\n'*2)
     sc.toc(T)